@@ -0,0 +1 @@
+"""Gerador de dados sintéticos e benchmark por etapa do pipeline (ver benchmarks.run)."""
@@ -0,0 +1,66 @@
+"""
+Compara dois resultados do benchmark (JSON de benchmarks.run).
+
+    python -m benchmarks.compare atual.json baseline.json [--tolerancia 0.2]
+
+Sai com código 1 se alguma etapa ficar mais lenta (ou usar mais memória) que
+a baseline além da tolerância.
+"""
+from __future__ import annotations
+import argparse
+import json
+import sys
+from pathlib import Path
+from typing import Dict, List
+
+METRICS = ["seconds", "peak_rss_mb"]
+
+
+def compare(current: dict, baseline: dict, tolerance: float = 0.2) -> List[Dict]:
+    """Uma linha por etapa/métrica presente nos dois resultados, com a razão atual/baseline."""
+    rows = []
+    for name, cur in current["stages"].items():
+        base = baseline.get("stages", {}).get(name)
+        if base is None:
+            continue
+        for metric in METRICS:
+            a, b = cur.get(metric), base.get(metric)
+            if a is None or not b:
+                continue
+            ratio = a / b
+            rows.append({
+                "stage": name,
+                "metric": metric,
+                "baseline": b,
+                "current": a,
+                "ratio": round(ratio, 3),
+                "regression": ratio > 1 + tolerance,
+            })
+    return rows
+
+
+def print_table(rows: List[Dict]):
+    print(f"{'etapa':<28} {'métrica':<12} {'baseline':>10} {'atual':>10} {'razão':>7}")
+    for r in rows:
+        flag = "  <-- piorou" if r["regression"] else ""
+        print(f"{r['stage']:<28} {r['metric']:<12} {r['baseline']:>10.3f} {r['current']:>10.3f} {r['ratio']:>7.2f}{flag}")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Compara um resultado do benchmark com a baseline.")
+    parser.add_argument("atual", type=Path)
+    parser.add_argument("baseline", type=Path)
+    parser.add_argument("--tolerancia", type=float, default=0.2, help="piora aceita (0.2 = 20%%)")
+    args = parser.parse_args(argv)
+
+    current = json.loads(args.atual.read_text(encoding="utf-8"))
+    baseline = json.loads(args.baseline.read_text(encoding="utf-8"))
+    if current.get("params") != baseline.get("params"):
+        print(f"Aviso: parâmetros diferentes ({current.get('params')} vs {baseline.get('params')})")
+    rows = compare(current, baseline, args.tolerancia)
+    print_table(rows)
+    return 1 if any(r["regression"] for r in rows) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
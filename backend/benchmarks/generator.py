@@ -0,0 +1,143 @@
+from __future__ import annotations
+from pathlib import Path
+from typing import Dict, Tuple
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+CHUNK_ROWS = 1_000_000
+
+# Mapeamento (formato do front) para as colunas geradas abaixo
+MAPPING = {
+    "benef_mapping": {
+        "identifier": ["CPF"],
+        "data_inclusao": "Data Inclusao",
+        "data_inativacao": "Data Inativacao",
+        "sexo": "Sexo",
+        "nascimento": "Data Nascimento",
+    },
+    "ficha_mapping": {
+        "identifier": ["id_pessoa"],
+        "atendimento": "Data Atendimento",
+        "custos": "Valor Pago",
+        "qtde_usada": "Qtde Usada",
+        "agrupamento_assistencial": "Agrupamento Assistencial",
+        "codigo_servico": "Codigo Servico",
+        "descricao_servico": "Descricao Servico",
+        "idade": "Idade",
+    },
+}
+ULTIMA_COMP_REF = "2024-12-31"
+
+AGRUPAMENTOS = ["CONSULTA", "EXAME", "TERAPIA", "INTERNACAO", "PRONTO SOCORRO", "OUTROS"]
+AGRUPAMENTOS_P = [0.35, 0.30, 0.12, 0.05, 0.10, 0.08]
+N_SERVICOS = 2_000
+
+_INICIO = pd.Timestamp("2017-01-01")
+_DIAS = (pd.Timestamp(ULTIMA_COMP_REF) - _INICIO).days + 1
+
+
+def _dates_br(days: np.ndarray, missing: np.ndarray | None = None) -> np.ndarray:
+    """Dias desde _INICIO -> 'dd/mm/aaaa' (formata só os dias distintos)."""
+    uniq, inv = np.unique(days, return_inverse=True)
+    text = (_INICIO + pd.to_timedelta(uniq, unit="D")).strftime("%d/%m/%Y").to_numpy(dtype=object)
+    out = text[inv]
+    if missing is not None:
+        out[missing] = None
+    return out
+
+
+def _money_br(values: np.ndarray, rng: np.random.Generator) -> np.ndarray:
+    """Valores em reais no formato '1.234,56', às vezes com 'R$ ' na frente."""
+    cents = np.round(values * 100).astype("int64")
+    reais = pd.Series(cents // 100).astype(str).str.replace(r"\B(?=(\d{3})+(?!\d))", ".", regex=True)
+    text = (reais + "," + pd.Series(cents % 100).astype(str).str.zfill(2)).to_numpy(dtype=object, copy=True)
+    prefixed = rng.random(len(text)) < 0.1
+    text[prefixed] = "R$ " + text[prefixed]
+    return text
+
+
+def _life_ids(n_lives: int, seed: int) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    ids = rng.choice(10**11 - 10**10, size=n_lives, replace=False) + 10**10
+    return ids.astype(str).astype(object)
+
+
+def generate_beneficiarios(n_lives: int, seed: int = 0, chunk_rows: int = CHUNK_ROWS):
+    """Gera a base de beneficiários em blocos (DataFrames só de texto, como no upload)."""
+    ids = _life_ids(n_lives, seed)
+    rng = np.random.default_rng(seed + 1)
+    for start in range(0, n_lives, chunk_rows):
+        n = min(chunk_rows, n_lives - start)
+        inc = rng.integers(0, _DIAS - 30, n)
+        inat = inc + rng.integers(15, 1_500, n)
+        yield pd.DataFrame({
+            "CPF": ids[start:start + n],
+            "Data Inclusao": _dates_br(inc, missing=rng.random(n) < 0.03),
+            "Data Inativacao": _dates_br(np.minimum(inat, _DIAS - 1), missing=rng.random(n) >= 0.25),
+            "Sexo": rng.choice(np.array(["M", "F", "Masculino", "Feminino", None], dtype=object), n, p=[0.3, 0.3, 0.18, 0.18, 0.04]),
+            "Data Nascimento": (pd.Timestamp("1935-01-01") + pd.to_timedelta(rng.integers(0, 30_000, n), unit="D")).strftime("%d/%m/%Y").to_numpy(dtype=object),
+        })
+
+
+def generate_ficha(n_lives: int, n_events: int, seed: int = 0, chunk_rows: int = CHUNK_ROWS):
+    """
+    Gera a ficha financeira em blocos. A utilização por vida é assimétrica
+    (poucas vidas concentram muitos eventos), os custos seguem uma lognormal
+    por agrupamento e ~0,5% dos eventos têm id que não existe no benef.
+    """
+    ids = _life_ids(n_lives, seed)
+    rng = np.random.default_rng(seed + 2)
+    weights = rng.lognormal(0, 1.2, n_lives)
+    weights /= weights.sum()
+    servicos = np.array([f"{10_000_000 + i * 37}" for i in range(N_SERVICOS)], dtype=object)
+    descricoes = np.array([f"PROCEDIMENTO {i:04d}" for i in range(N_SERVICOS)], dtype=object)
+    custo_mu = np.array([4.5, 4.0, 4.8, 8.0, 5.5, 4.2])
+    idades = np.array([str(i) for i in range(100)], dtype=object)
+    for start in range(0, n_events, chunk_rows):
+        n = min(chunk_rows, n_events - start)
+        who = ids[rng.choice(n_lives, n, p=weights)]
+        unknown = rng.random(n) < 0.005
+        who[unknown] = (rng.integers(10**10, 10**11, unknown.sum())).astype(str)
+        agr = rng.choice(len(AGRUPAMENTOS), n, p=AGRUPAMENTOS_P)
+        serv = (rng.zipf(1.3, n) - 1) % N_SERVICOS
+        idade = idades[rng.integers(0, 100, n)]
+        idade[rng.random(n) < 0.05] = None
+        yield pd.DataFrame({
+            "id_pessoa": who,
+            "Data Atendimento": _dates_br(rng.integers(0, _DIAS, n)),
+            "Valor Pago": _money_br(rng.lognormal(custo_mu[agr], 1.3), rng),
+            "Qtde Usada": rng.choice(np.array(["1", "1", "1", "2", "3", "10", None], dtype=object), n),
+            "Agrupamento Assistencial": np.array(AGRUPAMENTOS, dtype=object)[agr],
+            "Codigo Servico": servicos[serv],
+            "Descricao Servico": descricoes[serv],
+            "Idade": idade,
+        })
+
+
+def _write(chunks, dest: Path) -> Tuple[int, int]:
+    tmp = dest.with_suffix(dest.suffix + ".tmp")
+    writer = None
+    rows = 0
+    for chunk in chunks:
+        if writer is None:
+            schema = pa.schema([(c, pa.string()) for c in chunk.columns])
+            writer = pq.ParquetWriter(tmp, schema)
+        writer.write_table(pa.Table.from_pandas(chunk, schema=schema, preserve_index=False))
+        rows += len(chunk)
+    writer.close()
+    tmp.replace(dest)
+    return rows, len(schema)
+
+
+def write_inputs(paths: Dict[str, Path], n_lives: int, n_events: int, seed: int = 0) -> Dict[str, Tuple[int, int]]:
+    """
+    Grava beneficiarios/ficha nos caminhos dados (mesmo formato do upload:
+    Parquet só de texto, um row group por bloco). Retorna {nome: (linhas, colunas)}.
+    """
+    return {
+        "beneficiarios": _write(generate_beneficiarios(n_lives, seed), Path(paths["beneficiarios"])),
+        "ficha": _write(generate_ficha(n_lives, n_events, seed), Path(paths["ficha"])),
+    }
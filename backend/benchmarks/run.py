@@ -0,0 +1,215 @@
+"""
+Benchmark por etapa do pipeline de análise e da consulta de resultados.
+
+    cd backend
+    python -m benchmarks.run --vidas 10000 --eventos 100000 --seed 42 --saida bench.json
+    python -m benchmarks.run --vidas 10000 --eventos 100000 --baseline bench.json
+
+Gera a base sintética (benchmarks.generator) num diretório de trabalho
+temporário, roda cada etapa de run_analysis separadamente e as rotas de
+resultados e de opções de filtro, e grava tempo (wall e CPU), pico de RSS e linhas de cada etapa em JSON.
+"""
+from __future__ import annotations
+import argparse
+import asyncio
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Dict
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from benchmarks.generator import MAPPING, ULTIMA_COMP_REF, write_inputs
+from benchmarks.compare import compare, print_table
+
+PROJECT_ID = "benchmark"
+ROUND_ID = "R1"
+
+# Combinações de filtros usadas na rota de resultados
+RESULT_QUERIES = [
+    {"periodo": "dentro", "momentoZero": False, "janela": 24, "grupos": None, "agrupamento_assistencial": None},
+    {"periodo": "ambos", "momentoZero": True, "janela": 12, "grupos": None, "agrupamento_assistencial": ["EXAME", "CONSULTA"]},
+    {"periodo": "fora", "momentoZero": False, "janela": 6, "grupos": ["TP_12", "TP_24", "TP_36"], "agrupamento_assistencial": None},
+]
+
+
+def _rows(out: Any) -> int | None:
+    if isinstance(out, pd.DataFrame):
+        return int(len(out))
+    if isinstance(out, tuple):
+        return sum(_rows(o) or 0 for o in out)
+    return None
+
+
+def _git_commit() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+                              cwd=Path(__file__).resolve().parent).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmark(n_lives: int, n_events: int, seed: int = 0) -> Dict[str, Any]:
+    """Roda o benchmark no diretório atual (que recebe o storage/) e retorna o resultado."""
+    # Importados aqui: o store usa caminho relativo ao diretório de trabalho
+    from database import store
+    from pipeline import sanitize_map
+    from src.schema import type_inputs
+    from src.mapping import apply_mapping
+    from src.compute import (build_id_index, consolidate, compute_tempo_programa, compute_ultima_competencia_ref,
+                             compute_momento_mes, compute_demographics)
+    from src.metrics import ensure_numeric_cols, pivot_antes_depois
+    from src.cube import build_results_cube, build_filter_options
+    from src.prediction import calculate_linear_trend
+    from src.outliers import detect_outliers_user_cost
+    from src.profiling import reset_peak_rss, peak_rss_bytes
+    import main as api
+
+    stages: Dict[str, Dict[str, Any]] = {}
+
+    def measure(name: str, fn: Callable, *args, **kwargs):
+        reset_peak_rss()
+        t0, c0 = time.perf_counter(), time.process_time()
+        out = fn(*args, **kwargs)
+        peak = peak_rss_bytes()
+        stages[name] = {
+            "seconds": round(time.perf_counter() - t0, 4),
+            "cpu_seconds": round(time.process_time() - c0, 4),
+            "peak_rss_mb": None if peak is None else round(peak / 2**20, 1),
+            "rows": _rows(out),
+        }
+        print(f"  {name:<28} {stages[name]['seconds']:>9.3f}s {stages[name]['peak_rss_mb'] or 0:>9.1f} MB", flush=True)
+        return out
+
+    project_id = store.create_project(PROJECT_ID)
+    store.create_round(project_id, name=ROUND_ID)
+    paths = store.input_paths(project_id, ROUND_ID)
+    shapes = measure("generate_inputs", write_inputs, paths, n_lives, n_events, seed)
+    store.register_inputs(project_id, ROUND_ID, shapes)
+    store.save_config(project_id, ROUND_ID, mapping=MAPPING, analysis_config={"ultima_comp_ref": ULTIMA_COMP_REF})
+
+    b_map, f_map = MAPPING["benef_mapping"], MAPPING["ficha_mapping"]
+    clean_b, clean_f = sanitize_map(b_map), sanitize_map(f_map)
+    id_benef, id_ficha = b_map["identifier"][0], f_map["identifier"][0]
+    ultima_ref = compute_ultima_competencia_ref(pd.Timestamp(ULTIMA_COMP_REF))
+
+    def load_both():
+        return pd.read_parquet(paths["beneficiarios"]), pd.read_parquet(paths["ficha"])
+
+    def both(fn, pair):
+        return fn(pair[0], clean_b), fn(pair[1], clean_f)
+
+    # Mesmas etapas (e ordem) do pipeline.run_pipeline, sem o cache de etapas
+    raw = measure("load_inputs", load_both)
+    typed = measure("type_inputs", both, type_inputs, raw)
+    del raw
+    benef, ficha = measure("apply_mapping", both, apply_mapping, typed)
+    del typed
+    benef = measure("compute_tempo_programa", compute_tempo_programa, benef, ultima_ref)
+    index = measure("build_id_index", build_id_index, benef[id_benef], ficha[id_ficha])
+    merged = measure("consolidate", consolidate, benef, ficha, id_benef, id_ficha, index=index)
+    del benef, ficha
+    merged["identifier"] = merged["__id__"]
+    merged = measure("compute_demographics", compute_demographics, merged, ultima_ref)
+    merged = measure("compute_momento_mes", compute_momento_mes, merged)
+    merged = measure("ensure_numeric_cols", ensure_numeric_cols, merged)
+    measure("pivot_antes_depois", pivot_antes_depois, merged, base_total_users=merged["identifier"].nunique(), id_col="identifier")
+    trend = measure("calculate_linear_trend", calculate_linear_trend, merged[merged["momento_mes"] > 0])
+    outliers = measure("detect_outliers_user_cost", detect_outliers_user_cost, merged)
+    cube = measure("build_results_cube", build_results_cube, merged)
+    filter_options = measure("build_filter_options", build_filter_options, merged)
+    measure("save_outputs", store.save_outputs, project_id, ROUND_ID,
+            consolidated_df=merged, outliers_df=outliers, trend_json=trend, cube=cube, filter_options=filter_options)
+    del merged
+
+    def query_all():
+        return [asyncio.run(api.get_results(project_id, ROUND_ID, **q)) for q in RESULT_QUERIES]
+
+    # 1ª chamada lê do disco e calcula; a 2ª sai do cache de respostas em memória
+    measure("get_results_cold", query_all)
+    measure("get_results_warm", query_all)
+
+    def filter_options_route():
+        return asyncio.run(api.get_filter_options(project_id, ROUND_ID))
+
+    # Dicionário dos filtros gravado com os outputs
+    measure("get_filter_options", filter_options_route)
+
+    # Caminho sem cubo nem dicionário (rodadas antigas): mesma base, sem os
+    # arquivos cube_*.parquet e filter_options.json
+    outputs = store.output_dir(project_id, ROUND_ID)
+    for f in [*outputs.glob("cube_*.parquet"), outputs / "filter_options.json"]:
+        f.unlink()
+    store.outputs_cache.invalidate(project_id)
+    store.results_cache.invalidate(project_id)
+    measure("get_results_fallback", query_all)
+    measure("get_filter_options_fallback", filter_options_route)
+
+    return {
+        "params": {"vidas": n_lives, "eventos": n_events, "seed": seed},
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "git_commit": _git_commit(),
+        "env": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "pandas": pd.__version__,
+            "numpy": np.__version__,
+            "pyarrow": pa.__version__,
+        },
+        "stages": stages,
+        "total_seconds": round(sum(s["seconds"] for name, s in stages.items() if name != "generate_inputs"), 3),
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark por etapa do pipeline de análise.")
+    parser.add_argument("--vidas", type=int, default=10_000, help="linhas de beneficiários")
+    parser.add_argument("--eventos", type=int, default=100_000, help="linhas da ficha financeira (até 50M)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--saida", type=Path, default=None, help="JSON de resultado (padrão: bench_<vidas>_<eventos>.json)")
+    parser.add_argument("--baseline", type=Path, default=None, help="JSON de uma execução anterior para comparar")
+    parser.add_argument("--tolerancia", type=float, default=0.2)
+    parser.add_argument("--workdir", type=Path, default=None, help="diretório de trabalho (padrão: temporário, apagado no fim)")
+    args = parser.parse_args(argv)
+
+    out_path = (args.saida or Path(f"bench_{args.vidas}_{args.eventos}.json")).resolve()
+    baseline_path = args.baseline.resolve() if args.baseline else None
+    backend_dir = str(Path(__file__).resolve().parent.parent)
+    if backend_dir not in sys.path:
+        sys.path.insert(0, backend_dir)
+
+    workdir = args.workdir or Path(tempfile.mkdtemp(prefix="bench_analise_"))
+    workdir.mkdir(parents=True, exist_ok=True)
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        print(f"Benchmark: {args.vidas} vidas, {args.eventos} eventos (seed {args.seed}) em {workdir}")
+        result = run_benchmark(args.vidas, args.eventos, args.seed)
+    finally:
+        os.chdir(cwd)
+        if args.workdir is None:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    out_path.write_text(json.dumps(result, indent=2, ensure_ascii=False), encoding="utf-8")
+    print(f"Total: {result['total_seconds']}s -> {out_path}")
+
+    if baseline_path:
+        baseline = json.loads(baseline_path.read_text(encoding="utf-8"))
+        rows = compare(result, baseline, args.tolerancia)
+        print_table(rows)
+        return 1 if any(r["regression"] for r in rows) else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -5,6 +5,12 @@ import json
 import uuid
 import hashlib
 import shutil
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from contextlib import contextmanager
 from json import JSONDecodeError
 from dataclasses import dataclass
 from datetime import datetime
@@ -12,6 +18,13 @@ from pathlib import Path
 from typing import Optional, Dict, Any, List
 
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+try:
+    import fcntl
+except ImportError:  # Windows: a trava da rodada vale só dentro do processo
+    fcntl = None
 
 
 def _now_iso() -> str:
@@ -90,6 +103,358 @@ def _write_json(path, obj):
             json.dump(obj, f, ensure_ascii=False, indent=2, default=_json_default)
 
 
+def _frame_nbytes(obj) -> int:
+    if isinstance(obj, pd.DataFrame):
+        return int(obj.memory_usage(index=True, deep=True).sum())
+    return 0
+
+
+class OutputsCache:
+    """Cache LRU (em memória) dos outputs carregados de cada rodada.
+
+    A chave é (projeto, rodada, tipo, assinatura, ...) e a assinatura inclui o
+    mtime/tamanho dos arquivos de output, então um arquivo
+    regravado nunca é servido do cache. O total mantido é limitado por
+    `max_bytes`. Os DataFrames devolvidos são compartilhados: quem chama não
+    deve alterá-los in-place.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._items: "OrderedDict[tuple, tuple[Any, int]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: tuple):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return item[0]
+
+    def put(self, key: tuple, value: Any, nbytes: int):
+        with self._lock:
+            # Outras versões do mesmo output da rodada ficaram obsoletas
+            for k in [k for k in self._items if k[:3] == key[:3] and k[3] != key[3]]:
+                del self._items[k]
+            if nbytes > self.max_bytes:
+                return
+            self._items[key] = (value, nbytes)
+            while self._total_bytes() > self.max_bytes:
+                self._items.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, project_id: str, round_id: Optional[str] = None):
+        with self._lock:
+            for k in list(self._items):
+                if k[0] == project_id and (round_id is None or k[1] == round_id):
+                    del self._items[k]
+
+    def _total_bytes(self) -> int:
+        return sum(nbytes for _, nbytes in self._items.values())
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._items),
+                "bytes": self._total_bytes(),
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": (self.hits / total) if total else 0.0,
+            }
+
+
+class SingleFlight:
+    """
+    Chamadas simultâneas com a mesma chave executam a função uma única vez: a
+    primeira calcula e as demais esperam e recebem o mesmo resultado (ou erro).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[Any, Future] = {}
+
+    def do(self, key, fn):
+        with self._lock:
+            fut = self._calls.get(key)
+            leader = fut is None
+            if leader:
+                fut = self._calls[key] = Future()
+        if not leader:
+            return fut.result()
+        try:
+            result = fn()
+        except BaseException as e:
+            fut.set_exception(e)
+            raise
+        else:
+            fut.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+
+
+class StageCache:
+    """
+    Cache em disco, endereçado por conteúdo, dos resultados intermediários do pipeline.
+
+    Cada entrada fica em `<root>/<etapa>/<chave>.parquet`, onde a chave é o hash
+    dos hashes de entrada + campos de configuração da etapa. Como não depende de
+    projeto/rodada, é reaproveitado entre rodadas e projetos com os mesmos dados.
+    Acima de `max_bytes`, as entradas usadas há mais tempo são removidas.
+    """
+
+    def __init__(self, root: Path, max_bytes: int):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+
+    @staticmethod
+    def key(*parts) -> str:
+        payload = json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _path(self, stage: str, key: str) -> Path:
+        return self.root / stage / f"{key}.parquet"
+
+    def load(self, stage: str, key: Optional[str]) -> Optional[pd.DataFrame]:
+        if not key:
+            return None
+        path = self._path(stage, key)
+        try:
+            df = pq.read_table(path).to_pandas(date_as_object=False)
+        except (FileNotFoundError, OSError):
+            return None
+        os.utime(path)  # marca como usado (LRU do prune)
+        return df
+
+    def save(self, stage: str, key: Optional[str], table) -> None:
+        """Grava um DataFrame ou pyarrow.Table na entrada (stage, key)."""
+        if not key:
+            return
+        if isinstance(table, pd.DataFrame):
+            table = pa.Table.from_pandas(table, preserve_index=False)
+        path = self._path(stage, key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(f".{uuid.uuid4().hex}.tmp")
+        pq.write_table(table, tmp)
+        os.replace(tmp, path)
+        self.prune()
+
+    def prune(self):
+        files = [(f.stat().st_mtime, f.stat().st_size, f) for f in self.root.glob("*/*.parquet")]
+        total = sum(size for _, size, _ in files)
+        for _, size, f in sorted(files):
+            if total <= self.max_bytes:
+                break
+            f.unlink(missing_ok=True)
+            total -= size
+
+
+class MetadataDB:
+    """
+    Metadados de projetos e rodadas em SQLite (modo WAL), no lugar do index.json.
+
+    Cada alteração é uma transação curta (BEGIN IMMEDIATE), então a API e os
+    processos dos jobs podem gravar ao mesmo tempo sem perder atualizações. O
+    dicionário completo de cada item fica em `data` (JSON); status e datas
+    também ficam em colunas próprias, indexadas, para listar e paginar.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS projects (
+            project_id TEXT PRIMARY KEY,
+            status TEXT NOT NULL DEFAULT 'Rascunho',
+            created_at TEXT,
+            updated_at TEXT,
+            data TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS ix_projects_status ON projects (status, updated_at);
+        CREATE INDEX IF NOT EXISTS ix_projects_updated ON projects (updated_at);
+        CREATE TABLE IF NOT EXISTS rounds (
+            project_id TEXT NOT NULL,
+            round_id TEXT NOT NULL,
+            created_at TEXT,
+            updated_at TEXT,
+            data TEXT NOT NULL,
+            PRIMARY KEY (project_id, round_id)
+        );
+        CREATE INDEX IF NOT EXISTS ix_rounds_updated ON rounds (project_id, updated_at);
+        CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+    """
+
+    ORDERS = {"created_at": "rowid", "updated_at": "updated_at"}
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._local = threading.local()
+        self._conn().executescript(self.SCHEMA)
+
+    def _conn(self) -> sqlite3.Connection:
+        # Uma conexão por thread (os endpoints síncronos rodam no threadpool do FastAPI)
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def transaction(self):
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    @staticmethod
+    def _dumps(obj: Dict[str, Any]) -> str:
+        return json.dumps(obj, ensure_ascii=False, default=_json_default)
+
+    # --- projetos ---
+    def upsert_project(self, meta: Dict[str, Any], conn: Optional[sqlite3.Connection] = None):
+        (conn or self._conn()).execute(
+            "INSERT INTO projects (project_id, status, created_at, updated_at, data) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT (project_id) DO UPDATE SET status = excluded.status, "
+            "updated_at = excluded.updated_at, data = excluded.data",
+            (meta["project_id"], meta.get("status") or "Rascunho", meta.get("created_at"), meta.get("updated_at"), self._dumps(meta)),
+        )
+
+    def update_project(self, project_id: str, **fields) -> Optional[Dict[str, Any]]:
+        """Atualiza campos do projeto (leitura e escrita na mesma transação)."""
+        with self.transaction() as conn:
+            row = conn.execute("SELECT data FROM projects WHERE project_id = ?", (project_id,)).fetchone()
+            if row is None:
+                return None
+            meta = json.loads(row[0])
+            meta.update(fields)
+            self.upsert_project(meta, conn)
+            return meta
+
+    def get_project(self, project_id: str) -> Optional[Dict[str, Any]]:
+        row = self._conn().execute("SELECT data FROM projects WHERE project_id = ?", (project_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def list_projects(self, limit: Optional[int] = None, offset: int = 0, status: Optional[str] = None,
+                      order: str = "created_at", descending: bool = False) -> List[Dict[str, Any]]:
+        sql = "SELECT data FROM projects"
+        params: list = []
+        if status:
+            sql += " WHERE status = ?"
+            params.append(status)
+        sql += f" ORDER BY {self.ORDERS[order]} {'DESC' if descending else 'ASC'}, rowid"
+        if limit is not None or offset:
+            sql += " LIMIT ? OFFSET ?"
+            params += [-1 if limit is None else int(limit), int(offset)]
+        return [json.loads(data) for (data,) in self._conn().execute(sql, params)]
+
+    def count_projects(self, status: Optional[str] = None) -> int:
+        if status:
+            return self._conn().execute("SELECT COUNT(*) FROM projects WHERE status = ?", (status,)).fetchone()[0]
+        return self._conn().execute("SELECT COUNT(*) FROM projects").fetchone()[0]
+
+    def delete_project(self, project_id: str) -> bool:
+        with self.transaction() as conn:
+            deleted = conn.execute("DELETE FROM projects WHERE project_id = ?", (project_id,)).rowcount
+            conn.execute("DELETE FROM rounds WHERE project_id = ?", (project_id,))
+        return deleted > 0
+
+    # --- rodadas ---
+    def upsert_round(self, meta: Dict[str, Any], conn: Optional[sqlite3.Connection] = None):
+        (conn or self._conn()).execute(
+            "INSERT INTO rounds (project_id, round_id, created_at, updated_at, data) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT (project_id, round_id) DO UPDATE SET updated_at = excluded.updated_at, data = excluded.data",
+            (meta["project_id"], meta["round_id"], meta.get("created_at"), meta.get("updated_at"), self._dumps(meta)),
+        )
+
+    def update_round(self, project_id: str, round_id: str, **fields) -> Optional[Dict[str, Any]]:
+        with self.transaction() as conn:
+            row = conn.execute("SELECT data FROM rounds WHERE project_id = ? AND round_id = ?", (project_id, round_id)).fetchone()
+            if row is None:
+                return None
+            meta = json.loads(row[0])
+            meta.update(fields)
+            self.upsert_round(meta, conn)
+            return meta
+
+    def list_rounds(self, project_id: str) -> List[Dict[str, Any]]:
+        rows = self._conn().execute("SELECT data FROM rounds WHERE project_id = ? ORDER BY round_id", (project_id,))
+        return [json.loads(data) for (data,) in rows]
+
+    # --- migração ---
+    def migrate_from_json(self, base_dir: Path):
+        """
+        Importa o index.json e os project.json/round.json das pastas. Depois de
+        importados, os arquivos são renomeados para *.migrated: o SQLite passa a
+        ser a única fonte dos metadados. Roda a cada abertura, mas só encontra
+        arquivos na 1ª vez (ou se uma pasta antiga for copiada de volta, que é
+        importada sem sobrescrever o que já existe).
+        """
+        index_path = base_dir / "index.json"
+        project_files = sorted(base_dir.glob("*/project.json"))
+        round_files = sorted(base_dir.glob("*/rounds/*/round.json"))
+        if not (index_path.exists() or project_files or round_files):
+            return
+        with self.transaction() as conn:
+            projects = {}
+            # Ordem do index primeiro (é a ordem de criação exibida na lista)
+            for proj in _read_json(index_path, {"projects": []}).get("projects", []):
+                if proj.get("project_id"):
+                    projects[proj["project_id"]] = proj
+            for pj in project_files:
+                meta = _read_json(pj, {})
+                if meta.get("project_id"):
+                    projects[meta["project_id"]] = {**meta, **projects.get(meta["project_id"], {})}
+            for meta in projects.values():
+                conn.execute(
+                    "INSERT OR IGNORE INTO projects (project_id, status, created_at, updated_at, data) VALUES (?, ?, ?, ?, ?)",
+                    (meta["project_id"], meta.get("status") or "Rascunho", meta.get("created_at"), meta.get("updated_at"), self._dumps(meta)),
+                )
+            for rj in round_files:
+                meta = _read_json(rj, {})
+                if meta.get("project_id") and meta.get("round_id"):
+                    conn.execute(
+                        "INSERT OR IGNORE INTO rounds (project_id, round_id, created_at, updated_at, data) VALUES (?, ?, ?, ?, ?)",
+                        (meta["project_id"], meta["round_id"], meta.get("created_at"), meta.get("updated_at"), self._dumps(meta)),
+                    )
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('json_migrated', ?)", (_now_iso(),))
+        for path in [index_path] + project_files + round_files:
+            if path.exists():
+                os.replace(path, path.with_suffix(".json.migrated"))
+
+
+CUBE_PARTS = ["events", "users", "lives"]
+OUTPUT_FILES = ["consolidated.parquet", "outliers.parquet", "trend.json", "filter_options.json"] + [f"cube_{name}.parquet" for name in CUBE_PARTS]
+
+# Versões de outputs mantidas por rodada (a corrente + as anteriores ainda em leitura)
+OUTPUT_VERSIONS_KEPT = int(os.environ.get("OUTPUT_VERSIONS_KEPT", "2"))
+
+
+class RoundBusy(RuntimeError):
+    """Já existe uma análise em execução para a rodada."""
+
+
+def _link_or_copy(src: Path, dst: Path):
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
 @dataclass
 class RoundPaths:
     root: Path
@@ -104,34 +469,35 @@ class ProjectStore:
     def __init__(self, base_dir: str = "storage/projects"): # Ajustei para storage/projects
         self.base_dir = Path(base_dir)
         self.base_dir.mkdir(parents=True, exist_ok=True)
-        self.index_path = self.base_dir / "index.json"
         self.current_path = self.base_dir / "_current.json"
-        if not self.index_path.exists():
-            _write_json(self.index_path, {"projects": []})
-
-    def list_projects(self) -> List[Dict[str, Any]]:
-        idx = _read_json(self.index_path, {"projects": []})
-        return idx.get("projects", [])
-
-    def _save_index(self, projects: List[Dict[str, Any]]):
-        _write_json(self.index_path, {"projects": projects})
+        # Metadados de projetos/rodadas (o index.json antigo é importado na 1ª abertura)
+        self.meta = MetadataDB(self.base_dir / "metadata.sqlite3")
+        self.meta.migrate_from_json(self.base_dir)
+        cache_mb = int(os.environ.get("OUTPUTS_CACHE_MB", "512"))
+        self.outputs_cache = OutputsCache(max_bytes=cache_mb * 1024 * 1024)
+        # Respostas já serializadas de /analysis/results (chave inclui a versão dos outputs)
+        results_cache_mb = int(os.environ.get("RESULTS_CACHE_MB", "64"))
+        self.results_cache = OutputsCache(max_bytes=results_cache_mb * 1024 * 1024)
+        stage_cache_gb = float(os.environ.get("STAGE_CACHE_GB", "20"))
+        self.stage_cache = StageCache(self.base_dir.parent / "cache", max_bytes=int(stage_cache_gb * 1024 ** 3))
+        self._local_locks: Dict[tuple, threading.Lock] = {}
+
+    def list_projects(self, limit: Optional[int] = None, offset: int = 0, status: Optional[str] = None,
+                      order: str = "created_at", descending: bool = False) -> List[Dict[str, Any]]:
+        """Projetos na ordem de criação (ou de atualização), opcionalmente filtrados por status e paginados."""
+        return self.meta.list_projects(limit=limit, offset=offset, status=status, order=order, descending=descending)
+
+    def count_projects(self, status: Optional[str] = None) -> int:
+        return self.meta.count_projects(status)
         
     def delete_project(self, project_id: str) -> bool:
-        """Remove o projeto do index e apaga a pasta física."""
-        # 1. Carrega e filtra o JSON
-        idx = _read_json(self.index_path, {"projects": []})
-        projects = idx.get("projects", [])
-        
-        original_count = len(projects)
-        new_projects = [p for p in projects if p["project_id"] != project_id]
-        
-        if len(new_projects) == original_count:
-            return False # Projeto não encontrado na lista
-            
-        # Salva o novo index sem o projeto
-        self._save_index(new_projects)
+        """Remove o projeto dos metadados e apaga a pasta física."""
+        if not self.meta.delete_project(project_id):
+            return False # Projeto não encontrado
+        self.outputs_cache.invalidate(project_id)
+        self.results_cache.invalidate(project_id)
         
-        # 2. Apaga a pasta física recursivamente
+        # Apaga a pasta física recursivamente
         project_path = self.base_dir / project_id
         if project_path.exists() and project_path.is_dir():
             try:
@@ -162,27 +528,14 @@ class ProjectStore:
             "created_at": _now_iso(),
             "updated_at": _now_iso(),
         }
-        _write_json(root / "project.json", project_meta)
-
-        projects = self.list_projects()
-        projects.append(project_meta)
-        self._save_index(projects)
+        self.meta.upsert_project(project_meta)
         return project_id
 
     def read_project(self, project_id: str) -> Dict[str, Any]:
-        return _read_json(self.base_dir / project_id / "project.json", {})
+        return self.meta.get_project(project_id) or {}
 
     def list_rounds(self, project_id: str) -> List[Dict[str, Any]]:
-        rounds_dir = self.base_dir / project_id / "rounds"
-        if not rounds_dir.exists():
-            return []
-        rounds = []
-        for rd in sorted(rounds_dir.iterdir()):
-            if rd.is_dir():
-                meta = _read_json(rd / "round.json", {})
-                if meta:
-                    rounds.append(meta)
-        return rounds
+        return self.meta.list_rounds(project_id)
 
     def create_round(self, project_id: str, name: str, competencia: str = "", notes: str = "", copy_from_round_id: Optional[str] = None) -> str:
         # Se o nome já vier no formato de ID (ex: "R1"), usamos ele, senão geramos slug
@@ -191,8 +544,6 @@ class ProjectStore:
         else:
              round_id = f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{_slug(name)}"
              
-        rd_root = self.base_dir / project_id / "rounds" / round_id
-
         paths = self.round_paths(project_id, round_id)
         for p in [paths.inputs, paths.config, paths.outputs, paths.audit, paths.reports]:
             p.mkdir(parents=True, exist_ok=True)
@@ -207,7 +558,7 @@ class ProjectStore:
             "updated_at": _now_iso(),
             "copied_from": copy_from_round_id,
         }
-        _write_json(rd_root / "round.json", meta)
+        self.meta.upsert_round(meta)
 
         if copy_from_round_id:
             src = self.round_paths(project_id, copy_from_round_id)
@@ -218,10 +569,7 @@ class ProjectStore:
                     dp.parent.mkdir(parents=True, exist_ok=True)
                     dp.write_bytes(sp.read_bytes())
 
-        pm = self.read_project(project_id)
-        if pm:
-            pm["updated_at"] = _now_iso()
-            _write_json(self.base_dir / project_id / "project.json", pm)
+        self.meta.update_project(project_id, updated_at=_now_iso())
 
         return round_id
 
@@ -236,20 +584,113 @@ class ProjectStore:
             reports=root / "reports",
         )
 
-    def save_inputs(self, project_id: str, round_id: str, benef_df: pd.DataFrame, ficha_df: pd.DataFrame) -> Dict[str, Any]:
+    @contextmanager
+    def round_lock(self, project_id: str, round_id: str, timeout: float = 0.0, on_wait=None):
+        """
+        Trava exclusiva da rodada, válida entre processos (flock em <rodada>/.run.lock).
+
+        Espera até `timeout` segundos (chamando `on_wait` a cada tentativa, ex.:
+        checar cancelamento) e levanta RoundBusy se a rodada continuar travada.
+        """
+        path = self.round_paths(project_id, round_id).root / ".run.lock"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        local = self._local_locks.setdefault((project_id, round_id), threading.Lock())
+        deadline = time.monotonic() + timeout
+        with open(path, "a+") as f:
+            while True:
+                if local.acquire(blocking=False):
+                    try:
+                        if fcntl is not None:
+                            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                        break
+                    except BlockingIOError:
+                        local.release()
+                if time.monotonic() >= deadline:
+                    raise RoundBusy(f"Já existe uma análise em execução para a rodada {round_id}")
+                if on_wait is not None:
+                    on_wait()
+                time.sleep(0.2)
+            try:
+                f.seek(0)
+                f.truncate()
+                f.write(json.dumps({"pid": os.getpid(), "locked_at": _now_iso()}))
+                f.flush()
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+                local.release()
+
+    def round_busy(self, project_id: str, round_id: str) -> bool:
+        """True se a trava da rodada está com outra análise (checagem sem esperar, vale entre processos)."""
+        try:
+            with self.round_lock(project_id, round_id):
+                return False
+        except RoundBusy:
+            return True
+
+    def input_paths(self, project_id: str, round_id: str) -> Dict[str, Path]:
         p = self.round_paths(project_id, round_id)
-        benef_path = p.inputs / "beneficiarios.parquet"
-        ficha_path = p.inputs / "ficha.parquet"
-        benef_df.to_parquet(benef_path, index=False)
-        ficha_df.to_parquet(ficha_path, index=False)
-        meta = {
-            "saved_at": _now_iso(),
-            "beneficiarios": {"path": str(benef_path), "sha256": _sha256_file(benef_path), "rows": int(benef_df.shape[0]), "cols": int(benef_df.shape[1])},
-            "ficha": {"path": str(ficha_path), "sha256": _sha256_file(ficha_path), "rows": int(ficha_df.shape[0]), "cols": int(ficha_df.shape[1])},
-        }
+        p.inputs.mkdir(parents=True, exist_ok=True)
+        return {"beneficiarios": p.inputs / "beneficiarios.parquet", "ficha": p.inputs / "ficha.parquet"}
+
+    def register_inputs(self, project_id: str, round_id: str, shapes: Dict[str, tuple]) -> Dict[str, Any]:
+        """Grava o inputs_hash.json para os Parquets já escritos em inputs/ ({nome: (linhas, colunas)})."""
+        p = self.round_paths(project_id, round_id)
+        paths = self.input_paths(project_id, round_id)
+        meta = {"saved_at": _now_iso()}
+        for name, (rows, cols) in shapes.items():
+            meta[name] = {"path": str(paths[name]), "sha256": _sha256_file(paths[name]), "rows": int(rows), "cols": int(cols)}
         _write_json(p.inputs / "inputs_hash.json", meta)
         return meta
 
+    def save_inputs(self, project_id: str, round_id: str, benef_df: pd.DataFrame, ficha_df: pd.DataFrame) -> Dict[str, Any]:
+        paths = self.input_paths(project_id, round_id)
+        benef_df.to_parquet(paths["beneficiarios"], index=False)
+        ficha_df.to_parquet(paths["ficha"], index=False)
+        return self.register_inputs(project_id, round_id, {"beneficiarios": benef_df.shape, "ficha": ficha_df.shape})
+
+    def input_columns(self, project_id: str, round_id: str) -> Dict[str, Optional[List[str]]]:
+        """Nomes das colunas de cada input, lidos só do schema do Parquet (None se o arquivo não existir)."""
+        return {
+            name: (pq.read_schema(path).names if path.exists() else None)
+            for name, path in self.input_paths(project_id, round_id).items()
+        }
+
+    def load_inputs_meta(self, project_id: str, round_id: str) -> Optional[Dict[str, Any]]:
+        return _read_json(self.round_paths(project_id, round_id).inputs / "inputs_hash.json", None)
+
+    def save_id_index(self, project_id: str, round_id: str, index: Dict[str, Any], fingerprint: str):
+        """Grava o dicionário do identificador (id -> código int32) e os códigos de cada base em inputs/id_index/."""
+        d = self.round_paths(project_id, round_id).inputs / "id_index"
+        d.mkdir(parents=True, exist_ok=True)
+        tables = {
+            "ids": pa.table({"id": pa.array(index["ids"], pa.string())}),
+            "beneficiarios": pa.table({"code": pa.array(index["benef"], pa.int32())}),
+            "ficha": pa.table({"code": pa.array(index["ficha"], pa.int32())}),
+        }
+        for name, table in tables.items():
+            tmp = d / f"{name}.parquet.tmp"
+            pq.write_table(table, tmp)
+            os.replace(tmp, d / f"{name}.parquet")
+        _write_json(d / "id_index.json", {"fingerprint": fingerprint, "saved_at": _now_iso(), "stats": index["stats"]})
+
+    def load_id_index(self, project_id: str, round_id: str, fingerprint: Optional[str]) -> Optional[Dict[str, Any]]:
+        """Dicionário do identificador da rodada, ou None se não existir para esse fingerprint."""
+        d = self.round_paths(project_id, round_id).inputs / "id_index"
+        meta = _read_json(d / "id_index.json", None)
+        if not fingerprint or not meta or meta.get("fingerprint") != fingerprint:
+            return None
+        try:
+            return {
+                "ids": pq.read_table(d / "ids.parquet").column("id").to_numpy(zero_copy_only=False).astype(object),
+                "benef": pq.read_table(d / "beneficiarios.parquet").column("code").to_numpy(),
+                "ficha": pq.read_table(d / "ficha.parquet").column("code").to_numpy(),
+                "stats": meta["stats"],
+            }
+        except FileNotFoundError:
+            return None
+
     def load_inputs(self, project_id: str, round_id: str) -> Dict[str, Optional[pd.DataFrame]]:
         p = self.round_paths(project_id, round_id)
         benef_path = p.inputs / "beneficiarios.parquet"
@@ -273,25 +714,70 @@ class ProjectStore:
             "filters": _read_json(p.config / "filters.json", None),
         }
 
-    def save_outputs(self, project_id: str, round_id: str, consolidated_df: pd.DataFrame | None = None, outliers_df: pd.DataFrame | None = None, trend_json: dict | None = None):
+    def save_profile(self, project_id: str, round_id: str, profile: Dict[str, Any]) -> Path:
+        """Grava o perfil de uma execução em audit/profile_<tipo>_<aaaammdd_hhmmss>.json."""
+        audit = self.round_paths(project_id, round_id).audit
+        audit.mkdir(parents=True, exist_ok=True)
+        path = audit / f"profile_{profile['kind']}_{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}.json"
+        _write_json(path, profile)
+        return path
+
+    def load_profiles(self, project_id: str, round_id: str, kind: str = "run", limit: int = 10) -> List[Dict[str, Any]]:
+        """Perfis gravados da rodada, do mais recente para o mais antigo."""
+        audit = self.round_paths(project_id, round_id).audit
+        files = sorted(audit.glob(f"profile_{kind}_*.json"), reverse=True)[:limit]
+        return [p for p in (_read_json(f, None) for f in files) if p is not None]
+
+    def save_outputs(self, project_id: str, round_id: str, consolidated_df: pd.DataFrame | None = None, outliers_df: pd.DataFrame | None = None, trend_json: dict | None = None, cube: Dict[str, pd.DataFrame] | None = None,
+                     filter_options: dict | None = None):
+        """
+        Grava os outputs numa pasta nova (outputs/v<data>) e só então troca o
+        ponteiro outputs/CURRENT, então quem lê vê sempre uma versão completa.
+        Partes não informadas são herdadas da versão anterior (por hard link); o
+        cubo e o dicionário de filtros não são herdados quando a base consolidada muda.
+        """
         p = self.round_paths(project_id, round_id)
+        prev = self.output_dir(project_id, round_id)
+        version = f"v{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}"
+        tmp = p.outputs / f".{version}.tmp"
+        tmp.mkdir(parents=True)
         
         # 1. Salva os arquivos físicos (Parquet/JSON)
+        written = set()
         if consolidated_df is not None: 
-            consolidated_df.to_parquet(p.outputs / "consolidated.parquet", index=False)
+            consolidated_df.to_parquet(tmp / "consolidated.parquet", index=False)
+            written.add("consolidated.parquet")
         if outliers_df is not None: 
-            outliers_df.to_parquet(p.outputs / "outliers.parquet", index=False)
+            outliers_df.to_parquet(tmp / "outliers.parquet", index=False)
+            written.add("outliers.parquet")
         if trend_json is not None: 
-            _write_json(p.outputs / "trend.json", trend_json)
+            _write_json(tmp / "trend.json", trend_json)
+            written.add("trend.json")
+        cube_files = {f"cube_{name}.parquet" for name in CUBE_PARTS}
+        if cube is not None:
+            for name, part in cube.items():
+                part.to_parquet(tmp / f"cube_{name}.parquet", index=False)
+            written |= cube_files
+        elif consolidated_df is not None:
+            # Cubo de uma execução anterior não corresponde mais à base consolidada: não herda
+            written |= cube_files
+        if filter_options is not None:
+            _write_json(tmp / "filter_options.json", filter_options)
+        if filter_options is not None or consolidated_df is not None:
+            written.add("filter_options.json")
+        for fname in OUTPUT_FILES:
+            if fname not in written and (prev / fname).exists():
+                _link_or_copy(prev / fname, tmp / fname)
+
+        os.replace(tmp, p.outputs / version)
+        self._set_current_output(p.outputs, version)
+        self.outputs_cache.invalidate(project_id, round_id)
+        self._prune_outputs(p.outputs, version)
         
-        # 2. Atualiza o metadata da Rodada (round.json)
-        rp = p.root / "round.json"
-        meta = _read_json(rp, {})
-        if meta:
-            meta["updated_at"] = _now_iso()
-            _write_json(rp, meta)
-
-        # 3. ATUALIZA O INDEX DO PROJETO (Para a Lista aparecer correta)
+        # 2. Atualiza o metadata da Rodada
+        self.meta.update_round(project_id, round_id, updated_at=_now_iso())
+
+        # 3. ATUALIZA OS METADADOS DO PROJETO (Para a Lista aparecer correta)
         # Calcula vidas se o DF estiver disponível
         lives_count = 0
         if consolidated_df is not None:
@@ -300,24 +786,123 @@ class ProjectStore:
             if col_id in consolidated_df.columns:
                 lives_count = int(consolidated_df[col_id].nunique())
 
-        # Carrega a lista de projetos, atualiza o alvo e salva de volta
-        projects = self.list_projects()
-        updated_projects = []
-        for proj in projects:
-            if proj["project_id"] == project_id:
-                proj["status"] = "Processado" # Muda de Rascunho para Processado
-                proj["lives"] = lives_count   # Salva o número de vidas
-                proj["updated_at"] = _now_iso()
-            updated_projects.append(proj)
-        
-        self._save_index(updated_projects)
+        # Muda de Rascunho para Processado e salva o número de vidas (uma transação só)
+        self.meta.update_project(project_id, status="Processado", lives=lives_count, updated_at=_now_iso())
+
+    def output_version(self, project_id: str, round_id: str) -> Optional[str]:
+        """Versão corrente dos outputs da rodada (pasta apontada por outputs/CURRENT), ou None."""
+        try:
+            version = (self.round_paths(project_id, round_id).outputs / "CURRENT").read_text(encoding="utf-8").strip()
+        except FileNotFoundError:
+            return None
+        return version or None
+
+    def output_dir(self, project_id: str, round_id: str, version: Optional[str] = None) -> Path:
+        """Pasta de uma versão dos outputs (a corrente por padrão). Rodadas antigas gravavam direto em outputs/."""
+        outputs = self.round_paths(project_id, round_id).outputs
+        version = version or self.output_version(project_id, round_id)
+        return outputs / version if version else outputs
+
+    def outputs_tag(self, project_id: str, round_id: str, version: Optional[str] = None) -> Optional[str]:
+        """
+        Identifica o conteúdo dos outputs da rodada (para ETag/caches): a versão
+        corrente ou, em rodadas sem versão, o mtime/tamanho dos arquivos. None se
+        a rodada ainda não foi processada.
+        """
+        version = version or self.output_version(project_id, round_id)
+        d = self.output_dir(project_id, round_id, version)
+        if not (d / "consolidated.parquet").exists():
+            return None
+        if version:
+            return version
+        return StageCache.key(self._outputs_signature(d, OUTPUT_FILES))
+
+    @staticmethod
+    def _set_current_output(outputs: Path, version: str):
+        tmp = outputs / f"CURRENT.{uuid.uuid4().hex}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(version)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, outputs / "CURRENT")
+
+    @staticmethod
+    def _prune_outputs(outputs: Path, current: str):
+        """Apaga as versões além de OUTPUT_VERSIONS_KEPT e os arquivos do layout antigo (sem versão)."""
+        versions = sorted((d for d in outputs.glob("v*") if d.is_dir() and d.name != current), reverse=True)
+        for d in versions[max(OUTPUT_VERSIONS_KEPT - 1, 0):]:
+            shutil.rmtree(d, ignore_errors=True)
+        for fname in OUTPUT_FILES:
+            (outputs / fname).unlink(missing_ok=True)
+
+    def _outputs_signature(self, d: Path, fnames: List[str]) -> tuple:
+        # Pastas versionadas não mudam depois de publicadas: o nome da versão basta
+        if d.name.startswith("v"):
+            return (d.name,)
+        sig = []
+        for fname in fnames:
+            try:
+                st = (d / fname).stat()
+                sig.append((fname, st.st_mtime_ns, st.st_size))
+            except FileNotFoundError:
+                sig.append((fname, None, None))
+        return tuple(sig)
+
+    def load_outputs(self, project_id: str, round_id: str, columns: Optional[List[str]] = None, filters: Optional[List[tuple]] = None,
+                     version: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Carrega os outputs da rodada, servindo do cache em memória quando possível.
+
+        `columns` e `filters` (formato do pyarrow: [("col", "==", v), ("col", "in", [...])])
+        são aplicados na leitura do consolidated.parquet, então só as colunas e
+        row groups necessários são lidos. Colunas inexistentes no arquivo são ignoradas.
+        Tudo sai da mesma versão dos outputs (a corrente, se `version` não vier).
+        """
+        d = self.output_dir(project_id, round_id, version)
+        cons_path = d / "consolidated.parquet"
+        key = (
+            project_id, round_id, "outputs",
+            self._outputs_signature(d, ["consolidated.parquet", "outliers.parquet", "trend.json"]),
+            tuple(columns) if columns is not None else None,
+            tuple((c, op, tuple(v) if isinstance(v, (list, tuple, set)) else v) for c, op, v in filters) if filters else None,
+        )
+        cached = self.outputs_cache.get(key)
+        if cached is not None:
+            return dict(cached)
 
-    def load_outputs(self, project_id: str, round_id: str) -> Dict[str, Any]:
-        p = self.round_paths(project_id, round_id)
         out = {"consolidated_df": None, "outliers_df": None, "trend": None}
-        if (p.outputs / "consolidated.parquet").exists(): out["consolidated_df"] = pd.read_parquet(p.outputs / "consolidated.parquet")
-        if (p.outputs / "outliers.parquet").exists(): out["outliers_df"] = pd.read_parquet(p.outputs / "outliers.parquet")
-        out["trend"] = _read_json(p.outputs / "trend.json", None)
-        return out
+        if cons_path.exists():
+            available = set(pq.read_schema(cons_path).names)
+            cols = [c for c in columns if c in available] if columns is not None else None
+            flt = [f for f in (filters or []) if f[0] in available] or None
+            out["consolidated_df"] = pd.read_parquet(cons_path, columns=cols, filters=flt)
+        if (d / "outliers.parquet").exists(): out["outliers_df"] = pd.read_parquet(d / "outliers.parquet")
+        out["trend"] = _read_json(d / "trend.json", None)
+
+        nbytes = _frame_nbytes(out["consolidated_df"]) + _frame_nbytes(out["outliers_df"])
+        self.outputs_cache.put(key, out, nbytes)
+        return dict(out)
+
+    def load_trend(self, project_id: str, round_id: str, version: Optional[str] = None) -> Optional[dict]:
+        return _read_json(self.output_dir(project_id, round_id, version) / "trend.json", None)
+
+    def load_filter_options(self, project_id: str, round_id: str, version: Optional[str] = None) -> Optional[dict]:
+        """Dicionário dos filtros gravado com os outputs (None em rodadas processadas antes dele existir)."""
+        return _read_json(self.output_dir(project_id, round_id, version) / "filter_options.json", None)
+
+    def load_cube(self, project_id: str, round_id: str, version: Optional[str] = None) -> Optional[Dict[str, pd.DataFrame]]:
+        """Carrega o cubo de resultados pré-agregado da rodada (None se a rodada não tiver cubo)."""
+        d = self.output_dir(project_id, round_id, version)
+        fnames = [f"cube_{name}.parquet" for name in CUBE_PARTS]
+        if not all((d / f).exists() for f in fnames):
+            return None
+        key = (project_id, round_id, "cube", self._outputs_signature(d, fnames))
+        cached = self.outputs_cache.get(key)
+        if cached is not None:
+            return dict(cached)
+
+        cube = {name: pd.read_parquet(d / f"cube_{name}.parquet") for name in CUBE_PARTS}
+        self.outputs_cache.put(key, cube, sum(_frame_nbytes(df) for df in cube.values()))
+        return dict(cube)
 
 store = ProjectStore()
\ No newline at end of file
@@ -0,0 +1,203 @@
+from __future__ import annotations
+
+import os
+import uuid
+import threading
+import traceback
+import multiprocessing as mp
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, Future
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from database import store, RoundBusy, _read_json, _write_json, _now_iso
+
+try:
+    import fcntl
+except ImportError:  # Windows: a trava do estado dos jobs vale só dentro do processo
+    fcntl = None
+
+TERMINAL = ("done", "failed", "cancelled")
+
+# Quanto o worker espera pela trava da rodada. O submit já recusa rodadas travadas,
+# então a espera só cobre a corrida entre essa checagem e o início do job; curta
+# para um job não segurar um processo do pool enquanto outra API roda a rodada.
+ROUND_LOCK_WAIT_S = float(os.environ.get("ROUND_LOCK_WAIT_S", "30"))
+
+
+class JobCancelled(Exception):
+    pass
+
+
+def _job_path(jobs_dir: Path, job_id: str) -> Path:
+    return jobs_dir / f"{job_id}.json"
+
+
+def _cancel_path(jobs_dir: Path, job_id: str) -> Path:
+    return jobs_dir / f"{job_id}.cancel"
+
+
+_STATE_LOCK = threading.Lock()
+
+
+@contextmanager
+def _state_lock(jobs_dir: Path):
+    """
+    Trava das leituras/escritas do estado dos jobs, válida entre processos
+    (flock em <jobs_dir>/.lock): a API (cancelamento) e o worker (etapas,
+    status final) atualizam o mesmo JSON.
+    """
+    with _STATE_LOCK:
+        with open(Path(jobs_dir) / ".lock", "a+") as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _update_job(jobs_dir: Path, job_id: str, only_active: bool = False, **fields) -> Dict[str, Any]:
+    """
+    Atualiza campos do <job_id>.json (ler-alterar-gravar sob a trava do estado).
+    Com `only_active`, um job já terminado (TERMINAL) é devolvido sem alteração.
+    """
+    with _state_lock(jobs_dir):
+        job = _read_json(_job_path(jobs_dir, job_id), {}) or {}
+        if only_active and job.get("status") in TERMINAL:
+            return job
+        job.update(fields, job_id=job_id)
+        _write_json(_job_path(jobs_dir, job_id), job)
+        return job
+
+
+def _run_job(jobs_dir: str, job_id: str, project_id: str, round_id: str, config: dict) -> Dict[str, Any]:
+    """Executado no processo do pool: roda o pipeline e grava status/progresso em <job_id>.json."""
+    import pandas as pd
+    from pipeline import run_pipeline, STAGES
+
+    # Copy-on-write no processo do worker: as etapas do pipeline trabalham sobre cópias
+    # rasas da base consolidada e só copiam as colunas que alteram (pico de memória menor)
+    pd.set_option("mode.copy_on_write", True)
+
+    jobs_dir = Path(jobs_dir)
+
+    def on_stage(name: str):
+        if _cancel_path(jobs_dir, job_id).exists():
+            raise JobCancelled()
+        idx = STAGES.index(name)
+        _update_job(jobs_dir, job_id, stage=name, stage_index=idx, progress=round(idx / len(STAGES), 3))
+
+    def check_cancel():
+        if _cancel_path(jobs_dir, job_id).exists():
+            raise JobCancelled()
+
+    # Uma análise por rodada: se outra pegou a trava depois do submit, espera pouco e falha
+    try:
+        with store.round_lock(project_id, round_id, timeout=ROUND_LOCK_WAIT_S, on_wait=check_cancel):
+            check_cancel()
+            _update_job(jobs_dir, job_id, status="running", started_at=_now_iso())
+            result = run_pipeline(project_id, round_id, config, on_stage=on_stage)
+    except JobCancelled:
+        return _update_job(jobs_dir, job_id, status="cancelled", finished_at=_now_iso())
+    except RoundBusy as e:
+        return _update_job(jobs_dir, job_id, status="failed", error=str(e), finished_at=_now_iso())
+    except Exception as e:
+        traceback.print_exc()
+        return _update_job(jobs_dir, job_id, status="failed", error=str(e), finished_at=_now_iso())
+    return _update_job(jobs_dir, job_id, status="done", stage=None, progress=1.0, result=result, finished_at=_now_iso())
+
+
+class JobManager:
+    """
+    Fila de execução do pipeline em um pool de processos.
+
+    O estado de cada job fica em `<base_dir>/_jobs/<job_id>.json` (escrito pelo
+    processo que executa), então o status pode ser lido por qualquer worker da API.
+    O cancelamento é cooperativo: o job para antes da próxima etapa.
+    Cada rodada aceita um job ativo por vez: submit levanta RoundBusy se já há
+    um job da rodada neste processo ou se a trava da rodada (ProjectStore.round_lock)
+    está com outro processo da API, sem ocupar um processo do pool esperando.
+    """
+
+    def __init__(self, jobs_dir: Path, max_workers: int):
+        self.jobs_dir = Path(jobs_dir)
+        self.jobs_dir.mkdir(parents=True, exist_ok=True)
+        self.max_workers = max_workers
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._futures: Dict[str, Future] = {}
+        self._rounds: Dict[str, tuple] = {}
+        self._lock = threading.Lock()
+
+    def _pool(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            # spawn: o servidor é multi-thread, fork poderia herdar locks travados
+            self._executor = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=mp.get_context("spawn"))
+        return self._executor
+
+    def active(self, project_id: str, round_id: str) -> Optional[str]:
+        """Id do job ainda não terminado da rodada, se houver."""
+        with self._lock:
+            for job_id, key in self._rounds.items():
+                if key == (project_id, round_id) and (self.get(job_id) or {}).get("status") not in TERMINAL:
+                    return job_id
+        return None
+
+    def submit(self, project_id: str, round_id: str, config: dict) -> Dict[str, Any]:
+        from pipeline import STAGES
+
+        running = self.active(project_id, round_id)
+        if running is not None:
+            raise RoundBusy(f"Já existe uma análise em execução para a rodada {round_id} (job {running})")
+        if store.round_busy(project_id, round_id):
+            raise RoundBusy(f"Já existe uma análise em execução para a rodada {round_id} (outro processo)")
+        job_id = uuid.uuid4().hex
+        job = _update_job(
+            self.jobs_dir, job_id,
+            project_id=project_id,
+            round_id=round_id,
+            status="queued",
+            stage=None,
+            stage_index=None,
+            stages=STAGES,
+            progress=0.0,
+            error=None,
+            created_at=_now_iso(),
+        )
+        with self._lock:
+            fut = self._pool().submit(_run_job, str(self.jobs_dir), job_id, project_id, round_id, config)
+            self._futures[job_id] = fut
+            self._rounds[job_id] = (project_id, round_id)
+        fut.add_done_callback(lambda f, jid=job_id: self._on_done(jid, f))
+        return job
+
+    def _on_done(self, job_id: str, fut: Future):
+        with self._lock:
+            self._futures.pop(job_id, None)
+            self._rounds.pop(job_id, None)
+        if fut.cancelled():
+            _update_job(self.jobs_dir, job_id, only_active=True, status="cancelled", finished_at=_now_iso())
+            return
+        exc = fut.exception()
+        if exc is not None:
+            # Processo morreu antes de gravar o status (ex.: OOM) -> marca como falha
+            _update_job(self.jobs_dir, job_id, only_active=True, status="failed", error=str(exc) or type(exc).__name__, finished_at=_now_iso())
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        return _read_json(_job_path(self.jobs_dir, job_id), None)
+
+    def cancel(self, job_id: str) -> Optional[Dict[str, Any]]:
+        job = self.get(job_id)
+        if job is None or job.get("status") in TERMINAL:
+            return job
+        _cancel_path(self.jobs_dir, job_id).touch()
+        with self._lock:
+            fut = self._futures.get(job_id)
+        if fut is not None and fut.cancel():
+            return _update_job(self.jobs_dir, job_id, only_active=True, status="cancelled", finished_at=_now_iso())
+        # O job pode ter terminado desde a leitura acima: não reabre o estado final
+        return _update_job(self.jobs_dir, job_id, only_active=True, cancel_requested=True)
+
+
+jobs = JobManager(store.base_dir / "_jobs", max_workers=int(os.environ.get("ANALISE_MAX_JOBS", "2")))
@@ -1,20 +1,35 @@
-from fastapi import FastAPI, UploadFile, File, Form, Query, HTTPException, Body
+from fastapi import FastAPI, UploadFile, File, Form, Query, HTTPException, Body, Header, Response
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import StreamingResponse
-from typing import List, Dict, Any, Optional
-import numpy as np
+from starlette.concurrency import run_in_threadpool
+from typing import List, Dict, Any, Literal, Optional
 import pandas as pd
+import os
 import json
-import io
+import asyncio
+import hashlib
+import threading
+import multiprocessing as mp
+from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 
 # --- IMPORTS DOS MÓDULOS LOCAIS ---
-from database import store  # O arquivo database.py que criamos
-from src.mapping import suggest_mapping, apply_mapping, BENEF_CONCEPTS, FICHA_CONCEPTS
-from src.compute import consolidate, compute_tempo_programa, compute_ultima_competencia_ref, compute_momento_mes
-from src.metrics import pivot_antes_depois, ensure_numeric_cols
-from src.prediction import calculate_linear_trend
-from src.outliers import detect_outliers_user_cost
-from src.io import read_table
+from database import store, RoundBusy, SingleFlight  # O arquivo database.py que criamos
+from jobs import jobs
+from results import RESULT_ID_COLS, load_cohort, compute_results, compare_round
+from src.mapping import suggest_mapping, sanitize_map, BENEF_CONCEPTS, FICHA_CONCEPTS
+from src.compute import compute_ultima_competencia_ref
+from src.cube import build_filter_options, LIVES_COLS, FILTER_DIMS
+from src.io import write_table_parquet
+from src.preview import preview_head, tp_summary, iter_tp_frames
+from src.compare import compare_rounds
+from src.export import EXPORT_FORMATS, ARROW_STREAM, accepts_arrow, arrow_ipc, stream_csv, stream_parquet, stream_xlsx
+
+# Copy-on-write do pandas para o processo da API: os cálculos partem de cópias rasas
+# (df.copy(deep=False)) e filtros do cache de outputs, e com CoW uma coluna só é
+# copiada de fato quando alterada. Ligado aqui (e no worker dos jobs), não no pacote src.
+pd.set_option("mode.copy_on_write", True)
 
 app = FastAPI()
 
@@ -25,14 +40,26 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Total-Count", "Content-Disposition"],
 )
 
 # --- ROTAS DE PROJETOS ---
 
 @app.get("/projects")
-def list_projects():
-    """Lista todos os projetos cadastrados no index.json."""
-    return store.list_projects()
+def list_projects(
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1, le=1000),
+    offset: int = Query(0, ge=0),
+    status: Optional[str] = None,
+    ordem: Literal["created_at", "updated_at"] = "created_at",
+    desc: bool = False,
+):
+    """
+    Lista os projetos cadastrados (todos, se `limit` não vier). O total para
+    paginação vai no cabeçalho X-Total-Count.
+    """
+    response.headers["X-Total-Count"] = str(store.count_projects(status))
+    return store.list_projects(limit=limit, offset=offset, status=status, order=ordem, descending=desc)
 
 @app.get("/projects/{project_id}")
 def read_project(project_id: str):
@@ -63,9 +90,13 @@ async def upload_files(
     project_id: str, 
     round_id: str,
     beneficiarios: UploadFile = File(...),
-    ficha: UploadFile = File(...)
+    ficha: UploadFile = File(...),
+    accept: Optional[str] = Header(None),
 ):
-    """Recebe arquivos CSV/Excel, converte e salva como Parquet na pasta inputs."""
+    """
+    Recebe arquivos CSV/Excel, converte e salva como Parquet na pasta inputs.
+    Com `Accept: application/vnd.apache.arrow.stream`, as prévias vêm em Arrow IPC.
+    """
     try:
         # Garante que a rodada existe
         try:
@@ -73,21 +104,28 @@ async def upload_files(
         except Exception:
              pass 
         
-        # Lê os arquivos usando o módulo IO robusto
-        df_ben = read_table(beneficiarios)
-        df_ficha = read_table(ficha)
-        
-        # Salva
-        store.save_inputs(project_id, round_id, df_ben, df_ficha)
+        # Converte os arquivos em blocos direto para Parquet (contagem e preview na mesma passada)
+        paths = store.input_paths(project_id, round_id)
+        info_ben = write_table_parquet(beneficiarios, paths["beneficiarios"])
+        info_ficha = write_table_parquet(ficha, paths["ficha"])
+        store.register_inputs(project_id, round_id, {
+            "beneficiarios": (info_ben["rows"], info_ben["cols"]),
+            "ficha": (info_ficha["rows"], info_ficha["cols"]),
+        })
         
-        # Pegamos as 5 primeiras linhas e preenchemos NaNs com "" para não quebrar o JSON
-        preview_ben = df_ben.head(50).fillna("").to_dict(orient="records")
-        preview_ficha = df_ficha.head(50).fillna("").to_dict(orient="records")
+        if accepts_arrow(accept):
+            meta = {"status": "success", "rows_benef": info_ben["rows"], "rows_ficha": info_ficha["rows"]}
+            tables = {"preview_benef": info_ben["preview"], "preview_ficha": info_ficha["preview"]}
+            return Response(arrow_ipc(tables, meta), media_type=ARROW_STREAM, headers={"Vary": "Accept"})
+
+        # Pegamos as 50 primeiras linhas e preenchemos NaNs com "" para não quebrar o JSON
+        preview_ben = info_ben["preview"].fillna("").to_dict(orient="records")
+        preview_ficha = info_ficha["preview"].fillna("").to_dict(orient="records")
         
         return {
             "status": "success", 
-            "rows_benef": len(df_ben), 
-            "rows_ficha": len(df_ficha),
+            "rows_benef": info_ben["rows"], 
+            "rows_ficha": info_ficha["rows"],
             "preview_benef": preview_ben, # <--- Enviando dados
             "preview_ficha": preview_ficha # <--- Enviando dados
         }
@@ -99,31 +137,34 @@ async def upload_files(
 @app.get("/mapping/suggestions/{project_id}/{round_id}")
 def get_mapping_suggestions(project_id: str, round_id: str):
     """Gera sugestões de De-Para baseadas nos nomes das colunas."""
-    inputs = store.load_inputs(project_id, round_id)
-    if inputs["benef_df"] is None or inputs["ficha_df"] is None:
+    columns = store.input_columns(project_id, round_id)
+    if columns["beneficiarios"] is None or columns["ficha"] is None:
         raise HTTPException(status_code=404, detail="Arquivos não encontrados em inputs/")
     
-    sug_b = suggest_mapping(list(inputs["benef_df"].columns), BENEF_CONCEPTS)
-    sug_f = suggest_mapping(list(inputs["ficha_df"].columns), FICHA_CONCEPTS)
+    sug_b = suggest_mapping(columns["beneficiarios"], BENEF_CONCEPTS)
+    sug_f = suggest_mapping(columns["ficha"], FICHA_CONCEPTS)
     
     return {
-        "beneficiarios": {"columns": list(inputs["benef_df"].columns), "suggestions": sug_b},
-        "ficha": {"columns": list(inputs["ficha_df"].columns), "suggestions": sug_f}
+        "beneficiarios": {"columns": columns["beneficiarios"], "suggestions": sug_b},
+        "ficha": {"columns": columns["ficha"], "suggestions": sug_f}
     }
 
 
 @app.post("/analysis/preview/{project_id}/{round_id}")
-async def preview_calculation(project_id: str, round_id: str, payload: dict):
+async def preview_calculation(project_id: str, round_id: str, payload: dict, rows: int = Query(50, ge=1, le=1000),
+                              accept: Optional[str] = Header(None)):
     """
-    Simula o cálculo do Tempo de Programa e retorna as primeiras 50 linhas
-    para o usuário conferir antes de finalizar.
+    Simula o cálculo do Tempo de Programa e retorna as primeiras `rows` linhas
+    para o usuário conferir antes de finalizar (em Arrow IPC, com os tipos
+    originais, se o Accept pedir).
+
+    O TP das linhas exibidas é calculado só sobre elas; os totais (status e
+    grupos de TP) vêm de uma passada leve pela base lendo apenas as colunas de datas.
     """
     try:
-        # 1. Carrega os inputs brutos salvos no passo de Upload
-        inputs = store.load_inputs(project_id, round_id)
-        df_ben = inputs["benef_df"]
-        
-        if df_ben is None:
+        # 1. Localiza o input salvo no passo de Upload (sem carregar a base)
+        benef_path = store.input_paths(project_id, round_id)["beneficiarios"]
+        if not benef_path.exists():
             raise HTTPException(status_code=404, detail="Base de beneficiários não encontrada.")
 
         # 2. Prepara os dados do payload (igual ao submit final)
@@ -137,154 +178,146 @@ async def preview_calculation(project_id: str, round_id: str, payload: dict):
         # Usa sua função de cálculo de competência (normalização)
         ultima_ref = compute_ultima_competencia_ref(ref_ts)
         
-        # 4. Aplica o Mapeamento (Renomeia colunas, etc)
-        # Remove a chave 'identifier' pois o apply_mapping espera apenas de-para de colunas
-        map_clean = {k: v for k, v in mapping_ben.items() if k != "identifier" and v}
-        df_mapped = apply_mapping(df_ben, map_clean)
-        
-        # 5. Calcula o Tempo de Programa
-        df_calculated = compute_tempo_programa(df_mapped, ultima_ref)
-        
-        # 6. Retorna o Preview (50 linhas)
-        # Convertemos datas para string para não quebrar o JSON
-        preview = df_calculated.head(50).fillna("").astype(str).to_dict(orient="records")
+        # 4. Mapeamento sem a chave 'identifier' e com uma coluna por conceito (igual ao pipeline)
+        map_clean = sanitize_map(mapping_ben)
+
+        # 5. Calcula o Tempo de Programa das linhas exibidas + resumo da base
+        df_calculated = preview_head(benef_path, map_clean, ultima_ref, rows=rows)
+        resumo = tp_summary(benef_path, map_clean, ultima_ref)
         
-        return {
+        # 6. Retorna o Preview
+        out = {
             "status": "success",
             "ref_calculada": str(ultima_ref.date()),
-            "preview": preview,
-            "total_linhas": len(df_calculated)
+            "total_linhas": resumo["total_linhas"],
+            "resumo": {"status": resumo["status"], "grupos": resumo["grupos"]},
         }
+        if accepts_arrow(accept):
+            return Response(arrow_ipc({"preview": df_calculated}, out), media_type=ARROW_STREAM, headers={"Vary": "Accept"})
+
+        # Convertemos datas para string para não quebrar o JSON
+        out["preview"] = df_calculated.fillna("").astype(str).to_dict(orient="records")
+        return out
         
+    except HTTPException:
+        raise
     except Exception as e:
         import traceback
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=str(e))
 
-# --- ROTA: DOWNLOAD EXCEL COMPLETO ---
+# --- ROTA: DOWNLOAD DA BASE COMPLETA ---
 @app.post("/analysis/download_preview/{project_id}/{round_id}")
-async def download_preview_excel(project_id: str, round_id: str, payload: dict = Body(...)):
+def download_preview_excel(
+    project_id: str,
+    round_id: str,
+    payload: dict = Body(...),
+    format: str = Query("xlsx", pattern="^(xlsx|csv|parquet)$"),
+):
     """
-    Recalcula o Tempo de Programa (com a config atual) e baixa o Excel COMPLETO.
+    Recalcula o Tempo de Programa (com a config atual) e baixa a base COMPLETA
+    em xlsx, csv ou parquet.
+
+    A base é lida e calculada em blocos e cada bloco já vai para a resposta, sem
+    montar o arquivo em memória. No xlsx, o que passa do limite de linhas do Excel
+    continua em novas planilhas (Base_Calculada_2, ...).
     """
     try:
-        inputs = store.load_inputs(project_id, round_id)
-        df_ben = inputs["benef_df"]
-        if df_ben is None: raise HTTPException(status_code=404, detail="Base não encontrada.")
+        benef_path = store.input_paths(project_id, round_id)["beneficiarios"]
+        if not benef_path.exists(): raise HTTPException(status_code=404, detail="Base não encontrada.")
 
         # Recalcula igual ao preview
         config = payload
         mapping_ben = config["mapping"]["benef_mapping"]
         ref_ts = pd.to_datetime(config.get("ultima_comp_ref"))
         ultima_ref = compute_ultima_competencia_ref(ref_ts)
-        map_clean = {k: v for k, v in mapping_ben.items() if k != "identifier" and v}
-        df_mapped = apply_mapping(df_ben, map_clean)
-        df_calculated = compute_tempo_programa(df_mapped, ultima_ref)
-        
-        # Gera Excel em memória (Buffer)
-        output = io.BytesIO()
-        with pd.ExcelWriter(output, engine='openpyxl') as writer:
-            df_calculated.to_excel(writer, index=False, sheet_name="Base_Calculada")
-        
-        output.seek(0)
-        
-        headers = {
-            'Content-Disposition': 'attachment; filename="base_calculada_completa.xlsx"'
-        }
-        
-        return StreamingResponse(output, media_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', headers=headers)
+        map_clean = sanitize_map(mapping_ben)
 
+        # Valida o mapeamento antes de começar a enviar (depois disso não dá para responder 500)
+        preview_head(benef_path, map_clean, ultima_ref, rows=1)
+    except HTTPException:
+        raise
     except Exception as e:
         import traceback
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=str(e))
 
+    frames = iter_tp_frames(benef_path, map_clean, ultima_ref)
+    if format == "csv":
+        body = stream_csv(frames)
+    elif format == "parquet":
+        body = stream_parquet(frames)
+    else:
+        body = stream_xlsx(frames, sheet_name="Base_Calculada")
+
+    headers = {
+        'Content-Disposition': f'attachment; filename="base_calculada_completa.{format}"'
+    }
+    return StreamingResponse(body, media_type=EXPORT_FORMATS[format], headers=headers)
+
 # --- ROTA DE ANÁLISE (ETL + CÁLCULO) ---
 @app.post("/analysis/run/{project_id}/{round_id}")
 async def run_analysis(project_id: str, round_id: str, config: dict = Body(...)):
-    """Executa o pipeline completo: Mapeamento -> ETL -> Métricas -> AI -> Salvar."""
+    """Enfileira o pipeline completo (Mapeamento -> ETL -> Métricas -> AI -> Salvar) e retorna o job."""
+    p = store.round_paths(project_id, round_id)
+    if not (p.inputs / "beneficiarios.parquet").exists() or not (p.inputs / "ficha.parquet").exists():
+        raise HTTPException(status_code=404, detail="Dados de entrada não encontrados")
+    if "mapping" not in config or "ultima_comp_ref" not in config:
+        raise HTTPException(status_code=422, detail="Configuração incompleta: informe mapping e ultima_comp_ref.")
+
     try:
-        # 1. Carrega inputs
-        inputs = store.load_inputs(project_id, round_id)
-        if inputs["benef_df"] is None or inputs["ficha_df"] is None:
-             raise HTTPException(status_code=404, detail="Dados de entrada não encontrados")
-
-        # 2. Salva configurações
-        store.save_config(
-            project_id, round_id, 
-            mapping=config["mapping"], 
-            analysis_config={"ultima_comp_ref": config["ultima_comp_ref"]},
-            filters=None
-        )
-
-        b_map = config["mapping"]["benef_mapping"]
-        f_map = config["mapping"]["ficha_mapping"]
-        
-        def sanitize_map(mapping):
-            clean = {}
-            for k, v in mapping.items():
-                if k == "identifier": continue
-                if isinstance(v, list):
-                    if len(v) > 0: clean[k] = v[0]
-                elif isinstance(v, str) and v:
-                    clean[k] = v
-            return clean
-
-        # 3. Processamento de Beneficiários (Apenas TP, pois idade pode não estar aqui)
-        clean_b_map = sanitize_map(b_map)
-        benef = apply_mapping(inputs["benef_df"], clean_b_map)
-        
-        ultima_ref = compute_ultima_competencia_ref(pd.Timestamp(config["ultima_comp_ref"]))
-        
-        # Calcula Tempo de Programa (depende da data de inclusão que está no benef)
-        benef = compute_tempo_programa(benef, ultima_ref)
-        
-        # 4. Processamento de Ficha Financeira (Renomeia 'idade' -> 'idade' aqui)
-        clean_f_map = sanitize_map(f_map)
-        ficha = apply_mapping(inputs["ficha_df"], clean_f_map)
-        
-        id_benef = b_map["identifier"][0] if isinstance(b_map["identifier"], list) else b_map["identifier"]
-        id_ficha = f_map["identifier"][0] if isinstance(f_map["identifier"], list) else f_map["identifier"]
+        job = jobs.submit(project_id, round_id, config)
+    except RoundBusy as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return {"status": job["status"], "job_id": job["job_id"]}
+
+@app.get("/analysis/jobs/{job_id}")
+def get_job(job_id: str):
+    """Status e progresso por etapa de um job de análise."""
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job não encontrado")
+    return job
+
+@app.post("/analysis/jobs/{job_id}/cancel")
+def cancel_job(job_id: str):
+    """Cancela um job na fila ou interrompe antes da próxima etapa se já estiver rodando."""
+    job = jobs.cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job não encontrado")
+    return job
 
-        # 5. Consolidação (Join das Tabelas)
-        # O DataFrame 'merged' agora tem colunas do benef (TP, Sexo se tiver) + colunas da ficha (Idade, Custos)
-        merged = consolidate(benef, ficha, id_benef, id_ficha)
-        
-        # Alias para compatibilidade
-        merged["identifier"] = merged["__id__"]
+# --- ROTA DE RESULTADOS (DASHBOARD) ---
+# Perfis das últimas consultas de resultados por rodada (só em memória; o da análise vai para audit/)
+RESULTS_PROFILES: Dict[tuple, deque] = defaultdict(lambda: deque(maxlen=20))
+
+def _remember_profile(project_id: str, round_id: str, profile: dict):
+    RESULTS_PROFILES[(project_id, round_id)].appendleft(profile)
+
+
+def _results_etag(tag: str, arrow: bool, periodo: str, momentoZero: bool, janela: int,
+                  grupos: Optional[List[str]], agrupamento_assistencial: Optional[List[str]]) -> str:
+    """ETag da resposta: versão dos outputs + parâmetros normalizados (listas ordenadas) + formato."""
+    params = {
+        "periodo": periodo,
+        "momentoZero": bool(momentoZero),
+        "janela": int(janela),
+        "grupos": sorted(set(grupos or [])),
+        "agrupamento_assistencial": sorted(set(agrupamento_assistencial or [])),
+        "formato": "arrow" if arrow else "json",
+    }
+    payload = json.dumps([tag, params], sort_keys=True, ensure_ascii=False)
+    return '"' + hashlib.sha256(payload.encode("utf-8")).hexdigest()[:32] + '"'
 
-        # --- CÁLCULO DEMOGRÁFICO CORRIGIDO (MOVIDO PARA CÁ) ---
-        # Agora ele pode acessar a coluna 'idade' que veio da ficha financeira
-        from src.compute import compute_demographics 
-        merged = compute_demographics(merged, ultima_ref)
-        # ------------------------------------------------------
+def _etag_matches(if_none_match, etag: str) -> bool:
+    if not isinstance(if_none_match, str):
+        return False
+    tags = [t.strip() for t in if_none_match.split(",")]
+    return "*" in tags or etag in tags or f"W/{etag}" in tags
 
-        merged = compute_momento_mes(merged)
-        
-        # 6. Conversão Numérica Robusta
-        merged = ensure_numeric_cols(merged)
-        
-        # 7. Geração de Métricas e KPIs
-        res_dentro = pivot_antes_depois(merged, base_total_users=merged["identifier"].nunique(), id_col="identifier")
-        
-        trend = calculate_linear_trend(merged[merged["momento_mes"] > 0])
-        outliers = detect_outliers_user_cost(merged)
-        
-        # 8. Salva Resultados
-        store.save_outputs(
-            project_id, round_id, 
-            consolidated_df=merged, 
-            outliers_df=outliers, 
-            trend_json=trend
-        )
-        
-        return {"status": "success"}
-    except Exception as e:
-        import traceback
-        traceback.print_exc() 
-        raise HTTPException(status_code=500, detail=str(e))
+# Cálculos de resultados em andamento: pedidos idênticos simultâneos esperam o mesmo cálculo
+RESULTS_FLIGHT = SingleFlight()
 
-# --- ROTA DE RESULTADOS (DASHBOARD) ---
 @app.get("/analysis/results/{project_id}/{round_id}")
 async def get_results(
     project_id: str,
@@ -296,171 +329,261 @@ async def get_results(
     # ✅ multi-select (React manda grupos=TP_01&grupos=TP_02...)
     grupos: Optional[List[str]] = Query(None),
     agrupamento_assistencial: Optional[List[str]] = Query(None),
+    accept: Optional[str] = Header(None),
+    if_none_match: Optional[str] = Header(None),
 ):
-    try:
-        outputs = store.load_outputs(project_id, round_id)
-        config = store.load_config(project_id, round_id)
-
-        df = outputs.get("consolidated_df")
-        trend_data = outputs.get("trend") or {}
-
-        ref_date = None
-        if config and config.get("analysis_config"):
-            ref_date = config["analysis_config"].get("ultima_comp_ref")
-
-        if df is None:
-            return {"status": "processing", "message": "Análise ainda não processada."}
-
-        df = ensure_numeric_cols(df)
-
-        id_col = "__id__" if "__id__" in df.columns else ("identifier" if "identifier" in df.columns else None)
-        if not id_col:
-            raise ValueError("Não encontrei coluna de ID (__id__ ou identifier) no consolidated_df.")
-
-        # =====================================================================================
-        # 1) BASE DE VIDAS (COORTE) -> usada pra "N. Usuários Base total" (igual antigo)
-        # =====================================================================================
-        base = df.drop_duplicates(subset=[id_col]).copy()
-
-        # Excluir não elegíveis (se existir status)
-        if "tempo_programa_status" in base.columns:
-            base = base[base["tempo_programa_status"].fillna("") == "OK"]
-
-        # Filtro por grupos (TP) na base (coorte)
-        if grupos and "grupos" in base.columns:
-            base = base[base["grupos"].isin(grupos)]
-
-        # Aqui NÃO aplicamos agrupamento_assistencial na base, porque é evento (assistencial) e não "vida".
-        # Se você quiser "base por assistencial", aí a base deixa de ser coorte e vira "vida com evento daquele assistencial".
-
-        base_total_users = int(base[id_col].nunique())
-
-        # =====================================================================================
-        # 2) DATASET DE EVENTOS (linhas) -> aqui aplicamos assistencial, dentro/fora por TP individual etc.
-        # =====================================================================================
-        dff = df.copy()
-
-        # Mantém só vidas elegíveis (pra bater com o antigo)
-        if "tempo_programa_status" in dff.columns:
-            dff = dff[dff["tempo_programa_status"].fillna("") == "OK"]
-
-        # Filtro por grupos (TP)
-        if grupos and "grupos" in dff.columns:
-            dff = dff[dff["grupos"].isin(grupos)]
-
-        # Filtro por agrupamento assistencial (multi)
-        if agrupamento_assistencial and "agrupamento_assistencial" in dff.columns:
-            dff = dff[dff["agrupamento_assistencial"].isin(agrupamento_assistencial)]
-
-        # Momento zero
-        if "momento_mes" in dff.columns and not momentoZero:
-            dff = dff[dff["momento_mes"] != 0]
-
-        # ==========================
-        # Dentro/Fora RESPEITANDO TP
-        # ==========================
-        if "momento_mes" in dff.columns and periodo != "ambos":
-            # precisa ter tempo_programa pra respeitar janela individual
-            if "tempo_programa" not in dff.columns:
-                raise ValueError("Não existe coluna tempo_programa no consolidated_df. Sem isso não dá pra respeitar TP por vida.")
-
-            tp = pd.to_numeric(dff["tempo_programa"], errors="coerce")
-            win = tp.clip(lower=0).fillna(0).astype(int)
-            win = np.minimum(win, int(janela))
-
-            m = pd.to_numeric(dff["momento_mes"], errors="coerce").fillna(0).astype(int)
-            inside = (m.abs() <= win)
-
-            if periodo == "dentro":
-                dff = dff[inside]
-            elif periodo == "fora":
-                dff = dff[~inside]
-            else:
-                # valor inválido -> assume "dentro"
-                dff = dff[inside]
-
-        # =====================================================================================
-        # 3) KPIs / Comparative / Timeline (AGORA sobre dff)
-        # =====================================================================================
-        total_vidas_com_evento = int(dff[id_col].nunique())
-        custo_total = float(dff["custos"].sum()) if "custos" in dff.columns else 0.0
-        pmpm = (custo_total / base_total_users) if base_total_users > 0 else 0.0  # ✅ base total (igual antigo)
-
-        comparative = pivot_antes_depois(
-            dff,
-            base_total_users=base_total_users,   # ✅ coorte, não "vida com evento"
-            id_col=id_col
-        )
-
-        # Timeline (sobre dff)
-        if "momento_mes" in dff.columns and "custos" in dff.columns:
-            timeline = (
-                dff[dff["momento_mes"] > 0]
-                .groupby("momento_mes")["custos"]
-                .sum()
-                .reset_index()
-                .sort_values("momento_mes")
-            )
-        else:
-            timeline = pd.DataFrame({"momento_mes": [], "custos": []})
-
-        # Raw data (demográfico) -> envia da BASE (coorte), não de dff (evento)
-        cols_interest = ["sexo", "idade", "faixa_etaria", "tempo_programa", "grupos", "nascimento"]
-        cols_to_keep = [id_col] + [c for c in cols_interest if c in base.columns]
-
-        unique_lives_df = base[cols_to_keep].copy()
-        unique_lives_df = unique_lives_df.fillna({
-            "sexo": "N/I",
-            "faixa_etaria": "N/I",
-            "grupos": "N/I",
-            "tempo_programa": 0,
-            "idade": 0
-        })
-        demographic_sample = unique_lives_df.to_dict(orient="records")
+    """
+    KPIs, comparativo Antes/Depois, timeline e perfil demográfico da rodada.
+    Com `Accept: application/vnd.apache.arrow.stream`, comparativo e timeline
+    vêm como tabelas Arrow IPC e o restante como JSON no metadata do stream.
 
-        return {
-            "status": "success",
-            "meta": {"ref_date": ref_date},
-            "kpis": {
-                "lives": base_total_users,                 # ✅ base total elegível
-                "lives_with_events": total_vidas_com_evento,  # útil pra auditoria
-                "total_cost": custo_total,
-                "pmpm": float(pmpm),
-                "prediction": trend_data.get("prediction", 0),
-            },
-            "charts": {
-                "timeline": {
-                    "x": timeline["momento_mes"].tolist() if "momento_mes" in timeline.columns else [],
-                    "y": timeline["custos"].tolist() if "custos" in timeline.columns else [],
-                },
-                "trend": trend_data,
-            },
-            "raw_data": demographic_sample,
-            "comparative": comparative,
-        }
+    A resposta leva um ETag (versão dos outputs + parâmetros normalizados):
+    `If-None-Match` com o mesmo ETag recebe 304, respostas já calculadas saem
+    do cache e pedidos idênticos simultâneos compartilham um único cálculo.
+    """
+    arrow = accepts_arrow(accept)
+    version = store.output_version(project_id, round_id)
+    tag = store.outputs_tag(project_id, round_id, version)
+    if tag is None:
+        return {"status": "processing", "message": "Análise ainda não processada."}
 
+    etag = _results_etag(tag, arrow, periodo, momentoZero, janela, grupos, agrupamento_assistencial)
+    headers = {"ETag": etag, "Vary": "Accept", "Cache-Control": "no-cache"}
+    if _etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+
+    key = (project_id, round_id, "results", tag, etag)
+
+    def compute():
+        cached = store.results_cache.get(key)
+        if cached is None:
+            cached = _compute_results(project_id, round_id, version, periodo, momentoZero, janela, grupos, agrupamento_assistencial, arrow)
+            if isinstance(cached, tuple):
+                store.results_cache.put(key, cached, len(cached[0]))
+        return cached
+
+    out = await run_in_threadpool(RESULTS_FLIGHT.do, key, compute)
+    if not isinstance(out, tuple):
+        return out
+    body, media_type = out
+    return Response(body, media_type=media_type, headers=headers)
+
+def _compute_results(project_id: str, round_id: str, version: Optional[str], periodo: str, momentoZero: bool, janela: int,
+                     grupos: Optional[List[str]], agrupamento_assistencial: Optional[List[str]], arrow: bool):
+    """Resposta de /analysis/results (ver results.compute_results), guardando o perfil da consulta."""
+    try:
+        out, profile = compute_results(project_id, round_id, version, periodo, momentoZero, janela, grupos, agrupamento_assistencial, arrow)
     except Exception as e:
         import traceback
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=str(e))
+    if profile is not None:
+        _remember_profile(project_id, round_id, profile)
+    return out
+
+
+# --- COMPARAÇÃO ENTRE RODADAS ---
+# Processos que calculam os resultados das rodadas fora do cache (criados no 1º uso)
+COMPARE_MAX_WORKERS = int(os.environ.get("COMPARE_MAX_WORKERS", str(min(4, os.cpu_count() or 1))))
+_COMPARE_POOL: Optional[ProcessPoolExecutor] = None
+_COMPARE_POOL_LOCK = threading.Lock()
+
+def _compare_pool() -> ProcessPoolExecutor:
+    global _COMPARE_POOL
+    with _COMPARE_POOL_LOCK:
+        if _COMPARE_POOL is None:
+            # spawn: o servidor é multi-thread, fork poderia herdar locks travados (como em jobs.py)
+            _COMPARE_POOL = ProcessPoolExecutor(max_workers=COMPARE_MAX_WORKERS, mp_context=mp.get_context("spawn"))
+        return _COMPARE_POOL
+
+def _reset_compare_pool(pool: ProcessPoolExecutor):
+    """Descarta o pool quebrado (processo morto, ex.: OOM) para o próximo pedido criar outro."""
+    global _COMPARE_POOL
+    with _COMPARE_POOL_LOCK:
+        if _COMPARE_POOL is pool:
+            _COMPARE_POOL = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+@app.get("/projects/{project_id}/compare")
+async def compare_project_rounds(
+    project_id: str,
+    rodadas: Optional[List[str]] = Query(None),
+    periodo: str = Query("dentro"),
+    momentoZero: bool = Query(False),
+    janela: int = Query(24),
+    grupos: Optional[List[str]] = Query(None),
+    agrupamento_assistencial: Optional[List[str]] = Query(None),
+    accept: Optional[str] = Header(None),
+):
+    """
+    KPIs e timeline de todas as rodadas do projeto (ou só das `rodadas` pedidas)
+    com os mesmos filtros de /analysis/results, alinhados numa tabela por rodada.
+
+    Respostas já calculadas saem do cache de resultados; as demais são
+    calculadas em paralelo num pool de processos (a partir do cubo de cada
+    rodada) e entram no cache, valendo também para o dashboard. Com
+    `Accept: application/vnd.apache.arrow.stream`, a tabela de rodadas e a
+    timeline (uma coluna por rodada) vêm como tabelas Arrow IPC.
+    """
+    if not store.read_project(project_id):
+        raise HTTPException(status_code=404, detail="Projeto não encontrado")
+    rounds = store.list_rounds(project_id)
+    if rodadas:
+        missing = sorted(set(rodadas) - {r["round_id"] for r in rounds})
+        if missing:
+            raise HTTPException(status_code=404, detail=f"Rodadas não encontradas: {', '.join(missing)}")
+        rounds = [r for r in rounds if r["round_id"] in set(rodadas)]
+
+    params = (periodo, momentoZero, janela, grupos, agrupamento_assistencial)
+    results: Dict[str, dict] = {}
+    pending: Dict[str, tuple] = {}
+    reused = 0
+    for meta in rounds:
+        rid = meta["round_id"]
+        version = store.output_version(project_id, rid)
+        tag = store.outputs_tag(project_id, rid, version)
+        if tag is None:
+            results[rid] = {"status": "processing", "message": "Análise ainda não processada."}
+            continue
+        # Mesma chave do cache de /analysis/results (resposta JSON)
+        key = (project_id, rid, "results", tag, _results_etag(tag, False, *params))
+        cached = store.results_cache.get(key)
+        if cached is not None:
+            results[rid] = json.loads(cached[0])
+            reused += 1
+        else:
+            pending[rid] = (key, version)
+
+    if len(pending) == 1:
+        # Uma rodada só: calcula aqui mesmo, sem pagar a ida e volta ao pool
+        rid, (key, version) = next(iter(pending.items()))
+        outs = [await run_in_threadpool(compare_round, project_id, rid, version, *params)]
+    elif pending:
+        pool = _compare_pool()
+        futures = [pool.submit(compare_round, project_id, rid, version, *params) for rid, (key, version) in pending.items()]
+        outs = await asyncio.gather(*(asyncio.wrap_future(f) for f in futures), return_exceptions=True)
+        if any(isinstance(out, BrokenProcessPool) for out in outs):
+            _reset_compare_pool(pool)
+    else:
+        outs = []
+
+    for (rid, (key, version)), res in zip(pending.items(), outs):
+        if isinstance(res, BaseException):
+            results[rid] = {"status": "error", "message": str(res) or type(res).__name__}
+            continue
+        # Os spans da consulta voltam do worker e entram no perfil da rodada (/analysis/profile)
+        out, profile = res
+        if profile is not None:
+            _remember_profile(project_id, rid, profile)
+        if isinstance(out, tuple):
+            store.results_cache.put(key, out, len(out[0]))
+            results[rid] = json.loads(out[0])
+        else:
+            results[rid] = out
+
+    response = {
+        "status": "success",
+        "project_id": project_id,
+        "filters": {
+            "periodo": periodo,
+            "momentoZero": momentoZero,
+            "janela": janela,
+            "grupos": grupos,
+            "agrupamento_assistencial": agrupamento_assistencial,
+        },
+        **compare_rounds(rounds, results),
+        "cache": {"reused": reused, "computed": len(pending)},
+    }
+    if accepts_arrow(accept):
+        timeline = response.pop("timeline")
+        wide = pd.DataFrame({"momento_mes": timeline["x"]})
+        for s in timeline["series"]:
+            wide[s["round_id"]] = pd.Series(s["y"], dtype="float64")
+        tables = {"rounds": pd.DataFrame(response.pop("rounds")), "timeline": wide}
+        return Response(arrow_ipc(tables, response), media_type=ARROW_STREAM, headers={"Vary": "Accept"})
+    return response
+
+# --- VIDAS DA COORTE (paginado) ---
+@app.get("/analysis/lives/{project_id}/{round_id}")
+def get_lives(
+    project_id: str,
+    round_id: str,
+    grupos: Optional[List[str]] = Query(None),
+    colunas: Optional[List[str]] = Query(None),
+    offset: int = Query(0, ge=0),
+    limit: int = Query(1000, ge=1, le=50_000),
+    accept: Optional[str] = Header(None),
+):
+    """
+    Vidas elegíveis da coorte (uma linha por vida), paginadas e só com as
+    `colunas` pedidas (padrão: todas as demográficas). Para as telas que
+    precisam das vidas em si; os gráficos usam `demographics` de /analysis/results.
+    Com `Accept: application/vnd.apache.arrow.stream`, as linhas vêm em Arrow IPC.
+    """
+    version = store.output_version(project_id, round_id)
+    base = load_cohort(project_id, round_id, grupos, version, cube=store.load_cube(project_id, round_id, version=version))
+    if base is None:
+        return {"status": "processing", "message": "Análise ainda não processada."}
+
+    id_col = "__id__" if "__id__" in base.columns else "identifier"
+    available = [c for c in LIVES_COLS if c in base.columns]
+    unknown = [c for c in (colunas or []) if c not in available]
+    if unknown:
+        raise HTTPException(status_code=422, detail=f"Colunas indisponíveis: {unknown}. Disponíveis: {available}")
+    cols = [id_col] + [c for c in (colunas or available) if c != id_col]
+
+    page = base.iloc[offset:offset + limit][cols]
+    page = page.fillna({"sexo": "N/I", "faixa_etaria": "N/I", "grupos": "N/I", "tempo_programa": 0, "idade": 0})
+    meta = {"status": "success", "total": int(len(base)), "offset": offset, "limit": limit, "columns": cols}
+    if accepts_arrow(accept):
+        return Response(arrow_ipc({"rows": page}, meta), media_type=ARROW_STREAM, headers={"Vary": "Accept"})
+
+    # Datas tipadas voltam no formato do arquivo de origem (dd/mm/aaaa)
+    for c in page.columns:
+        if pd.api.types.is_datetime64_any_dtype(page[c]):
+            col = page[c]
+            page[c] = col.dt.strftime("%d/%m/%Y").where(col.notna(), None)
+    return {**meta, "rows": page.to_dict(orient="records")}
+
+
+# --- PERFIL DE EXECUÇÃO (tempo/memória por etapa) ---
+@app.get("/analysis/profile/{project_id}/{round_id}")
+async def get_profile(project_id: str, round_id: str, limit: int = Query(5, ge=1, le=50)):
+    """
+    Spans por etapa (tempo, CPU, linhas, memória) das últimas execuções da
+    análise (gravados em audit/) e das últimas consultas de resultados deste processo.
+    """
+    runs = store.load_profiles(project_id, round_id, kind="run", limit=limit)
+    return {
+        "status": "success",
+        "run": runs[0] if runs else None,
+        "previous_runs": runs[1:],
+        "results": list(RESULTS_PROFILES.get((project_id, round_id), []))[:limit],
+    }
 
 
 # --- OPTIONS PARA FILTROS (Dropdowns) ---
 @app.get("/analysis/filter-options/{project_id}/{round_id}")
 async def get_filter_options(project_id: str, round_id: str):
-    outputs = store.load_outputs(project_id, round_id)
-    df = outputs.get("consolidated_df")
-    if df is None:
-        return {"status": "processing", "message": "Análise ainda não processada."}
-
-    opts = {}
+    """
+    Valores de cada dimensão filtrável (FILTER_DIMS) com nº de linhas, vidas e
+    custo, lidos do dicionário gravado junto dos outputs.
+    """
+    counts = store.load_filter_options(project_id, round_id)
+    if counts is None:
+        # Rodada processada antes do dicionário existir: calcula só com as colunas necessárias
+        outputs = store.load_outputs(project_id, round_id, columns=RESULT_ID_COLS + FILTER_DIMS + ["custos", "custos_num"])
+        df = outputs.get("consolidated_df")
+        if df is None:
+            return {"status": "processing", "message": "Análise ainda não processada."}
+        counts = build_filter_options(df)
 
-    if "grupos" in df.columns:
-        opts["grupos"] = sorted([x for x in df["grupos"].dropna().unique().tolist()])
+    opts = {dim: [item["valor"] for item in items] for dim, items in counts.items()}
+    return {"status": "success", "options": opts, "counts": counts}
 
-    if "agrupamento_assistencial" in df.columns:
-        opts["agrupamento_assistencial"] = sorted(
-            [x for x in df["agrupamento_assistencial"].dropna().unique().tolist()]
-        )
 
-    return {"status": "success", "options": opts}
+# --- DIAGNÓSTICO ---
+@app.get("/cache/stats")
+def get_cache_stats():
+    """Contadores dos caches em memória de outputs e de respostas (hits, misses, bytes ocupados)."""
+    return {"outputs": store.outputs_cache.stats(), "results": store.results_cache.stats()}
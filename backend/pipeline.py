@@ -0,0 +1,188 @@
+from __future__ import annotations
+
+from typing import Callable, Optional
+
+import pandas as pd
+import pyarrow.parquet as pq
+
+from database import store
+from src.mapping import apply_mapping, sanitize_map
+from src.compute import build_id_index, consolidate, compute_tempo_programa, compute_ultima_competencia_ref, compute_momento_mes, compute_demographics
+from src.metrics import pivot_antes_depois, ensure_numeric_cols
+from src.cube import build_results_cube, build_filter_options
+from src.prediction import calculate_linear_trend
+from src.outliers import detect_outliers_user_cost
+from src.schema import CONCEPT_TYPES, type_inputs, to_arrow
+from src.profiling import Profiler
+
+# Etapas reportadas no progresso dos jobs (na ordem em que rodam)
+STAGES = ["mapping", "tp", "merge", "demographics", "momento", "metrics", "save"]
+
+# Entra na chave do cache de etapas: incrementar quando o cálculo de alguma etapa mudar
+PIPELINE_VERSION = 3
+
+
+def _input_hashes(project_id: str, round_id: str) -> dict:
+    meta = store.load_inputs_meta(project_id, round_id) or {}
+    return {name: (meta.get(name) or {}).get("sha256") for name in ["beneficiarios", "ficha"]}
+
+
+def _typed_input(project_id: str, round_id: str, name: str, sha: Optional[str], clean_map: dict, cache_stats: dict) -> pd.DataFrame:
+    """
+    Input tipado (datas, números e categóricas) para o mapeamento confirmado.
+
+    A tipagem roda uma vez por arquivo + mapeamento e fica no cache de etapas;
+    o texto bruto de inputs/ segue disponível apenas para auditoria.
+    """
+    key = store.stage_cache.key("typed", PIPELINE_VERSION, sha, clean_map, CONCEPT_TYPES) if sha else None
+    df = store.stage_cache.load(f"typed_{name}", key)
+    cache_stats[f"typed_{name}"] = "hit" if df is not None else "miss"
+    if df is not None:
+        return df
+
+    path = store.input_paths(project_id, round_id)[name]
+    if not path.exists():
+        raise FileNotFoundError("Dados de entrada não encontrados")
+    raw = pd.read_parquet(path)
+    df = type_inputs(raw, clean_map)
+    store.stage_cache.save(f"typed_{name}", key, to_arrow(df))
+    return df
+
+
+def _id_index(project_id: str, round_id: str, hashes: dict, id_benef: str, id_ficha: str) -> dict:
+    """
+    Dicionário do identificador da rodada (ver build_id_index), persistido junto
+    dos inputs. Só é refeito quando os arquivos ou as colunas de id mudam.
+    """
+    fingerprint = None
+    if all(hashes.values()):
+        fingerprint = store.stage_cache.key("id_index", PIPELINE_VERSION, hashes["beneficiarios"], hashes["ficha"], id_benef, id_ficha)
+    index = store.load_id_index(project_id, round_id, fingerprint)
+    if index is None:
+        # Lê só as colunas de id dos Parquets de entrada (mesma ordem de linhas dos inputs tipados)
+        paths = store.input_paths(project_id, round_id)
+        benef_ids = pq.read_table(paths["beneficiarios"], columns=[id_benef]).column(0).to_pandas()
+        ficha_ids = pq.read_table(paths["ficha"], columns=[id_ficha]).column(0).to_pandas()
+        index = build_id_index(benef_ids, ficha_ids)
+        if fingerprint:
+            store.save_id_index(project_id, round_id, index, fingerprint)
+    return index
+
+
+def run_pipeline(project_id: str, round_id: str, config: dict, on_stage: Optional[Callable[[str], None]] = None) -> dict:
+    """Executa o pipeline completo: Mapeamento -> ETL -> Métricas -> AI -> Salvar.
+
+    `on_stage` é chamado no início de cada etapa de STAGES (usado pelos jobs
+    para reportar progresso e checar cancelamento). Cada etapa vira um span
+    (tempo, CPU, linhas, memória) gravado em audit/ da rodada, inclusive
+    quando a execução falha ou é cancelada.
+    """
+    prof = Profiler("run", track_peak=True)
+
+    def stage(name: str, rows_in: Optional[int] = None):
+        if on_stage is not None:
+            on_stage(name)
+        prof.step(name, rows_in=rows_in)
+
+    try:
+        result = _run_stages(project_id, round_id, config, stage, prof)
+    except BaseException as e:
+        store.save_profile(project_id, round_id, prof.finish(status="failed", error=str(e) or type(e).__name__))
+        raise
+    profile = prof.finish(status="success", rows=result["rows"], cache=result["cache"])
+    store.save_profile(project_id, round_id, profile)
+    result["peak_rss_mb"] = {span["name"]: span["peak_rss_mb"] for span in profile["spans"]}
+    return result
+
+
+def _run_stages(project_id: str, round_id: str, config: dict, stage: Callable, prof: Profiler) -> dict:
+    stage("mapping")
+    # 1. Salva configurações
+    store.save_config(
+        project_id, round_id,
+        mapping=config["mapping"],
+        analysis_config={"ultima_comp_ref": config["ultima_comp_ref"]},
+        filters=None
+    )
+
+    b_map = config["mapping"]["benef_mapping"]
+    f_map = config["mapping"]["ficha_mapping"]
+    clean_b_map = sanitize_map(b_map)
+    clean_f_map = sanitize_map(f_map)
+
+    id_benef = b_map["identifier"][0] if isinstance(b_map["identifier"], list) else b_map["identifier"]
+    id_ficha = f_map["identifier"][0] if isinstance(f_map["identifier"], list) else f_map["identifier"]
+
+    ultima_ref = compute_ultima_competencia_ref(pd.Timestamp(config["ultima_comp_ref"]))
+
+    # 2. Chaves do cache de etapas: hashes dos inputs + campos de configuração de cada etapa.
+    # Sem inputs_hash.json (rodadas antigas) não há chave e tudo é recalculado.
+    cache = store.stage_cache
+    cache_stats: dict = {}
+    hashes = _input_hashes(project_id, round_id)
+    k_benef = cache.key("benef_tp", PIPELINE_VERSION, hashes["beneficiarios"], clean_b_map, ultima_ref) if hashes["beneficiarios"] else None
+    k_cons = cache.key("consolidated", PIPELINE_VERSION, k_benef, hashes["ficha"], clean_f_map, id_benef, id_ficha) if (k_benef and hashes["ficha"]) else None
+
+    index = _id_index(project_id, round_id, hashes, id_benef, id_ficha)
+
+    merged = cache.load("consolidated", k_cons)
+    cache_stats["consolidated"] = "hit" if merged is not None else "miss"
+    if merged is None:
+        # 3. Processamento de Beneficiários (Apenas TP, pois idade pode não estar aqui)
+        stage("tp")
+        benef = cache.load("benef_tp", k_benef)
+        cache_stats["benef_tp"] = "hit" if benef is not None else "miss"
+        if benef is None:
+            benef = apply_mapping(_typed_input(project_id, round_id, "beneficiarios", hashes["beneficiarios"], clean_b_map, cache_stats), clean_b_map)
+            # Calcula Tempo de Programa (depende da data de inclusão que está no benef)
+            benef = compute_tempo_programa(benef, ultima_ref)
+            cache.save("benef_tp", k_benef, benef)
+        prof.rows_out(len(benef))
+
+        # 4. Processamento de Ficha Financeira (Renomeia 'idade' -> 'idade' aqui)
+        ficha = apply_mapping(_typed_input(project_id, round_id, "ficha", hashes["ficha"], clean_f_map, cache_stats), clean_f_map)
+
+        stage("merge", rows_in=len(ficha))
+        # 5. Consolidação (Join das Tabelas)
+        # O DataFrame 'merged' agora tem colunas do benef (TP, Sexo se tiver) + colunas da ficha (Idade, Custos)
+        merged = consolidate(benef, ficha, id_benef, id_ficha, index=index)
+        del benef, ficha
+
+        # Alias para compatibilidade
+        merged["identifier"] = merged["__id__"]
+        prof.rows_out(len(merged))
+
+        stage("demographics", rows_in=len(merged))
+        # Cálculo demográfico depois do join: a coluna 'idade' vem da ficha financeira
+        merged = compute_demographics(merged, ultima_ref)
+
+        stage("momento", rows_in=len(merged))
+        merged = compute_momento_mes(merged)
+
+        # 6. Conversão Numérica Robusta
+        merged = ensure_numeric_cols(merged)
+        cache.save("consolidated", k_cons, merged)
+
+    stage("metrics", rows_in=len(merged))
+    # 7. Geração de Métricas e KPIs
+    res_dentro = pivot_antes_depois(merged, base_total_users=merged["identifier"].nunique(), id_col="identifier")
+
+    trend = calculate_linear_trend(merged[merged["momento_mes"] > 0])
+    outliers = detect_outliers_user_cost(merged)
+    cube = build_results_cube(merged)
+    if cube is not None:
+        prof.rows_out(sum(len(part) for part in cube.values()))
+    filter_options = build_filter_options(merged)
+
+    stage("save", rows_in=len(merged))
+    # 8. Salva Resultados
+    store.save_outputs(
+        project_id, round_id,
+        consolidated_df=merged,
+        outliers_df=outliers,
+        trend_json=trend,
+        cube=cube,
+        filter_options=filter_options,
+    )
+
+    return {"status": "success", "rows": int(merged.shape[0]), "cache": cache_stats, "join": index["stats"]}
@@ -0,0 +1,259 @@
+"""
+Resposta de /analysis/results de uma rodada: KPIs, comparativo Antes/Depois,
+timeline e perfil demográfico, a partir do cubo (ou do consolidated.parquet).
+
+Fica fora de main.py para rodar tanto nas threads da API quanto nos processos
+do pool de comparação entre rodadas (como pipeline.py para os jobs), sem que
+cada processo importe o app.
+"""
+from __future__ import annotations
+
+import traceback
+from typing import Any, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+from database import store
+from src.metrics import pivot_antes_depois, comparative_rows
+from src.cube import query_results_cube, demographic_summary, LIVES_COLS
+from src.export import ARROW_STREAM, arrow_ipc
+from src.profiling import Profiler
+
+# Colunas do consolidated.parquet lidas quando a rodada não tem cubo
+RESULT_ID_COLS = ["__id__", "identifier"]
+RESULT_EVENT_COLS = ["tempo_programa_status", "grupos", "agrupamento_assistencial", "momento_mes", "tempo_programa", "antes_depois", "custos", "qtde_usada", "custos_num", "qtde_usada_num"]
+
+def load_cohort(project_id: str, round_id: str, grupos: Optional[List[str]], version: Optional[str], cube: Optional[dict] = None) -> Optional[pd.DataFrame]:
+    """Base de vidas (coorte): uma linha por vida elegível, filtrada por grupos, com as colunas demográficas."""
+    if cube is not None:
+        lives = cube["lives"]
+        if grupos and "grupos" in lives.columns:
+            lives = lives[lives["grupos"].isin(grupos)]
+        return lives
+
+    # Sem filtros na leitura: a coorte é a primeira linha de cada vida (como no cubo),
+    # e só depois dela saem os não elegíveis e os grupos fora do filtro
+    lives_df = store.load_outputs(project_id, round_id, columns=RESULT_ID_COLS + ["tempo_programa_status"] + LIVES_COLS,
+                                  version=version)["consolidated_df"]
+    if lives_df is None:
+        return None
+    id_col = "__id__" if "__id__" in lives_df.columns else "identifier"
+    base = lives_df.drop_duplicates(subset=[id_col])
+
+    # Excluir não elegíveis (se existir status)
+    if "tempo_programa_status" in base.columns:
+        base = base[base["tempo_programa_status"].fillna("") == "OK"]
+
+    # Filtro por grupos (TP) na base (coorte)
+    if grupos and "grupos" in base.columns:
+        base = base[base["grupos"].isin(grupos)]
+    return base
+
+
+def compute_results(project_id: str, round_id: str, version: Optional[str], periodo: str, momentoZero: bool, janela: int,
+                    grupos: Optional[List[str]], agrupamento_assistencial: Optional[List[str]], arrow: bool) -> Tuple[Any, Optional[dict]]:
+    """
+    Calcula a resposta de /analysis/results sobre a versão `version` dos outputs.
+
+    Devolve (resposta, perfil): a resposta é (corpo, media type), ou o dict de
+    "processing" (sem perfil) se a rodada ainda não tem outputs; o perfil são os
+    spans da consulta, guardados por quem chamou.
+    """
+    prof = Profiler("results")
+    prof.step("load_config")
+    config = store.load_config(project_id, round_id)
+
+    ref_date = None
+    if config and config.get("analysis_config"):
+        ref_date = config["analysis_config"].get("ultima_comp_ref")
+
+    prof.step("load_cube")
+    # Todas as leituras abaixo usam a mesma versão dos outputs (uma análise pode publicar outra no meio)
+    cube = store.load_cube(project_id, round_id, version=version)
+    if cube is not None:
+        # Caminho rápido: KPIs, comparativo e timeline saem do cubo pré-agregado
+        trend_data = store.load_trend(project_id, round_id, version=version) or {}
+        prof.step("query_cube", rows_in=len(cube["events"]))
+        q = query_results_cube(
+            cube,
+            periodo=periodo,
+            momentoZero=momentoZero,
+            janela=janela,
+            grupos=grupos,
+            agrupamento_assistencial=agrupamento_assistencial,
+        )
+        base = q["lives"]
+        id_col = base.columns[0]
+        base_total_users = q["base_total_users"]
+        total_vidas_com_evento = q["lives_with_events"]
+        custo_total = q["total_cost"]
+        comparative = comparative_rows(q["by_label"], base_total_users=base_total_users)
+        timeline = q["timeline"]
+        prof.rows_out(len(base))
+    else:
+        # Sem cubo: lê só as colunas usadas, com elegibilidade/grupos/assistencial
+        # empurrados para o leitor Parquet (os filtros abaixo continuam valendo em memória)
+        eligible = [("tempo_programa_status", "==", "OK")]
+        if grupos:
+            eligible.append(("grupos", "in", list(grupos)))
+        event_filters = list(eligible)
+        if agrupamento_assistencial:
+            event_filters.append(("agrupamento_assistencial", "in", list(agrupamento_assistencial)))
+
+        prof.step("load_events")
+        outputs = store.load_outputs(project_id, round_id, columns=RESULT_ID_COLS + RESULT_EVENT_COLS, filters=event_filters, version=version)
+        df = outputs.get("consolidated_df")
+        trend_data = outputs.get("trend") or {}
+
+        if df is None:
+            return {"status": "processing", "message": "Análise ainda não processada."}, None
+
+        # custos/qtde_usada já vêm numéricos do pipeline (convertidos uma vez, nos inputs tipados)
+
+        id_col = "__id__" if "__id__" in df.columns else ("identifier" if "identifier" in df.columns else None)
+        if not id_col:
+            raise ValueError("Não encontrei coluna de ID (__id__ ou identifier) no consolidated_df.")
+
+        # =====================================================================================
+        # 1) BASE DE VIDAS (COORTE) -> usada pra "N. Usuários Base total" (igual antigo)
+        # =====================================================================================
+        prof.rows_out(len(df))
+        prof.step("load_lives")
+        base = load_cohort(project_id, round_id, grupos, version)
+
+        # Aqui NÃO aplicamos agrupamento_assistencial na base, porque é evento (assistencial) e não "vida".
+        # Se você quiser "base por assistencial", aí a base deixa de ser coorte e vira "vida com evento daquele assistencial".
+
+        base_total_users = int(base[id_col].nunique())
+
+        # =====================================================================================
+        # 2) DATASET DE EVENTOS (linhas) -> aqui aplicamos assistencial, dentro/fora por TP individual etc.
+        # =====================================================================================
+        prof.rows_out(len(base))
+
+        # Sem cópia: os filtros abaixo geram novos frames e não alteram o cache de outputs
+        prof.step("filter_events", rows_in=len(df))
+        dff = df
+
+        # Mantém só vidas elegíveis (pra bater com o antigo)
+        if "tempo_programa_status" in dff.columns:
+            dff = dff[dff["tempo_programa_status"].fillna("") == "OK"]
+
+        # Filtro por grupos (TP)
+        if grupos and "grupos" in dff.columns:
+            dff = dff[dff["grupos"].isin(grupos)]
+
+        # Filtro por agrupamento assistencial (multi)
+        if agrupamento_assistencial and "agrupamento_assistencial" in dff.columns:
+            dff = dff[dff["agrupamento_assistencial"].isin(agrupamento_assistencial)]
+
+        # Momento zero
+        if "momento_mes" in dff.columns and not momentoZero:
+            dff = dff[dff["momento_mes"] != 0]
+
+        # ==========================
+        # Dentro/Fora RESPEITANDO TP
+        # ==========================
+        if "momento_mes" in dff.columns and periodo != "ambos":
+            # precisa ter tempo_programa pra respeitar janela individual
+            if "tempo_programa" not in dff.columns:
+                raise ValueError("Não existe coluna tempo_programa no consolidated_df. Sem isso não dá pra respeitar TP por vida.")
+
+            tp = pd.to_numeric(dff["tempo_programa"], errors="coerce")
+            win = tp.clip(lower=0).fillna(0).astype(int)
+            win = np.minimum(win, int(janela))
+
+            m = pd.to_numeric(dff["momento_mes"], errors="coerce").fillna(0).astype(int)
+            inside = (m.abs() <= win)
+
+            if periodo == "dentro":
+                dff = dff[inside]
+            elif periodo == "fora":
+                dff = dff[~inside]
+            else:
+                # valor inválido -> assume "dentro"
+                dff = dff[inside]
+
+        # =====================================================================================
+        # 3) KPIs / Comparative / Timeline (AGORA sobre dff)
+        # =====================================================================================
+        prof.rows_out(len(dff))
+        prof.step("aggregate", rows_in=len(dff))
+        total_vidas_com_evento = int(dff[id_col].nunique())
+        custo_total = float(dff["custos"].sum()) if "custos" in dff.columns else 0.0
+
+        comparative = pivot_antes_depois(
+            dff,
+            base_total_users=base_total_users,   # ✅ coorte, não "vida com evento"
+            id_col=id_col
+        )
+
+        # Timeline (sobre dff)
+        if "momento_mes" in dff.columns and "custos" in dff.columns:
+            timeline = (
+                dff[dff["momento_mes"] > 0]
+                .groupby("momento_mes")["custos"]
+                .sum()
+                .reset_index()
+                .sort_values("momento_mes")
+            )
+        else:
+            timeline = pd.DataFrame({"momento_mes": [], "custos": []})
+
+    pmpm = (custo_total / base_total_users) if base_total_users > 0 else 0.0  # ✅ base total (igual antigo)
+
+    # Perfil demográfico -> agregado da BASE (coorte), não de dff (evento); as vidas em si ficam em /analysis/lives
+    prof.step("demographics", rows_in=len(base))
+    demographics = demographic_summary(base)
+
+    response = {
+        "status": "success",
+        "meta": {"ref_date": ref_date},
+        "kpis": {
+            "lives": base_total_users,                 # ✅ base total elegível
+            "lives_with_events": total_vidas_com_evento,  # útil pra auditoria
+            "total_cost": custo_total,
+            "pmpm": float(pmpm),
+            "prediction": trend_data.get("prediction", 0),
+        },
+        "charts": {
+            "timeline": {
+                "x": timeline["momento_mes"].tolist() if "momento_mes" in timeline.columns else [],
+                "y": timeline["custos"].tolist() if "custos" in timeline.columns else [],
+            },
+            "trend": trend_data,
+        },
+        "demographics": demographics,
+        "comparative": comparative,
+    }
+    if arrow:
+        prof.step("serialize_arrow")
+        tables = {
+            "comparative": pd.DataFrame(response.pop("comparative")),
+            "timeline": timeline[[c for c in ["momento_mes", "custos"] if c in timeline.columns]],
+        }
+        response["charts"] = {k: v for k, v in response["charts"].items() if k != "timeline"}
+        out = (arrow_ipc(tables, response), ARROW_STREAM)
+    else:
+        prof.step("serialize_json")
+        out = (JSONResponse(jsonable_encoder(response)).body, "application/json")
+    return out, prof.finish(status="success", path="cube" if cube is not None else "consolidated")
+
+
+def compare_round(project_id: str, round_id: str, version: Optional[str], periodo: str, momentoZero: bool, janela: int,
+                  grupos: Optional[List[str]], agrupamento_assistencial: Optional[List[str]]) -> Tuple[Any, Optional[dict]]:
+    """
+    Executado no processo do pool de comparação: resultados (JSON) de uma rodada
+    e o perfil da consulta. Erros voltam como status "error" para não derrubar a
+    comparação inteira.
+    """
+    # Copy-on-write no processo do worker (como em main.py e jobs._run_job)
+    pd.set_option("mode.copy_on_write", True)
+    try:
+        return compute_results(project_id, round_id, version, periodo, momentoZero, janela, grupos, agrupamento_assistencial, False)
+    except Exception as e:
+        traceback.print_exc()
+        return {"status": "error", "message": str(e) or type(e).__name__}, None
@@ -0,0 +1,55 @@
+from __future__ import annotations
+from typing import Dict, List, Optional
+
+# KPIs de cada rodada na tabela comparativa (mesmos campos de "kpis" em /analysis/results)
+KPI_COLS = ["lives", "lives_with_events", "total_cost", "pmpm", "prediction"]
+
+# Linhas do comparativo Antes/Depois levadas para a tabela (coluna "Custo Médio Usuários Total")
+COMPARATIVE_COLS = {"Antes": "custo_medio_antes", "Depois": "custo_medio_depois", "%": "variacao_pct"}
+
+
+def _comparative_value(comparative: list, momento: str) -> Optional[float]:
+    for row in comparative or []:
+        if row.get("Momento") == momento:
+            return row.get("Custo Médio Usuários Total")
+    return None
+
+
+def compare_rounds(rounds: List[dict], results: Dict[str, dict]) -> dict:
+    """
+    Alinha os resultados de várias rodadas de um projeto.
+
+    `rounds` são os metadados das rodadas (na ordem de exibição) e `results`
+    a resposta de /analysis/results de cada uma, por round_id. Devolve uma
+    linha por rodada com os KPIs e o custo médio por vida Antes/Depois, e as
+    timelines sobre o mesmo eixo de momento_mes (None onde a rodada não tem o mês).
+    """
+    table = []
+    series = {}
+    for meta in rounds:
+        rid = meta["round_id"]
+        res = results.get(rid) or {}
+        row = {
+            "round_id": rid,
+            "name": meta.get("name", rid),
+            "competencia": meta.get("competencia", ""),
+            "status": res.get("status", "processing"),
+        }
+        kpis = res.get("kpis") or {}
+        row.update({c: kpis.get(c) for c in KPI_COLS})
+        row.update({col: _comparative_value(res.get("comparative"), momento) for momento, col in COMPARATIVE_COLS.items()})
+        if res.get("status") != "success" and res.get("message"):
+            row["message"] = res["message"]
+        table.append(row)
+
+        timeline = (res.get("charts") or {}).get("timeline") or {}
+        series[rid] = dict(zip(timeline.get("x", []), timeline.get("y", [])))
+
+    x = sorted({m for points in series.values() for m in points})
+    return {
+        "rounds": table,
+        "timeline": {
+            "x": x,
+            "series": [{"round_id": rid, "y": [points.get(m) for m in x]} for rid, points in series.items()],
+        },
+    }
@@ -1,5 +1,4 @@
 from __future__ import annotations
-import math
 import pandas as pd
 import numpy as np
 
@@ -9,64 +8,175 @@ def months_diff(a: pd.Timestamp, b: pd.Timestamp) -> int:
 def compute_ultima_competencia_ref(last_competencia: pd.Timestamp) -> pd.Timestamp:
     return pd.Timestamp(year=last_competencia.year, month=last_competencia.month, day=1)
 
+def _period_ordinal(s: pd.Series) -> np.ndarray:
+    """Converte datas em ordinais de competência (ano*12 + mês), NaN onde não há data."""
+    s = pd.to_datetime(s, errors="coerce", dayfirst=True)
+    return (s.dt.year * 12 + s.dt.month).to_numpy(dtype="float64", na_value=np.nan)
+
 def compute_tempo_programa(df_benef: pd.DataFrame, ultima_comp_ref: pd.Timestamp) -> pd.DataFrame:
-    """Calcula TP e grupos de coortes [cite: 210-218]."""
-    df = df_benef.copy()
-    di = pd.to_datetime(df["data_inclusao"], errors="coerce", dayfirst=True)
-    din = pd.to_datetime(df["data_inativacao"], errors="coerce", dayfirst=True) if "data_inativacao" in df.columns else pd.Series([pd.NaT]*len(df))
-    
-    di_m = di.dt.to_period("M").dt.to_timestamp()
-    din_m = din.dt.to_period("M").dt.to_timestamp()
+    """Calcula TP e grupos de coortes [cite: 210-218].
+
+    Opera sobre a coluna inteira usando ordinais de competência (ano*12 + mês).
+    """
+    df = df_benef.copy(deep=False)
+    inc = _period_ordinal(df["data_inclusao"])
+    if "data_inativacao" in df.columns:
+        fim = _period_ordinal(df["data_inativacao"])
+    else:
+        fim = np.full(len(df), np.nan)
+
     fim_ref = compute_ultima_competencia_ref(ultima_comp_ref)
+    fim = np.where(np.isnan(fim), fim_ref.year * 12 + fim_ref.month, fim)
 
-    tempo, status = [], []
-    for i in range(len(df)):
-        inc = di_m.iloc[i]
-        if pd.isna(inc):
-            tempo.append(np.nan); status.append("SEM DATA INCLUSÃO")
-            continue
-        
-        fim = din_m.iloc[i] if not pd.isna(din_m.iloc[i]) else fim_ref
-        if inc >= fim:
-            tempo.append(np.nan); status.append("DATA DE INCLUSÃO NÃO PERMITE CÁLCULO")
-        else:
-            tp = months_diff(inc, fim)
-            tempo.append(tp); status.append("OK")
-
-    df["tempo_programa"] = tempo
+    sem_inclusao = np.isnan(inc)
+    ok = ~sem_inclusao & (inc < fim)
+
+    status = np.where(ok, "OK", "DATA DE INCLUSÃO NÃO PERMITE CÁLCULO").astype(object)
+    status[sem_inclusao] = "SEM DATA INCLUSÃO"
+    tempo = np.where(ok, fim - inc, np.nan)
+
+    # Mantém o dtype inteiro quando todas as vidas são elegíveis (igual ao cálculo por linha)
+    df["tempo_programa"] = tempo.astype("int64") if ok.all() else tempo
     df["tempo_programa_status"] = status
-    df["grupos"] = [f"TP_{int(tp):02d}" if s == "OK" else "Não Elegível" for tp, s in zip(tempo, status)]
+    grupos = np.full(len(df), "Não Elegível", dtype=object)
+    if ok.any():
+        grupos[ok] = "TP_" + pd.Series(tempo[ok].astype("int64")).astype(str).str.zfill(2).to_numpy()
+    df["grupos"] = grupos
     return df
 
-def compute_momento_mes(df: pd.DataFrame) -> pd.DataFrame:
-    """Determina o Antes/Depois baseado no mês de inclusão [cite: 219-223]."""
-    df = df.copy()
-    att = pd.to_datetime(df["atendimento"], errors="coerce", dayfirst=True)
-    inc = pd.to_datetime(df["data_inclusao"], errors="coerce", dayfirst=True)
-    
-    momento, antes_depois = [], []
-    for a, i in zip(att, inc):
-        if pd.isna(a) or pd.isna(i):
-            momento.append(np.nan); antes_depois.append("")
-            continue
-        days = (a - i).days
-        m = 0 if days == 0 else int(math.copysign(math.ceil(abs(days) / 30.0), days))
-        momento.append(m)
-        antes_depois.append("Momento zero" if m == 0 else "Antes" if m < 0 else "Depois")
-    
-    df["momento_mes"] = momento
+_NS_PER_DAY = 86_400 * 10**9
+_NAT = np.iinfo("int64").min
+
+def _date_ns(s: pd.Series, dedup: bool) -> tuple[np.ndarray, np.ndarray | None]:
+    """Converte datas em nanossegundos (int64).
+
+    Com `dedup`, só os valores distintos são convertidos e o retorno traz os
+    códigos de cada linha para o array de valores únicos.
+    """
+    if not dedup:
+        return pd.to_datetime(s, errors="coerce", dayfirst=True).to_numpy("datetime64[ns]").view("int64"), None
+    codes, uniques = pd.factorize(s)
+    parsed = pd.to_datetime(pd.Series(uniques), errors="coerce", dayfirst=True)
+    return parsed.to_numpy("datetime64[ns]").view("int64"), codes
+
+def compute_momento_mes(df: pd.DataFrame, dedup: bool = True) -> pd.DataFrame:
+    """Determina o Antes/Depois baseado no mês de inclusão [cite: 219-223].
+
+    Com `dedup=True` o cálculo é feito apenas para os pares distintos
+    (atendimento, data_inclusao) e o resultado é mapeado de volta às linhas.
+    """
+    df = df.copy(deep=False)
+    att_ns, att_codes = _date_ns(df["atendimento"], dedup)
+    inc_ns, inc_codes = _date_ns(df["data_inclusao"], dedup)
+
+    if dedup:
+        # Cada par distinto vira um código; o cálculo roda só sobre os pares únicos.
+        # Código -1 (data ausente) aponta para o NaT anexado ao final de cada array.
+        base = len(inc_ns) + 1
+        pair_codes, pairs = pd.factorize((att_codes.astype("int64") + 1) * base + (inc_codes + 1))
+        a = np.append(att_ns, _NAT)[pairs // base - 1]
+        i = np.append(inc_ns, _NAT)[pairs % base - 1]
+    else:
+        a, i = att_ns, inc_ns
+
+    valid = (a != _NAT) & (i != _NAT)
+    days = np.floor_divide(np.where(valid, a - i, 0), _NS_PER_DAY).astype("float64")
+    momento = np.where(valid, np.sign(days) * np.ceil(np.abs(days) / 30.0), np.nan)
+    antes_depois = np.select(
+        [~valid, momento == 0, momento < 0],
+        ["", "Momento zero", "Antes"],
+        default="Depois",
+    ).astype(object)
+
+    if dedup:
+        momento = momento[pair_codes]
+        antes_depois = antes_depois[pair_codes]
+        valid = valid[pair_codes]
+
+    # Mantém o dtype inteiro quando todas as linhas têm datas válidas
+    df["momento_mes"] = momento.astype("int64") if valid.all() else momento
     df["antes_depois"] = antes_depois
     return df
 
-def consolidate(benef: pd.DataFrame, ficha: pd.DataFrame, id_col_benef: str, id_col_ficha: str) -> pd.DataFrame:
-    """Faz o join das bases usando o identificador [cite: 224-225]."""
-    benef["__id__"] = benef[id_col_benef].astype(str).str.strip()
-    ficha["__id__"] = ficha[id_col_ficha].astype(str).str.strip()
-    return ficha.merge(benef.drop(columns=[id_col_benef]), on="__id__", how="left")
+def _normalize_ids(ids: pd.Series) -> tuple[np.ndarray, np.ndarray]:
+    """Normaliza (astype(str) + strip) só os valores distintos; retorna (códigos por linha, ids normalizados)."""
+    codes, uniques = pd.factorize(ids)
+    norm = pd.Series(uniques, dtype=object).astype(str).str.strip().to_numpy(dtype=object)
+    nulls = codes == -1
+    if nulls.any():
+        # Nulos viram o texto que o astype(str) daria ("None", "nan")
+        null_codes, null_text = pd.factorize(pd.Series(ids.to_numpy()[nulls], dtype=object).astype(str))
+        codes[nulls] = len(norm) + null_codes
+        norm = np.concatenate([norm, np.asarray(null_text, dtype=object)])
+    return codes, norm
+
+def build_id_index(benef_ids: pd.Series, ficha_ids: pd.Series) -> dict:
+    """
+    Dicionário do identificador (id normalizado -> código int32) das duas bases.
+
+    Retorna {"ids": ids normalizados (posição = código), "benef": códigos das
+    linhas do benef, "ficha": códigos das linhas da ficha, "stats": cruzamento}.
+    """
+    b_codes, b_norm = _normalize_ids(benef_ids)
+    f_codes, f_norm = _normalize_ids(ficha_ids)
+    # Benef primeiro: códigos < n_benef_ids são ids que existem no benef
+    codes, ids = pd.factorize(np.concatenate([b_norm, f_norm]))
+    b_map, f_map = codes[:len(b_norm)], codes[len(b_norm):]
+    benef = b_map[b_codes].astype("int32")
+    ficha = f_map[f_codes].astype("int32")
+
+    n_benef_ids = int(b_map.max()) + 1 if len(b_map) else 0
+    ficha_ids_used = np.unique(ficha)
+    matched_rows = int(np.count_nonzero(ficha < n_benef_ids))
+    stats = {
+        "ids": int(len(ids)),
+        "benef_ids": n_benef_ids,
+        "benef_duplicated_rows": int(len(benef) - len(np.unique(benef))),
+        "ficha_ids": int(len(ficha_ids_used)),
+        "ficha_ids_matched": int(np.count_nonzero(ficha_ids_used < n_benef_ids)),
+        "ficha_ids_missing": int(np.count_nonzero(ficha_ids_used >= n_benef_ids)),
+        "ficha_rows_matched": matched_rows,
+        "ficha_rows_missing": int(len(ficha) - matched_rows),
+        "benef_ids_without_events": int(n_benef_ids - np.count_nonzero(ficha_ids_used < n_benef_ids)),
+    }
+    return {"ids": np.asarray(ids, dtype=object), "benef": benef, "ficha": ficha, "stats": stats}
+
+def consolidate(benef: pd.DataFrame, ficha: pd.DataFrame, id_col_benef: str, id_col_ficha: str, index: dict | None = None) -> pd.DataFrame:
+    """Faz o join das bases usando o identificador [cite: 224-225].
+
+    O join é feito pelos códigos inteiros do `index` (ver build_id_index), com o
+    mesmo resultado do merge left da ficha com o benef pelo id normalizado.
+    """
+    if index is None:
+        index = build_id_index(benef[id_col_benef], ficha[id_col_ficha])
+    b_codes, f_codes = index["benef"], index["ficha"]
+
+    left = ficha.copy(deep=False)
+    left["__id__"] = index["ids"][f_codes]
+    right = benef.drop(columns=[id_col_benef])
+    right = right.drop(columns=[c for c in ["__id__"] if c in right.columns])
+
+    # Colunas com o mesmo nome nas duas bases recebem os sufixos do merge
+    overlap = [c for c in right.columns if c in left.columns]
+    left = left.rename(columns={c: f"{c}_x" for c in overlap})
+    right = right.rename(columns={c: f"{c}_y" for c in overlap})
+
+    if len(np.unique(b_codes)) == len(b_codes):
+        # Id único no benef: a linha do benef de cada evento é uma busca direta por código
+        pos = np.full(len(index["ids"]), -1, dtype="int64")
+        pos[b_codes] = np.arange(len(b_codes))
+        # reindex com -1 (posição inexistente) preenche com nulo, como o merge left
+        matched = right.reset_index(drop=True).reindex(pos[f_codes])
+        return pd.concat([left, matched.set_axis(left.index)], axis=1)
+
+    # Id repetido no benef: cada evento se repete para cada linha do benef (igual ao merge)
+    left["__code__"] = f_codes
+    right["__code__"] = b_codes
+    return left.merge(right, on="__code__", how="left").drop(columns=["__code__"])
 
 def compute_demographics(df: pd.DataFrame, ref_date: pd.Timestamp) -> pd.DataFrame:
     """Calcula Idade e Faixa Etária baseado no nascimento."""
-    out = df.copy()
+    out = df.copy(deep=False)
     
     # 1. Normaliza Sexo (se existir)
     if "sexo" in out.columns:
@@ -0,0 +1,215 @@
+from __future__ import annotations
+import pandas as pd
+import numpy as np
+
+from src.metrics import measures_from_totals, _numeric_arrays
+
+# Dimensões do cubo de eventos (antes_depois é função de momento_mes, não aumenta a cardinalidade)
+CUBE_DIMS = ["grupos", "agrupamento_assistencial", "tempo_programa", "momento_mes", "antes_depois"]
+LIVES_COLS = ["sexo", "idade", "faixa_etaria", "tempo_programa", "grupos", "nascimento"]
+# Dimensões filtráveis do dashboard (dicionário gravado junto dos outputs; basta incluir aqui uma nova)
+FILTER_DIMS = ["grupos", "agrupamento_assistencial", "faixa_etaria", "sexo", "antes_depois"]
+
+def _id_col(df: pd.DataFrame) -> str | None:
+    return "__id__" if "__id__" in df.columns else ("identifier" if "identifier" in df.columns else None)
+
+def build_results_cube(df: pd.DataFrame) -> dict[str, pd.DataFrame] | None:
+    """
+    Materializa os agregados usados pelo dashboard a partir da base consolidada.
+
+    - events: somas de custo/quantidade e nº de linhas por grupos × agrupamento × TP × momento_mes
+    - users: por vida e célula do cubo, o menor e o maior |momento_mes| (contagem exata de vidas distintas)
+    - lives: uma linha por vida elegível (coorte), com as colunas demográficas
+
+    Retorna None se a base não tiver as colunas que o cubo precisa; nesse caso
+    o dashboard continua calculando sobre as linhas.
+    """
+    id_col = _id_col(df)
+    if id_col is None or any(c not in df.columns for c in CUBE_DIMS + ["custos"]):
+        return None
+
+    # Coorte (mesma regra do dashboard: primeira linha de cada vida, só elegíveis)
+    base = df.drop_duplicates(subset=[id_col])
+    ev = df
+    if "tempo_programa_status" in df.columns:
+        base = base[base["tempo_programa_status"].fillna("") == "OK"]
+        ev = df[df["tempo_programa_status"].fillna("") == "OK"]
+    lives = base[[id_col] + [c for c in LIVES_COLS if c in base.columns]].reset_index(drop=True)
+
+    qtd = ev["qtde_usada_num"] if "qtde_usada_num" in ev.columns else pd.Series(1.0, index=ev.index)
+    abs_m = ev["momento_mes"].fillna(0).abs()
+    work = pd.DataFrame({
+        **{c: ev[c] for c in CUBE_DIMS},
+        "user": pd.factorize(ev[id_col])[0].astype("int32"),
+        "custos": ev["custos"],
+        "qtde_usada": qtd,
+        "abs_m": abs_m,
+    })
+
+    events = (
+        work.groupby(CUBE_DIMS, dropna=False, observed=True, sort=False)
+        .agg(custos=("custos", "sum"), qtde_usada=("qtde_usada", "sum"), linhas=("custos", "size"))
+        .reset_index()
+    )
+    users = (
+        work.groupby(["user"] + CUBE_DIMS[:3] + ["antes_depois"], dropna=False, observed=True, sort=False)
+        .agg(min_abs_m=("abs_m", "min"), max_abs_m=("abs_m", "max"))
+        .reset_index()
+    )
+    return {"events": events, "users": users, "lives": lives}
+
+def build_filter_options(df: pd.DataFrame, dims: list[str] = FILTER_DIMS) -> dict[str, list[dict]]:
+    """
+    Dicionário dos filtros: para cada dimensão de `dims` presente na base, os
+    valores distintos (ordenados, sem nulos; o texto vazio é um valor, como nas
+    opções antigas) com nº de linhas, de vidas e custo total.
+    """
+    id_col = _id_col(df)
+    users = pd.factorize(df[id_col])[0] if id_col is not None else np.arange(len(df))
+    custos, _ = _numeric_arrays(df)
+    out = {}
+    for dim in dims:
+        if dim not in df.columns:
+            continue
+        work = pd.DataFrame({"valor": df[dim], "user": users, "custo": custos})
+        g = work.groupby("valor", observed=True, sort=False)
+        stats = pd.DataFrame({
+            "linhas": g.size(),
+            "vidas": work.drop_duplicates(["valor", "user"]).groupby("valor", observed=True, sort=False).size(),
+            "custo": g["custo"].sum(),
+        })
+        items = [
+            {"valor": valor, "linhas": int(row.linhas), "vidas": int(row.vidas), "custo": float(row.custo)}
+            for valor, row in zip(stats.index.tolist(), stats.itertuples(index=False))
+        ]
+        # Categóricas agrupam na ordem das categorias: ordena pelos valores
+        try:
+            items.sort(key=lambda item: item["valor"])
+        except TypeError:
+            items.sort(key=lambda item: str(item["valor"]))
+        out[dim] = items
+    return out
+
+def _filter_cells(cells: pd.DataFrame, grupos, agrupamento_assistencial, momentoZero: bool) -> pd.DataFrame:
+    if grupos:
+        cells = cells[cells["grupos"].isin(grupos)]
+    if agrupamento_assistencial:
+        cells = cells[cells["agrupamento_assistencial"].isin(agrupamento_assistencial)]
+    if not momentoZero:
+        cells = cells[cells["antes_depois"] != "Momento zero"]
+    return cells
+
+def _window(cells: pd.DataFrame, janela: int) -> np.ndarray:
+    tp = pd.to_numeric(cells["tempo_programa"], errors="coerce")
+    return np.minimum(tp.clip(lower=0).fillna(0).astype(int).to_numpy(), int(janela))
+
+def query_results_cube(
+    cube: dict[str, pd.DataFrame],
+    periodo: str = "dentro",
+    momentoZero: bool = False,
+    janela: int = 24,
+    grupos=None,
+    agrupamento_assistencial=None,
+) -> dict:
+    """
+    Responde KPIs, comparativo e timeline do dashboard a partir do cubo,
+    com a mesma semântica do filtro sobre as linhas de evento.
+    """
+    lives = cube["lives"]
+    if grupos and "grupos" in lives.columns:
+        lives = lives[lives["grupos"].isin(grupos)]
+    base_total_users = int(lives.iloc[:, 0].nunique())
+
+    events = _filter_cells(cube["events"], grupos, agrupamento_assistencial, momentoZero)
+    users = _filter_cells(cube["users"], grupos, agrupamento_assistencial, momentoZero)
+
+    if periodo != "ambos":
+        # Evento "dentro" quando |momento_mes| <= min(TP da vida, janela)
+        inside_ev = events["momento_mes"].fillna(0).abs().to_numpy() <= _window(events, janela)
+        win_u = _window(users, janela)
+        if periodo == "fora":
+            events = events[~inside_ev]
+            users = users[users["max_abs_m"].to_numpy() > win_u]
+        else:
+            events = events[inside_ev]
+            users = users[users["min_abs_m"].to_numpy() <= win_u]
+
+    by_label = {}
+    for label in ["Antes", "Depois"]:
+        ev_l = events[events["antes_depois"] == label]
+        n_users = users.loc[users["antes_depois"] == label, "user"].nunique()
+        by_label[label] = measures_from_totals(float(ev_l["custos"].sum()), float(ev_l["qtde_usada"].sum()), int(n_users))
+
+    timeline = (
+        events[events["momento_mes"] > 0]
+        .groupby("momento_mes")["custos"]
+        .sum()
+        .reset_index()
+        .sort_values("momento_mes")
+    )
+
+    return {
+        "base_total_users": base_total_users,
+        "lives_with_events": int(users["user"].nunique()),
+        "total_cost": float(events["custos"].sum()),
+        "by_label": by_label,
+        "timeline": timeline,
+        "lives": lives,
+    }
+
+def _js_round(x: float) -> int:
+    # Mesmo arredondamento do Math.round do front (meio para cima)
+    return int(np.floor(x + 0.5))
+
+def _counts(values: pd.Series) -> dict:
+    return {str(k): int(v) for k, v in values.value_counts(sort=False).items() if v > 0}
+
+def demographic_summary(lives: pd.DataFrame) -> dict:
+    """
+    Distribuições da coorte para a aba de perfil (uma linha por vida em `lives`),
+    com as mesmas regras que o front aplicava sobre as vidas:
+
+    - sexo pela inicial em maiúscula ("N/I" quando vazio) e faixa etária × sexo (pirâmide)
+    - contagem por faixa etária e por grupo de TP; histograma do TP em meses (bincount)
+    - média e quantis da idade (só idades > 0) e média do TP (TP >= 0)
+    """
+    n = len(lives)
+
+    def text(col: str) -> pd.Series:
+        if col not in lives.columns:
+            return pd.Series("N/I", index=lives.index)
+        s = lives[col].astype(object).where(lives[col].notna(), "N/I").astype(str)
+        return s.where(s != "", "N/I")
+
+    sexo = text("sexo")
+    sexo = sexo.where(sexo == "N/I", sexo.str[:1].str.upper())
+    faixa = text("faixa_etaria")
+    grupos = text("grupos")
+
+    idade = pd.to_numeric(lives["idade"], errors="coerce").fillna(0).to_numpy(dtype="float64") if "idade" in lives.columns else np.zeros(n)
+    tp = pd.to_numeric(lives["tempo_programa"], errors="coerce").fillna(0).to_numpy(dtype="float64") if "tempo_programa" in lives.columns else np.zeros(n)
+    idade_ok = idade[idade > 0]
+    tp_ok = tp[tp >= 0]
+
+    piramide = pd.DataFrame({"faixa_etaria": faixa, "sexo": sexo}).groupby(["faixa_etaria", "sexo"], sort=True).size()
+    quantis = np.quantile(idade_ok, [0.1, 0.25, 0.5, 0.75, 0.9]) if len(idade_ok) else [None] * 5
+
+    return {
+        "total_vidas": n,
+        "tem_sexo": bool((sexo != "N/I").any()),
+        "tem_idade": bool((~faixa.isin(["N/I", "Sem Data"])).any()),
+        "sexo": _counts(sexo),
+        "faixa_etaria": _counts(faixa),
+        "piramide": [{"faixa_etaria": f, "sexo": s, "vidas": int(v)} for (f, s), v in piramide.items()],
+        "grupos": dict(sorted(_counts(grupos).items())),
+        "idade": {
+            "media": _js_round(idade_ok.mean()) if len(idade_ok) else 0,
+            "vidas_com_idade": int(len(idade_ok)),
+            "quantis": dict(zip(["p10", "p25", "p50", "p75", "p90"], [None if q is None else float(q) for q in quantis])),
+        },
+        "tempo_programa": {
+            "media": _js_round(tp_ok.mean()) if len(tp_ok) else 0,
+            # vidas por mês de TP (índice = meses)
+            "histograma": np.bincount(tp_ok.astype(np.int64)).tolist() if len(tp_ok) else [],
+        },
+    }
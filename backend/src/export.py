@@ -0,0 +1,276 @@
+from __future__ import annotations
+import io
+import json
+import re
+import zipfile
+from typing import Dict, Iterable, Iterator
+from xml.sax.saxutils import escape
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# Limite de linhas de uma planilha do Excel (inclui o cabeçalho)
+XLSX_MAX_ROWS = 1_048_576
+
+EXPORT_FORMATS = {
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    "csv": "text/csv; charset=utf-8",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+# Resposta tabular em Arrow IPC (negociada pelo cabeçalho Accept; JSON continua o padrão)
+ARROW_STREAM = "application/vnd.apache.arrow.stream"
+
+# Caracteres de controle que o XML não aceita (o Excel recusa o arquivo inteiro)
+_XML_ILLEGAL = re.compile(r"[\x00-\x08\x0b\x0c\x0e-\x1f]")
+
+
+class _Sink(io.RawIOBase):
+    """Arquivo só-escrita que acumula bytes até serem drenados para a resposta."""
+
+    def __init__(self):
+        self._parts = []
+        self._pos = 0
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self._parts.append(bytes(b))
+        self._pos += len(b)
+        return len(b)
+
+    def tell(self):
+        return self._pos
+
+    def drain(self) -> bytes:
+        out = b"".join(self._parts)
+        self._parts = []
+        return out
+
+
+def stream_csv(frames: Iterable[pd.DataFrame], sep: str = ";") -> Iterator[bytes]:
+    """CSV em blocos (UTF-8 com BOM para o Excel abrir com acentos)."""
+    header = True
+    yield "﻿".encode("utf-8")
+    for df in frames:
+        yield df.to_csv(index=False, header=header, sep=sep).encode("utf-8")
+        header = False
+
+
+def stream_parquet(frames: Iterable[pd.DataFrame]) -> Iterator[bytes]:
+    """Parquet com um row group por bloco; os bytes saem a cada bloco escrito."""
+    sink = _Sink()
+    writer = None
+    schema = None
+    for df in frames:
+        if writer is None:
+            # Coluna toda nula no 1º bloco não tem tipo: assume texto
+            schema = pa.Schema.from_pandas(df, preserve_index=False)
+            schema = pa.schema([f.with_type(pa.string()) if pa.types.is_null(f.type) else f for f in schema])
+            writer = pq.ParquetWriter(sink, schema)
+        writer.write_table(pa.Table.from_pandas(df, schema=schema, preserve_index=False))
+        yield sink.drain()
+    if writer is not None:
+        writer.close()
+        yield sink.drain()
+
+
+def _col_letter(i: int) -> str:
+    s = ""
+    i += 1
+    while i:
+        i, r = divmod(i - 1, 26)
+        s = chr(65 + r) + s
+    return s
+
+
+def _cell_xml(values: pd.Series) -> pd.Series:
+    """XML de célula para cada valor (sem o atributo r, que é opcional)."""
+    if pd.api.types.is_bool_dtype(values.dtype):
+        values = values.astype("int8")
+    if pd.api.types.is_numeric_dtype(values.dtype):
+        return '<c><v>' + values.astype(str) + "</v></c>"
+    if pd.api.types.is_datetime64_any_dtype(values.dtype):
+        text = values.dt.strftime("%d/%m/%Y")
+    else:
+        text = values.astype(str)
+    text = text.str.replace(_XML_ILLEGAL, "", regex=True)
+    text = text.str.replace("&", "&amp;", regex=False).str.replace("<", "&lt;", regex=False).str.replace(">", "&gt;", regex=False)
+    return '<c t="inlineStr"><is><t xml:space="preserve">' + text + "</t></is></c>"
+
+
+def _cells(s: pd.Series) -> np.ndarray:
+    """
+    XML das células de uma coluna (<c/> onde não há valor, para manter a posição
+    das colunas seguintes). O XML é montado só para os valores distintos e
+    espalhado pelas linhas.
+    """
+    if pd.api.types.is_float_dtype(s.dtype):
+        s = s.where(np.isfinite(s.astype("float64")))
+    codes, uniques = pd.factorize(s)
+    xml = _cell_xml(pd.Series(uniques)).to_numpy(dtype=object)
+    # Código -1 (sem valor) aponta para a célula vazia no fim
+    return np.append(xml, "<c/>")[codes]
+
+
+def _header_row(columns) -> str:
+    cells = "".join(
+        f'<c r="{_col_letter(i)}1" t="inlineStr"><is><t>{escape(_XML_ILLEGAL.sub("", str(c)))}</t></is></c>'
+        for i, c in enumerate(columns)
+    )
+    return f'<row r="1">{cells}</row>'
+
+
+_SHEET_OPEN = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'
+)
+_SHEET_CLOSE = "</sheetData></worksheet>"
+
+
+def _workbook_parts(sheet_names) -> dict:
+    main_ns = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+    rel_ns = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+    pkg_rel_ns = "http://schemas.openxmlformats.org/package/2006/relationships"
+    sheets = "".join(
+        f'<sheet name="{escape(name)}" sheetId="{i}" r:id="rId{i}"/>' for i, name in enumerate(sheet_names, start=1)
+    )
+    rels = "".join(
+        f'<Relationship Id="rId{i}" Type="{rel_ns}/worksheet" Target="worksheets/sheet{i}.xml"/>'
+        for i in range(1, len(sheet_names) + 1)
+    )
+    overrides = "".join(
+        f'<Override PartName="/xl/worksheets/sheet{i}.xml" '
+        f'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        for i in range(1, len(sheet_names) + 1)
+    )
+    head = '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    return {
+        "xl/workbook.xml": f'{head}<workbook xmlns="{main_ns}" xmlns:r="{rel_ns}"><sheets>{sheets}</sheets></workbook>',
+        "xl/_rels/workbook.xml.rels": f'{head}<Relationships xmlns="{pkg_rel_ns}">{rels}</Relationships>',
+        "_rels/.rels": (
+            f'{head}<Relationships xmlns="{pkg_rel_ns}">'
+            f'<Relationship Id="rId1" Type="{rel_ns}/officeDocument" Target="xl/workbook.xml"/></Relationships>'
+        ),
+        "[Content_Types].xml": (
+            f'{head}<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+            '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+            '<Default Extension="xml" ContentType="application/xml"/>'
+            '<Override PartName="/xl/workbook.xml" '
+            'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+            f"{overrides}</Types>"
+        ),
+    }
+
+
+def stream_xlsx(frames: Iterable[pd.DataFrame], sheet_name: str = "Planilha", max_rows: int = XLSX_MAX_ROWS) -> Iterator[bytes]:
+    """
+    XLSX escrito direto no zip, bloco a bloco, com memória constante.
+
+    Quando a planilha atinge `max_rows` (limite do Excel, com o cabeçalho) as
+    linhas seguintes continuam em `<sheet_name>_2`, `<sheet_name>_3`, ...
+    O workbook.xml vai no fim do zip, quando já se sabe quantas planilhas existem.
+    """
+    sink = _Sink()
+    zf = zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_DEFLATED, compresslevel=1)
+    sheet_names = []
+    sheet = None
+    row = 0
+    columns = None
+
+    def open_sheet():
+        nonlocal sheet, row
+        sheet_names.append(sheet_name if not sheet_names else f"{sheet_name}_{len(sheet_names) + 1}")
+        sheet = zf.open(f"xl/worksheets/sheet{len(sheet_names)}.xml", "w", force_zip64=True)
+        sheet.write((_SHEET_OPEN + _header_row(columns)).encode("utf-8"))
+        row = 1
+
+    for df in frames:
+        if columns is None:
+            columns = list(df.columns)
+            open_sheet()
+        start = 0
+        while start < len(df):
+            if row >= max_rows:
+                sheet.write(_SHEET_CLOSE.encode("utf-8"))
+                sheet.close()
+                open_sheet()
+            part = df.iloc[start:start + max_rows - row]
+            xml = np.arange(row + 1, row + 1 + len(part)).astype(str).astype(object)
+            xml = '<row r="' + xml + '">'
+            for col in columns:
+                xml = xml + _cells(part[col])
+            sheet.write("".join(xml + "</row>").encode("utf-8"))
+            row += len(part)
+            start += len(part)
+            yield sink.drain()
+
+    if columns is None:
+        columns = []
+        open_sheet()
+    sheet.write(_SHEET_CLOSE.encode("utf-8"))
+    sheet.close()
+    for name, content in _workbook_parts(sheet_names).items():
+        zf.writestr(name, content)
+    zf.close()
+    yield sink.drain()
+
+
+def accepts_arrow(accept) -> bool:
+    """True se o cabeçalho Accept pede Arrow IPC (stream)."""
+    return isinstance(accept, str) and ARROW_STREAM in accept.lower()
+
+
+def _arrow_table(df: pd.DataFrame) -> pa.Table:
+    try:
+        return pa.Table.from_pandas(df, preserve_index=False)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        # Coluna de texto com tipos misturados (ex.: números e textos no CSV): vai como texto
+        mixed = {c: df[c].astype(str).where(df[c].notna(), None) for c in df.columns if df[c].dtype == object}
+        return pa.Table.from_pandas(df.assign(**mixed), preserve_index=False)
+
+
+def _struct_column(table: pa.Table) -> pa.StructArray:
+    fields = list(table.schema)
+    if not fields:
+        return pa.array([{}] * table.num_rows, pa.struct([]))
+    return pa.StructArray.from_arrays([col.combine_chunks() for col in table.columns], fields=fields)
+
+
+def arrow_ipc(tables: Dict[str, pd.DataFrame], meta: dict) -> bytes:
+    """
+    Corpo de resposta em Arrow IPC: um único stream, com um record batch por tabela.
+
+    Para as tabelas caberem no mesmo schema, cada uma vira uma coluna struct com
+    o nome da tabela ("parte"); no batch de uma parte só a coluna dela tem
+    valores (as outras são nulas). A ordem dos batches é a de "_partes" e a parte
+    não tabular da resposta vai como JSON no metadata do schema ("json"). As
+    colunas saem direto do DataFrame, sem montar um objeto Python por linha.
+    Ver read_arrow_ipc para a leitura.
+    """
+    meta = {**meta, "_partes": list(tables)}
+    parts = {name: _arrow_table(df) for name, df in tables.items()}
+    schema = pa.schema(
+        [pa.field(name, pa.struct(list(table.schema))) for name, table in parts.items()],
+        metadata={b"json": json.dumps(meta, ensure_ascii=False, default=str).encode("utf-8")},
+    )
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, schema) as writer:
+        for name, table in parts.items():
+            columns = [_struct_column(table) if field.name == name else pa.nulls(table.num_rows, field.type) for field in schema]
+            writer.write_batch(pa.RecordBatch.from_arrays(columns, schema=schema))
+    return sink.getvalue().to_pybytes()
+
+
+def read_arrow_ipc(body: bytes) -> tuple[dict, Dict[str, pa.Table]]:
+    """Lê um corpo gerado por arrow_ipc: (parte JSON da resposta, {parte: tabela})."""
+    reader = pa.ipc.open_stream(body)
+    meta = json.loads(reader.schema.metadata[b"json"])
+    partes = meta.pop("_partes")
+    tables = {}
+    for name, batch in zip(partes, reader):
+        tables[name] = pa.Table.from_struct_array(batch.column(name))
+    return meta, tables
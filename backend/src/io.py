@@ -1,19 +1,73 @@
 from __future__ import annotations
+import os
+from pathlib import Path
+
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 from fastapi import UploadFile
 
-def read_table(file: UploadFile) -> pd.DataFrame:
-    """Lê CSV ou Excel vindo de um UploadFile do FastAPI."""
+SNIFF_BYTES = 64 * 1024
+CHUNK_ROWS = 200_000
+
+def sniff_separator(prefix: bytes) -> str:
+    """Escolhe ';' ou ',' olhando só o cabeçalho do arquivo (padrão: ';')."""
+    header = prefix.split(b"\n", 1)[0]
+    return "," if header.count(b",") > header.count(b";") else ";"
+
+def _sniff_file(f) -> str:
+    prefix = f.read(SNIFF_BYTES)
+    f.seek(0)
+    return sniff_separator(prefix)
+
+def _iter_chunks(file: UploadFile, chunk_rows: int):
     name = file.filename.lower()
-    
+
     if name.endswith(".csv"):
-        try:
-            return pd.read_csv(file.file, sep=";", dtype=str)
-        except Exception:
-            file.file.seek(0)
-            return pd.read_csv(file.file, sep=",", dtype=str)
-            
+        reader = pd.read_csv(file.file, sep=_sniff_file(file.file), dtype=str, chunksize=chunk_rows)
+        with reader:
+            yield from reader
+        return
+
     if name.endswith(".xlsx") or name.endswith(".xls"):
-        return pd.read_excel(file.file, dtype=str)
-        
-    raise ValueError("Formato não suportado. Use .csv ou .xlsx")
\ No newline at end of file
+        # Excel não tem leitura incremental no pandas; o arquivo já é limitado a ~1M linhas
+        df = pd.read_excel(file.file, dtype=str)
+        for start in range(0, max(len(df), 1), chunk_rows):
+            yield df.iloc[start:start + chunk_rows]
+        return
+
+    raise ValueError("Formato não suportado. Use .csv ou .xlsx")
+
+def write_table_parquet(file: UploadFile, dest: Path, preview_rows: int = 50, chunk_rows: int = CHUNK_ROWS) -> dict:
+    """
+    Converte o upload (CSV/Excel) para Parquet em blocos, um row group por bloco,
+    sem carregar o arquivo inteiro em memória.
+
+    Retorna {"rows", "cols", "preview"} calculados na mesma passada.
+    """
+    dest = Path(dest)
+    tmp = dest.with_suffix(dest.suffix + ".tmp")
+    writer = None
+    schema = None
+    rows = 0
+    preview = None
+    try:
+        for chunk in _iter_chunks(file, chunk_rows):
+            if writer is None:
+                # Tudo texto (os blocos já vêm lidos com dtype=str): a tipagem é feita no pipeline
+                schema = pa.schema([(str(c), pa.string()) for c in chunk.columns])
+                writer = pq.ParquetWriter(tmp, schema)
+                preview = chunk.head(preview_rows)
+            writer.write_table(pa.Table.from_pandas(chunk, schema=schema, preserve_index=False))
+            rows += len(chunk)
+    except Exception:
+        if writer is not None:
+            writer.close()
+        tmp.unlink(missing_ok=True)
+        raise
+
+    if writer is None:
+        raise ValueError(f"Arquivo vazio: {file.filename}")
+    writer.close()
+    os.replace(tmp, dest)
+    return {"rows": rows, "cols": len(schema), "preview": preview}
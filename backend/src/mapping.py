@@ -1,5 +1,12 @@
 from __future__ import annotations
+import copy
+import hashlib
+import json
 import re
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+import numpy as np
 import pandas as pd
 from typing import Dict, List, Tuple, Any
 from rapidfuzz import fuzz, process
@@ -33,43 +40,83 @@ def _norm(s: str) -> str:
     s = re.sub(r"[^a-z0-9_ çãáàâéêíóôõúü/-]", "", s)
     return s
 
+# Sugestões por hash da lista de colunas: layouts repetidos (mesmo operador, outros projetos) saem daqui
+SUGGEST_CACHE_SIZE = 256
+_SUGGEST_CACHE: "OrderedDict[str, Dict[str, List[str]]]" = OrderedDict()
+_SUGGEST_LOCK = threading.Lock()
+
+@lru_cache(maxsize=16)
+def _synonyms(concepts: Tuple[Tuple[str, Tuple[str, ...]], ...]) -> Tuple[List[str], List[str], List[int]]:
+    """Sinônimos normalizados de todos os conceitos em uma lista só (com o início de cada conceito)."""
+    names, syns, starts = [], [], []
+    for concept, synonyms in concepts:
+        names.append(concept)
+        starts.append(len(syns))
+        syns.extend(_norm(syn) for syn in synonyms)
+    starts.append(len(syns))
+    return names, syns, starts
+
+def _columns_key(columns: List[str], concepts: Dict[str, List[str]], limit: int) -> str:
+    payload = json.dumps([list(map(str, columns)), concepts, limit], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
 def suggest_mapping(columns: List[str], concepts: Dict[str, List[str]], limit: int = 5) -> Dict[str, List[str]]:
     """
     Sugere mapeamento usando lógica difusa (Fuzzy Matching).
     Retorna um dicionário onde a chave é o conceito e o valor é uma lista de colunas candidatas.
+
+    Os scores de todos os sinônimos contra todas as colunas saem de uma única
+    matriz (process.cdist, em paralelo); o resultado fica em cache pelo hash da
+    lista de colunas.
     """
+    key = _columns_key(columns, concepts, limit)
+    with _SUGGEST_LOCK:
+        if key in _SUGGEST_CACHE:
+            _SUGGEST_CACHE.move_to_end(key)
+            return copy.deepcopy(_SUGGEST_CACHE[key])
+
     # Cria mapa de {nome_normalizado: nome_original}
     cols_norm = {_norm(c): c for c in columns}
     keys = list(cols_norm.keys())
-    
+    names, syns, starts = _synonyms(tuple((k, tuple(v)) for k, v in concepts.items()))
+
+    # WRatio é bom para lidar com escolhas parciais e "fuzzy"
+    scores = process.cdist(syns, keys, scorer=fuzz.WRatio, dtype=np.float64, workers=-1) if keys else np.zeros((len(syns), 0))
+    # Top `limit` colunas de cada sinônimo (maior score; empate fica com a coluna que vem antes)
+    top = np.argsort(-scores, axis=1, kind="stable")[:, :limit]
+
     out = {}
-    
-    for concept, synonyms in concepts.items():
-        candidates = []
-        
-        # 1. Busca por similaridade para cada sinônimo
-        for syn in synonyms:
-            # WRatio é bom para lidar com escolhas parciais e "fuzzy"
-            matches = process.extract(_norm(syn), keys, scorer=fuzz.WRatio, limit=limit)
-            
-            for k, score, _ in matches:
+    for i, concept in enumerate(names):
+        # 1. Para cada coluna, o maior score entre os sinônimos (ordem de 1ª aparição)
+        best = {}
+        for row in range(starts[i], starts[i + 1]):
+            for j in top[row]:
+                score = scores[row, j]
                 # Só aceita se a similaridade for razoável (> 60)
                 if score > 60:
-                    candidates.append((cols_norm[k], int(score)))
-        
-        # 2. Consolida os candidatos e pega os melhores
-        best = {}
-        for col, score in candidates:
-            # Se a coluna já apareceu, mantém o maior score encontrado
-            best[col] = max(best.get(col, 0), score)
-        
-        # Ordena pelo score (decrescente) e pega apenas os nomes das colunas
+                    col = cols_norm[keys[j]]
+                    best[col] = max(best.get(col, 0), int(score))
+
+        # 2. Ordena pelo score (decrescente) e pega apenas os nomes das colunas
         sorted_candidates = sorted(best.items(), key=lambda x: x[1], reverse=True)
-        
-        # Retorna apenas a lista de nomes [ColunaA, ColunaB], sem os scores
         out[concept] = [item[0] for item in sorted_candidates][:limit]
-        
-    return out
+
+    with _SUGGEST_LOCK:
+        _SUGGEST_CACHE[key] = out
+        while len(_SUGGEST_CACHE) > SUGGEST_CACHE_SIZE:
+            _SUGGEST_CACHE.popitem(last=False)
+    return copy.deepcopy(out)
+
+def sanitize_map(mapping: dict) -> dict:
+    """Limpa o de-para vindo do front: ignora o identifier e pega a 1ª coluna quando vier lista."""
+    clean = {}
+    for k, v in mapping.items():
+        if k == "identifier": continue
+        if isinstance(v, list):
+            if len(v) > 0: clean[k] = v[0]
+        elif isinstance(v, str) and v:
+            clean[k] = v
+    return clean
 
 def apply_mapping(df: pd.DataFrame, mapping: Dict[str, str]) -> pd.DataFrame:
     """
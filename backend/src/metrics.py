@@ -2,25 +2,53 @@ from __future__ import annotations
 import pandas as pd
 import numpy as np
 
+# Só pontos agrupando milhares (1.234 / 12.345.678): no padrão brasileiro o ponto é de milhar
+_DOT_THOUSANDS = r"^-?[1-9]\d{0,2}(?:\.\d{3})+$"
+
+def parse_decimal_br(s: pd.Series) -> pd.Series:
+    """
+    Converte textos numéricos no padrão brasileiro para float64 (NaN quando inválido).
+
+    Aceita "1.234,56", "R$ 10,00", "-5.5", "1.234", "1.234.567" e "1,234.56":
+    quando há vírgula e ponto, o último separador é o decimal e o outro é de
+    milhar; vírgula sozinha é decimal; ponto sozinho é de milhar quando agrupa
+    exatamente três dígitos ("1.234" -> 1234, "1.234.567") ou se repete, e
+    decimal nos demais casos ("-5.5", "0.123"). O parse roda só sobre os valores distintos.
+    """
+    codes, uniques = pd.factorize(s)
+    u = pd.Series(uniques, dtype=object).astype(str).str.replace(r"[^0-9,.\-]", "", regex=True)
+
+    last_comma = u.str.rfind(",")
+    last_dot = u.str.rfind(".")
+    n_comma = u.str.count(",")
+    n_dot = u.str.count(r"\.")
+
+    # Vírgula é o decimal quando é única e vem depois de qualquer ponto
+    comma_decimal = (n_comma == 1) & (last_comma > last_dot)
+    out = u.where(~comma_decimal, u.str.replace(".", "", regex=False).str.replace(",", ".", regex=False))
+    # Senão vírgulas são de milhar, e ponto repetido também (ou, sem vírgula, agrupando 3 dígitos)
+    other = ~comma_decimal
+    dot_thousands = other & ((n_dot > 1) | ((n_comma == 0) & u.str.match(_DOT_THOUSANDS)))
+    out = out.where(~(other & (n_comma > 0)), out.str.replace(",", "", regex=False))
+    out = out.where(~dot_thousands, out.str.replace(".", "", regex=False))
+
+    parsed = pd.to_numeric(out, errors="coerce").to_numpy(dtype="float64")
+    # Código -1 (nulo) aponta para o NaN anexado ao final
+    return pd.Series(np.append(parsed, np.nan)[codes], index=s.index, name=s.name)
+
 def _to_numeric(s: pd.Series) -> pd.Series:
     """Converte para numérico forçando ponto como decimal de forma robusta."""
     # Se já for numérico, retorna direto
     if pd.api.types.is_numeric_dtype(s):
         return s
-        
-    s = s.astype(str).str.replace(r"[^0-9,\.-]", "", regex=True)
-    has_comma = s.str.contains(",")
-    has_dot = s.str.contains(r"\.")
-    s2 = s.copy()
-    
-    # Se tem vírgula e não tem ponto, assume que vírgula é decimal (padrão BR)
-    mask = has_comma & ~has_dot
-    s2.loc[mask] = s2.loc[mask].str.replace(",", ".", regex=False)
-    
-    return pd.to_numeric(s2, errors="coerce")
+    return parse_decimal_br(s)
 
 def ensure_numeric_cols(df: pd.DataFrame) -> pd.DataFrame:
-    out = df.copy()
+    # Base já convertida (consolidated do pipeline): nada a fazer, nem cópia
+    if all(c in df.columns and pd.api.types.is_numeric_dtype(df[c]) for c in ["custos_num", "qtde_usada_num", "custos"]):
+        return df
+
+    out = df.copy(deep=False)
     # Garante conversão segura
     out["custos_num"] = _to_numeric(out["custos"]) if "custos" in out.columns else 0.0
     out["qtde_usada_num"] = _to_numeric(out["qtde_usada"]).fillna(1) if "qtde_usada" in out.columns else 1
@@ -29,22 +57,74 @@ def ensure_numeric_cols(df: pd.DataFrame) -> pd.DataFrame:
     out["custos"] = out["custos_num"].fillna(0.0) 
     return out
 
-def measures(df: pd.DataFrame, id_col: str = "__id__") -> dict:
-    df = ensure_numeric_cols(df)
-    custos = df["custos_num"]
-    qtd = df["qtde_usada_num"]
-    
+def _numeric_arrays(df: pd.DataFrame) -> tuple[np.ndarray, np.ndarray]:
+    """custos e qtde_usada como float64 (mesma regra do ensure_numeric_cols), sem copiar o DataFrame."""
+    if "custos_num" in df.columns and pd.api.types.is_numeric_dtype(df["custos_num"]):
+        custos = df["custos_num"].to_numpy(dtype="float64", na_value=np.nan)
+    elif "custos" in df.columns:
+        custos = _to_numeric(df["custos"]).to_numpy(dtype="float64", na_value=np.nan)
+    else:
+        custos = np.zeros(len(df))
+
+    if "qtde_usada_num" in df.columns and pd.api.types.is_numeric_dtype(df["qtde_usada_num"]):
+        qtd = df["qtde_usada_num"].to_numpy(dtype="float64", na_value=np.nan)
+    elif "qtde_usada" in df.columns:
+        qtd = _to_numeric(df["qtde_usada"]).fillna(1).to_numpy(dtype="float64", na_value=np.nan)
+    else:
+        qtd = np.ones(len(df))
+    return custos, qtd
+
+def _id_column(df: pd.DataFrame, id_col: str) -> str | None:
     # Fallback para identifier se __id__ não existir
-    use_id = id_col
-    if use_id not in df.columns and "identifier" in df.columns:
-        use_id = "identifier"
-        
-    n_users = df[use_id].nunique(dropna=True) if use_id in df.columns else 0
+    if id_col not in df.columns and "identifier" in df.columns:
+        return "identifier"
+    return id_col if id_col in df.columns else None
 
-    # Evita divisão por zero
-    soma_custo = float(custos.sum(skipna=True))
-    soma_qtd = float(qtd.sum(skipna=True))
+def measures(df: pd.DataFrame, id_col: str = "__id__") -> dict:
+    custos, qtd = _numeric_arrays(df)
+    use_id = _id_column(df, id_col)
+    n_users = df[use_id].nunique(dropna=True) if use_id else 0
+
+    return measures_from_totals(float(np.nansum(custos)), float(np.nansum(qtd)), int(n_users))
 
+def measures_by_label(df: pd.DataFrame, labels: list[str], label_col: str = "antes_depois", id_col: str = "__id__") -> dict:
+    """
+    Medidas (ver measures) de cada rótulo de `label_col`, em uma única passada:
+    as linhas são agrupadas por rótulo (ordenação estável dos códigos) para as
+    somas, e os pares distintos (rótulo, usuário) dão as contagens de usuários.
+    As somas são as mesmas de measures (mesmos valores, na mesma ordem).
+    """
+    lab = pd.Categorical(df[label_col], categories=labels).codes
+    sel = np.flatnonzero(lab >= 0)
+    order = sel[np.argsort(lab[sel], kind="stable")]
+    bounds = np.searchsorted(lab[order], np.arange(len(labels) + 1))
+
+    custos, qtd = _numeric_arrays(df)
+    custos = custos[order]
+    qtd = qtd[order]
+    custos[np.isnan(custos)] = 0.0
+    qtd[np.isnan(qtd)] = 0.0
+    sums = [
+        (float(custos[a:b].sum()), float(qtd[a:b].sum()))
+        for a, b in zip(bounds[:-1], bounds[1:])
+    ]
+
+    n_users = np.zeros(len(labels), dtype="int64")
+    use_id = _id_column(df, id_col)
+    if use_id:
+        ids, uniques = pd.factorize(df[use_id].to_numpy()[order])
+        has_id = ids >= 0
+        pairs = pd.unique(lab[order][has_id].astype("int64") * (len(uniques) + 1) + ids[has_id])
+        n_users = np.bincount(pairs // (len(uniques) + 1), minlength=len(labels))
+
+    return {
+        label: measures_from_totals(sums[i][0], sums[i][1], int(n_users[i]))
+        for i, label in enumerate(labels)
+    }
+
+def measures_from_totals(soma_custo: float, soma_qtd: float, n_users: int) -> dict:
+    """Monta as medidas a partir de totais já agregados (usado também pelo cubo de resultados)."""
+    # Evita divisão por zero
     out = {
         "custo": soma_custo,
         "qtde_usada": soma_qtd,
@@ -63,12 +143,15 @@ def pivot_antes_depois(df: pd.DataFrame, base_total_users: int | None = None, id
     if "antes_depois" not in df.columns:
         return []
 
-    keep = df[df["antes_depois"].isin(["Antes", "Depois"])].copy()
+    by_label = measures_by_label(df, ["Antes", "Depois"], id_col=id_col)
+    return comparative_rows(by_label, base_total_users)
+
+def comparative_rows(by_label: dict, base_total_users: int | None = None) -> list[dict]:
+    """Monta as linhas Antes/Depois/Diferença/% a partir das medidas de cada período."""
     rows = []
     
     for label in ["Antes", "Depois"]:
-        part = keep[keep["antes_depois"] == label]
-        m = measures(part, id_col=id_col)
+        m = by_label[label]
         
         n_total = base_total_users if base_total_users else m["n_usuarios"]
         custo_medio_total = (m["custo"] / n_total) if (n_total and n_total > 0) else 0.0
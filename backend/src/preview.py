@@ -0,0 +1,71 @@
+from __future__ import annotations
+from pathlib import Path
+from typing import Any, Dict, Iterator
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from src.mapping import apply_mapping, sanitize_map
+from src.compute import compute_tempo_programa
+
+# Colunas do beneficiário que o cálculo do TP realmente lê
+TP_CONCEPTS = ["data_inclusao", "data_inativacao"]
+SUMMARY_BATCH_ROWS = 1_000_000
+EXPORT_BATCH_ROWS = 100_000
+
+def preview_head(path: Path, mapping: Dict[str, Any], ultima_ref: pd.Timestamp, rows: int = 50) -> pd.DataFrame:
+    """
+    Calcula o TP só para as primeiras `rows` linhas do Parquet (lê apenas o 1º lote).
+    O de-para pode vir como o front manda (listas de colunas): passa por sanitize_map.
+    """
+    mapping = sanitize_map(mapping)
+    pf = pq.ParquetFile(path)
+    batch = next(pf.iter_batches(batch_size=rows), None)
+    head = batch.to_pandas() if batch is not None else pf.schema_arrow.empty_table().to_pandas()
+    return compute_tempo_programa(apply_mapping(head, mapping), ultima_ref)
+
+def tp_summary(path: Path, mapping: Dict[str, Any], ultima_ref: pd.Timestamp, batch_rows: int = SUMMARY_BATCH_ROWS) -> dict:
+    """
+    Resumo do TP sobre a base inteira em uma passada, lendo só as colunas de datas.
+
+    Cada lote é reduzido às combinações distintas de (inclusão, inativação) com a
+    contagem de linhas; o TP é calculado uma única vez sobre essas combinações e
+    as contagens são somadas por status e por grupo.
+    """
+    mapping = sanitize_map(mapping)
+    pf = pq.ParquetFile(path)
+    names = set(pf.schema_arrow.names)
+    cols = {concept: mapping[concept] for concept in TP_CONCEPTS if mapping.get(concept) in names}
+    total = pf.metadata.num_rows
+    if "data_inclusao" not in cols:
+        raise KeyError("data_inclusao")
+
+    keys = list(dict.fromkeys(cols.values()))
+    parts = []
+    for batch in pf.iter_batches(batch_size=batch_rows, columns=keys):
+        parts.append(pa.Table.from_batches([batch]).group_by(keys).aggregate([([], "count_all")]))
+    if parts:
+        pairs = pa.concat_tables(parts).group_by(keys).aggregate([("count_all", "sum")]).to_pandas()
+        n = pairs.pop("count_all_sum")
+    else:
+        pairs, n = pd.DataFrame(columns=keys), pd.Series(dtype="int64")
+
+    tp = compute_tempo_programa(apply_mapping(pairs, cols), ultima_ref)
+    return {
+        "total_linhas": int(total),
+        "status": {k: int(v) for k, v in n.groupby(tp["tempo_programa_status"].to_numpy()).sum().items()},
+        "grupos": {k: int(v) for k, v in n.groupby(tp["grupos"].to_numpy()).sum().sort_index().items()},
+    }
+
+def iter_tp_frames(path: Path, mapping: Dict[str, Any], ultima_ref: pd.Timestamp, batch_rows: int = EXPORT_BATCH_ROWS) -> Iterator[pd.DataFrame]:
+    """
+    Base inteira com o TP calculado, em blocos de `batch_rows` linhas (o TP é
+    linha a linha). `tempo_programa` sai como Int64 para o tipo não variar entre blocos.
+    """
+    mapping = sanitize_map(mapping)
+    pf = pq.ParquetFile(path)
+    for batch in pf.iter_batches(batch_size=batch_rows):
+        df = compute_tempo_programa(apply_mapping(batch.to_pandas(), mapping), ultima_ref)
+        df["tempo_programa"] = df["tempo_programa"].astype("Int64")
+        yield df
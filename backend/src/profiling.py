@@ -0,0 +1,125 @@
+from __future__ import annotations
+import re
+import sys
+import time
+from datetime import datetime
+
+try:
+    import resource
+except ImportError:  # Windows: sem getrusage, o pico de memória fica None
+    resource = None
+
+_HWM = re.compile(r"VmHWM:\s+(\d+)\s+kB")
+
+def reset_peak_rss() -> bool:
+    """
+    Zera o pico de memória residente (VmHWM) do processo, para medir o pico de
+    cada etapa separadamente. Só existe no Linux; retorna False se não deu.
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+def peak_rss_bytes() -> int | None:
+    """Pico de RSS desde o último reset_peak_rss (ou desde o início do processo); None se indisponível."""
+    try:
+        with open("/proc/self/status") as f:
+            m = _HWM.search(f.read())
+        if m:
+            return int(m.group(1)) * 1024
+    except OSError:
+        pass
+    if resource is None:
+        return None
+    # Fallback: pico do processo inteiro (ru_maxrss é kB no Linux e bytes no macOS)
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == "darwin" else rss * 1024
+
+_RSS = re.compile(r"VmRSS:\s+(\d+)\s+kB")
+
+def current_rss_bytes() -> int | None:
+    """RSS atual do processo (None fora do Linux)."""
+    try:
+        with open("/proc/self/status") as f:
+            m = _RSS.search(f.read())
+        return int(m.group(1)) * 1024 if m else None
+    except OSError:
+        return None
+
+def _mb(n: int | None) -> float | None:
+    return None if n is None else round(n / 2**20, 1)
+
+class Profiler:
+    """
+    Coleta spans sequenciais (uma etapa por vez) com tempo de parede, tempo de
+    CPU, linhas de entrada/saída e memória (RSS no início/fim, delta e pico).
+
+        prof = Profiler("run")
+        prof.step("merge", rows_in=len(ficha))
+        ...
+        prof.rows_out(len(merged))
+        profile = prof.finish()
+
+    Com `track_peak=True` o pico de RSS (VmHWM) é zerado no início de cada
+    etapa e lido no fim. Zerar vale para o processo inteiro, então só deve ser
+    usado onde uma execução roda sozinha no processo (o worker do pipeline);
+    nos spans da API (várias requisições em threads) o pico fica None e só o
+    RSS de início/fim é registrado.
+    """
+
+    def __init__(self, kind: str, track_peak: bool = False):
+        self.kind = kind
+        self.track_peak = track_peak
+        self.started_at = datetime.now().isoformat(timespec="seconds")
+        self.spans: list[dict] = []
+        self._open: dict | None = None
+        self._t0 = time.perf_counter()
+        self._c0 = time.process_time()
+
+    def step(self, name: str, rows_in: int | None = None):
+        """Fecha a etapa atual (se houver) e abre `name`."""
+        self._close()
+        if self.track_peak:
+            reset_peak_rss()
+        self._open = {
+            "name": name,
+            "rows_in": None if rows_in is None else int(rows_in),
+            "rows_out": None,
+            "_t": time.perf_counter(),
+            "_c": time.process_time(),
+            "_rss": current_rss_bytes(),
+        }
+
+    def rows_out(self, n: int):
+        if self._open is not None:
+            self._open["rows_out"] = int(n)
+
+    def _close(self):
+        span, self._open = self._open, None
+        if span is None:
+            return
+        rss_start, rss_end = span.pop("_rss"), current_rss_bytes()
+        span.update({
+            "wall_s": round(time.perf_counter() - span.pop("_t"), 4),
+            "cpu_s": round(time.process_time() - span.pop("_c"), 4),
+            "rss_start_mb": _mb(rss_start),
+            "rss_end_mb": _mb(rss_end),
+            "mem_delta_mb": _mb(rss_end - rss_start) if rss_start is not None and rss_end is not None else None,
+            "peak_rss_mb": _mb(peak_rss_bytes()) if self.track_peak else None,
+        })
+        self.spans.append(span)
+
+    def finish(self, **extra) -> dict:
+        """Fecha a última etapa e retorna o perfil completo (serializável em JSON)."""
+        self._close()
+        return {
+            "kind": self.kind,
+            "started_at": self.started_at,
+            "wall_s": round(time.perf_counter() - self._t0, 4),
+            "cpu_s": round(time.process_time() - self._c0, 4),
+            **extra,
+            "spans": self.spans,
+        }
@@ -0,0 +1,61 @@
+from __future__ import annotations
+import pandas as pd
+import pyarrow as pa
+
+from src.metrics import _to_numeric
+
+# Tipo físico de cada conceito mapeado (colunas não mapeadas continuam texto)
+CONCEPT_TYPES = {
+    "data_inclusao": "date",
+    "data_inativacao": "date",
+    "nascimento": "date",
+    "atendimento": "date",
+    "custos": "decimal_br",
+    "qtde_usada": "decimal_br",
+    "idade": "number",
+    "sexo": "category",
+    "agrupamento_assistencial": "category",
+    "codigo_servico": "category",
+    "descricao_servico": "category",
+}
+
+# Só vira categórica se tiver no máximo essa fração de valores distintos
+MAX_CATEGORY_RATIO = 0.5
+
+def _convert(s: pd.Series, kind: str) -> pd.Series:
+    if kind == "date":
+        return pd.to_datetime(s, errors="coerce", dayfirst=True)
+    if kind == "decimal_br":
+        return _to_numeric(s).astype("float64")
+    if kind == "number":
+        return pd.to_numeric(s, errors="coerce").astype("float64")
+    if kind == "category":
+        n = len(s)
+        if n and s.nunique(dropna=True) <= n * MAX_CATEGORY_RATIO:
+            return s.astype("category")
+    return s
+
+def type_inputs(df: pd.DataFrame, mapping: dict) -> pd.DataFrame:
+    """
+    Converte, uma única vez, as colunas mapeadas para o tipo do conceito:
+    datas como datetime, custos/quantidades como float64 e colunas de baixa
+    cardinalidade como categóricas. Os nomes originais das colunas são mantidos.
+
+    mapping: {'nome_padrao': 'nome_original_csv'} (mesmo formato do apply_mapping)
+    """
+    out = df.copy(deep=False)
+    for concept, col in mapping.items():
+        kind = CONCEPT_TYPES.get(concept)
+        if kind and isinstance(col, str) and col in out.columns:
+            out[col] = _convert(out[col], kind)
+    return out
+
+def to_arrow(df: pd.DataFrame) -> pa.Table:
+    """Tabela Arrow do input tipado: datas sem hora viram date32, categóricas viram dictionary."""
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    for i, field in enumerate(table.schema):
+        if pa.types.is_timestamp(field.type):
+            s = df[field.name]
+            if (s.isna() | (s == s.dt.normalize())).all():
+                table = table.set_column(i, field.name, table.column(i).cast(pa.date32()))
+    return table
@@ -0,0 +1,20 @@
+from __future__ import annotations
+
+import os
+import shutil
+import tempfile
+
+_workdir = None
+
+
+def pytest_sessionstart(session):
+    # database.store é criado no import e grava em storage/ relativo ao diretório
+    # corrente: os testes rodam num diretório temporário para não sujar o backend
+    global _workdir
+    _workdir = tempfile.mkdtemp(prefix="analise-tests-")
+    os.chdir(_workdir)
+
+
+def pytest_sessionfinish(session):
+    os.chdir(session.config.invocation_params.dir)
+    shutil.rmtree(_workdir, ignore_errors=True)
@@ -0,0 +1,221 @@
+"""
+Equivalência dos cálculos vetorizados de src.compute com os laços por linha
+originais (cópias congeladas abaixo), sobre datas aleatórias com NaT e lixo,
+e do join por códigos (consolidate) com o merge pelo id normalizado.
+"""
+from __future__ import annotations
+import math
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import pipeline
+from database import ProjectStore
+from src.compute import build_id_index, compute_momento_mes, consolidate, compute_tempo_programa, compute_ultima_competencia_ref, months_diff
+
+
+# --- Implementações originais (laço por linha / merge), congeladas para comparação ---
+
+
+def _consolidate_merge(benef: pd.DataFrame, ficha: pd.DataFrame, id_col_benef: str, id_col_ficha: str) -> pd.DataFrame:
+    benef = benef.copy()
+    ficha = ficha.copy()
+    benef["__id__"] = benef[id_col_benef].astype(str).str.strip()
+    ficha["__id__"] = ficha[id_col_ficha].astype(str).str.strip()
+    return ficha.merge(benef.drop(columns=[id_col_benef]), on="__id__", how="left")
+
+def _tempo_programa_loop(df_benef: pd.DataFrame, ultima_comp_ref: pd.Timestamp) -> pd.DataFrame:
+    df = df_benef.copy()
+    di = pd.to_datetime(df["data_inclusao"], errors="coerce", dayfirst=True)
+    din = pd.to_datetime(df["data_inativacao"], errors="coerce", dayfirst=True) if "data_inativacao" in df.columns else pd.Series([pd.NaT]*len(df))
+
+    di_m = di.dt.to_period("M").dt.to_timestamp()
+    din_m = din.dt.to_period("M").dt.to_timestamp()
+    fim_ref = compute_ultima_competencia_ref(ultima_comp_ref)
+
+    tempo, status = [], []
+    for i in range(len(df)):
+        inc = di_m.iloc[i]
+        if pd.isna(inc):
+            tempo.append(np.nan); status.append("SEM DATA INCLUSÃO")
+            continue
+
+        fim = din_m.iloc[i] if not pd.isna(din_m.iloc[i]) else fim_ref
+        if inc >= fim:
+            tempo.append(np.nan); status.append("DATA DE INCLUSÃO NÃO PERMITE CÁLCULO")
+        else:
+            tp = months_diff(inc, fim)
+            tempo.append(tp); status.append("OK")
+
+    df["tempo_programa"] = tempo
+    df["tempo_programa_status"] = status
+    df["grupos"] = [f"TP_{int(tp):02d}" if s == "OK" else "Não Elegível" for tp, s in zip(tempo, status)]
+    return df
+
+
+def _momento_mes_loop(df: pd.DataFrame) -> pd.DataFrame:
+    df = df.copy()
+    att = pd.to_datetime(df["atendimento"], errors="coerce", dayfirst=True)
+    inc = pd.to_datetime(df["data_inclusao"], errors="coerce", dayfirst=True)
+
+    momento, antes_depois = [], []
+    for a, i in zip(att, inc):
+        if pd.isna(a) or pd.isna(i):
+            momento.append(np.nan); antes_depois.append("")
+            continue
+        days = (a - i).days
+        m = 0 if days == 0 else int(math.copysign(math.ceil(abs(days) / 30.0), days))
+        momento.append(m)
+        antes_depois.append("Momento zero" if m == 0 else "Antes" if m < 0 else "Depois")
+
+    df["momento_mes"] = momento
+    df["antes_depois"] = antes_depois
+    return df
+
+
+TP_COLS = ["tempo_programa", "tempo_programa_status", "grupos"]
+MOMENTO_COLS = ["momento_mes", "antes_depois"]
+
+
+def _random_dates(rng: np.random.Generator, n: int, as_text: bool, missing: float = 0.1, invalid: float = 0.03) -> np.ndarray:
+    """Datas entre 2015 e 2025 (texto dd/mm/aaaa ou Timestamp), com ausentes e valores inválidos."""
+    d = pd.Timestamp("2015-01-01") + pd.to_timedelta(rng.integers(0, 4000, n), unit="D")
+    s = pd.Series(d.strftime("%d/%m/%Y") if as_text else d, dtype=object)
+    s[rng.random(n) < missing] = None
+    if as_text:
+        s[rng.random(n) < invalid] = "lixo"
+    return s.to_numpy()
+
+
+@pytest.mark.parametrize("seed", range(20))
+@pytest.mark.parametrize("inativacao", [False, True])
+@pytest.mark.parametrize("as_text", [False, True])
+def test_tempo_programa_matches_loop(seed, inativacao, as_text):
+    rng = np.random.default_rng(seed)
+    n = int(rng.integers(0, 400))
+    df = pd.DataFrame({"id": range(n), "data_inclusao": _random_dates(rng, n, as_text)}, index=rng.permutation(n) + 5)
+    if inativacao:
+        df["data_inativacao"] = _random_dates(rng, n, as_text)
+    ref = pd.Timestamp(f"2024-{int(rng.integers(1, 13)):02d}-15")
+
+    expected = _tempo_programa_loop(df, ref)
+    result = compute_tempo_programa(df, ref)
+    pd.testing.assert_frame_equal(result[TP_COLS], expected[TP_COLS])
+
+
+def test_tempo_programa_all_eligible_keeps_int_dtype():
+    df = pd.DataFrame({"data_inclusao": ["01/01/2020", "15/03/2021"]})
+    ref = pd.Timestamp("2024-01-01")
+    result = compute_tempo_programa(df, ref)
+    pd.testing.assert_frame_equal(result[TP_COLS], _tempo_programa_loop(df, ref)[TP_COLS])
+    assert result["tempo_programa"].dtype == "int64"
+
+
+@pytest.mark.parametrize("seed", range(20))
+@pytest.mark.parametrize("dedup", [True, False])
+@pytest.mark.parametrize("as_text", [False, True])
+def test_momento_mes_matches_loop(seed, dedup, as_text):
+    rng = np.random.default_rng(1000 + seed)
+    n = int(rng.integers(0, 600))
+    # Poucas inclusões distintas repetidas por evento, como na base consolidada
+    inclusoes = _random_dates(rng, max(1, n // 10), as_text)
+    df = pd.DataFrame({
+        "atendimento": _random_dates(rng, n, as_text),
+        "data_inclusao": inclusoes[rng.integers(0, len(inclusoes), n)],
+    })
+
+    expected = _momento_mes_loop(df)
+    result = compute_momento_mes(df, dedup=dedup)
+    pd.testing.assert_frame_equal(result[MOMENTO_COLS], expected[MOMENTO_COLS])
+
+
+def test_momento_mes_all_valid_keeps_int_dtype():
+    df = pd.DataFrame({"atendimento": ["10/02/2021", "01/01/2021", "20/12/2020"], "data_inclusao": ["01/01/2021"] * 3})
+    result = compute_momento_mes(df)
+    pd.testing.assert_frame_equal(result[MOMENTO_COLS], _momento_mes_loop(df)[MOMENTO_COLS])
+    assert result["momento_mes"].dtype == "int64"
+    assert result["antes_depois"].tolist() == ["Depois", "Momento zero", "Antes"]
+
+
+# --- consolidate com o dicionário do identificador ---
+
+def _id_frames(rng: np.random.Generator, n_benef: int, n_ficha: int, duplicated: bool) -> tuple[pd.DataFrame, pd.DataFrame]:
+    ids = [f"{i:06d}" for i in range(n_benef)]
+    if duplicated:
+        ids = ids + list(rng.choice(ids, n_benef // 5))
+    benef_ids = np.array(ids, dtype=object)
+    # Espaços em volta, nulos e ids só da ficha
+    spaced = rng.random(len(benef_ids)) < 0.2
+    benef_ids[spaced] = [f" {v} " for v in benef_ids[spaced]]
+    benef_ids[rng.random(len(benef_ids)) < 0.03] = None
+    benef = pd.DataFrame({
+        "cpf": benef_ids,
+        "sexo": rng.choice(["F", "M"], len(benef_ids)),
+        "valor": rng.integers(0, 10, len(benef_ids)),
+    })
+    pool = np.array([v.strip() for v in ids] + ["999999", " 999999", "nan"], dtype=object)
+    ficha_ids = pool[rng.integers(0, len(pool), n_ficha)]
+    ficha_ids[rng.random(n_ficha) < 0.03] = None
+    ficha_ids[rng.random(n_ficha) < 0.03] = np.nan
+    spaced = rng.random(n_ficha) < 0.2
+    ficha_ids[spaced] = [f"{v}  " if isinstance(v, str) else v for v in ficha_ids[spaced]]
+    ficha = pd.DataFrame({"id_pessoa": ficha_ids, "custos": rng.random(n_ficha), "valor": rng.integers(0, 10, n_ficha)})
+    return benef, ficha
+
+
+@pytest.mark.parametrize("seed", range(4))
+@pytest.mark.parametrize("duplicated", [False, True])
+def test_consolidate_matches_merge(seed, duplicated):
+    rng = np.random.default_rng(2000 + seed)
+    benef, ficha = _id_frames(rng, int(rng.integers(1, 200)), int(rng.integers(0, 800)), duplicated)
+    expected = _consolidate_merge(benef, ficha, "cpf", "id_pessoa")
+
+    pd.testing.assert_frame_equal(consolidate(benef, ficha, "cpf", "id_pessoa"), expected)
+    index = build_id_index(benef["cpf"], ficha["id_pessoa"])
+    pd.testing.assert_frame_equal(consolidate(benef, ficha, "cpf", "id_pessoa", index=index), expected)
+
+
+def test_consolidate_same_id_column_name():
+    benef = pd.DataFrame({"identifier": ["1", " 2", "2 ", None], "sexo": ["F", "M", "M", "F"]})
+    ficha = pd.DataFrame({"identifier": ["2", "1 ", None, "3"], "custos": [1.0, 2.0, 3.0, 4.0]})
+    expected = _consolidate_merge(benef, ficha, "identifier", "identifier")
+    pd.testing.assert_frame_equal(consolidate(benef, ficha, "identifier", "identifier"), expected)
+
+
+def _saved_inputs(s: ProjectStore, benef: pd.DataFrame, ficha: pd.DataFrame) -> tuple[pd.DataFrame, pd.DataFrame]:
+    # O pipeline junta os inputs relidos do Parquet (NaN em coluna de texto volta como None)
+    s.save_inputs("P", "R1", benef, ficha)
+    paths = s.input_paths("P", "R1")
+    return pd.read_parquet(paths["beneficiarios"]), pd.read_parquet(paths["ficha"])
+
+
+def test_id_index_persisted_and_rebuilt_when_stale(tmp_path, monkeypatch):
+    s = ProjectStore(str(tmp_path / "projects"))
+    monkeypatch.setattr(pipeline, "store", s)
+    rng = np.random.default_rng(7)
+
+    # 1ª execução: o índice é montado e gravado com o fingerprint dos inputs
+    old_benef, old_ficha = _saved_inputs(s, *_id_frames(rng, 50, 300, duplicated=False))
+    hashes = pipeline._input_hashes("P", "R1")
+    old_index = pipeline._id_index("P", "R1", hashes, "cpf", "id_pessoa")
+    loaded = s.load_id_index("P", "R1", s.stage_cache.key("id_index", pipeline.PIPELINE_VERSION, hashes["beneficiarios"], hashes["ficha"], "cpf", "id_pessoa"))
+    assert loaded is not None
+    pd.testing.assert_frame_equal(
+        consolidate(old_benef, old_ficha, "cpf", "id_pessoa", index=loaded),
+        _consolidate_merge(old_benef, old_ficha, "cpf", "id_pessoa"),
+    )
+
+    # Novos inputs: o índice gravado fica com fingerprint antigo e não pode ser usado
+    benef, ficha = _saved_inputs(s, *_id_frames(rng, 80, 400, duplicated=True))
+    new_hashes = pipeline._input_hashes("P", "R1")
+    new_fp = s.stage_cache.key("id_index", pipeline.PIPELINE_VERSION, new_hashes["beneficiarios"], new_hashes["ficha"], "cpf", "id_pessoa")
+    assert s.load_id_index("P", "R1", new_fp) is None
+    assert s.load_id_index("P", "R1", None) is None
+
+    index = pipeline._id_index("P", "R1", new_hashes, "cpf", "id_pessoa")
+    assert len(index["ficha"]) == len(ficha) != len(old_index["ficha"])
+    expected = _consolidate_merge(benef, ficha, "cpf", "id_pessoa")
+    pd.testing.assert_frame_equal(consolidate(benef, ficha, "cpf", "id_pessoa", index=index), expected)
+    # E o índice refeito passa a ser o gravado
+    pd.testing.assert_frame_equal(consolidate(benef, ficha, "cpf", "id_pessoa", index=s.load_id_index("P", "R1", new_fp)), expected)
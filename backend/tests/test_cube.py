@@ -0,0 +1,48 @@
+from __future__ import annotations
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.cube import build_filter_options
+
+
+def _options_loop(df: pd.DataFrame) -> dict:
+    """Cópia congelada das opções antigas de /analysis/filter-options (valores distintos, sem nulos)."""
+    opts = {}
+    if "grupos" in df.columns:
+        opts["grupos"] = sorted([x for x in df["grupos"].dropna().unique().tolist()])
+    if "agrupamento_assistencial" in df.columns:
+        opts["agrupamento_assistencial"] = sorted([x for x in df["agrupamento_assistencial"].dropna().unique().tolist()])
+    return opts
+
+
+def test_filter_options_match_old_values():
+    rng = np.random.default_rng(0)
+    n = 400
+    df = pd.DataFrame({
+        "__id__": rng.integers(0, 50, n).astype(str),
+        "grupos": rng.choice(np.array(["TP_10", "TP_03", "", None], dtype=object), n),
+        "agrupamento_assistencial": rng.choice(np.array(["EXAME", "", "CONSULTA", None], dtype=object), n),
+        "custos": rng.random(n),
+    })
+    counts = build_filter_options(df)
+    assert {dim: [item["valor"] for item in items] for dim, items in counts.items()} == _options_loop(df)
+    # O texto vazio continua sendo uma opção (como antes), com suas contagens
+    vazio = counts["grupos"][0]
+    assert vazio["valor"] == ""
+    rows = df[df["grupos"] == ""]
+    assert vazio["linhas"] == len(rows) and vazio["vidas"] == rows["__id__"].nunique()
+    assert vazio["custo"] == pytest.approx(rows["custos"].sum())
+
+
+def test_filter_options_counts():
+    df = pd.DataFrame({
+        "__id__": ["a", "a", "b", "c", "c"],
+        "sexo": pd.Categorical(["M", "M", "F", None, "F"], categories=["M", "F"]),
+        "custos": [1.0, 2.0, 3.0, 4.0, np.nan],
+    })
+    assert build_filter_options(df) == {"sexo": [
+        {"valor": "F", "linhas": 2, "vidas": 2, "custo": 3.0},
+        {"valor": "M", "linhas": 2, "vidas": 1, "custo": 3.0},
+    ]}
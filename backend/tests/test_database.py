@@ -0,0 +1,220 @@
+from __future__ import annotations
+
+import json
+import subprocess
+import sys
+import threading
+
+import pandas as pd
+import pytest
+
+import database
+from database import ProjectStore, OUTPUT_FILES
+
+
+@pytest.fixture
+def project_store(tmp_path):
+    return ProjectStore(str(tmp_path / "projects"))
+
+
+def _consolidated(n: int) -> pd.DataFrame:
+    return pd.DataFrame({"__id__": [str(i % 3) for i in range(n)], "identifier": [str(i % 3) for i in range(n)], "custos": [float(i) for i in range(n)]})
+
+
+def test_save_outputs_switches_current(project_store):
+    s = project_store
+    assert s.output_version("P", "R1") is None and s.outputs_tag("P", "R1") is None
+
+    s.save_outputs("P", "R1", consolidated_df=_consolidated(3), trend_json={"prediction": 1})
+    v1 = s.output_version("P", "R1")
+    outputs = s.round_paths("P", "R1").outputs
+    assert (outputs / "CURRENT").read_text() == v1 and s.outputs_tag("P", "R1") == v1
+    assert len(s.load_outputs("P", "R1")["consolidated_df"]) == 3
+
+    s.save_outputs("P", "R1", consolidated_df=_consolidated(5))
+    v2 = s.output_version("P", "R1")
+    assert v2 != v1 and s.outputs_tag("P", "R1") == v2
+    out = s.load_outputs("P", "R1")
+    assert len(out["consolidated_df"]) == 5
+    # Partes não informadas são herdadas da versão anterior
+    assert out["trend"] == {"prediction": 1}
+    # A versão anterior continua legível enquanto não é podada
+    assert len(s.load_outputs("P", "R1", version=v1)["consolidated_df"]) == 3
+    assert not list(outputs.glob(".*.tmp"))
+
+
+@pytest.mark.parametrize("kept", [1, 2, 3])
+def test_prune_keeps_output_versions(project_store, monkeypatch, kept):
+    monkeypatch.setattr(database, "OUTPUT_VERSIONS_KEPT", kept)
+    s = project_store
+    saved = []
+    for n in range(1, 6):
+        s.save_outputs("P", "R1", consolidated_df=_consolidated(n))
+        saved.append(s.output_version("P", "R1"))
+
+    outputs = s.round_paths("P", "R1").outputs
+    versions = sorted(d.name for d in outputs.glob("v*") if d.is_dir())
+    assert versions == saved[-kept:]
+    assert s.output_version("P", "R1") == saved[-1]
+
+
+def test_legacy_flat_outputs_still_readable(project_store):
+    # Rodadas processadas antes das versões gravavam direto em outputs/ (sem CURRENT)
+    s = project_store
+    outputs = s.round_paths("P", "R1").outputs
+    outputs.mkdir(parents=True)
+    _consolidated(4).to_parquet(outputs / "consolidated.parquet", index=False)
+    (outputs / "trend.json").write_text('{"prediction": 7}', encoding="utf-8")
+
+    assert s.output_version("P", "R1") is None
+    tag = s.outputs_tag("P", "R1")
+    assert tag is not None and s.outputs_tag("P", "R1") == tag
+    out = s.load_outputs("P", "R1", columns=["__id__", "custos"])
+    assert out["consolidated_df"].columns.tolist() == ["__id__", "custos"] and len(out["consolidated_df"]) == 4
+    assert out["trend"] == {"prediction": 7}
+    assert s.load_cube("P", "R1") is None
+
+    # A primeira gravação versionada herda o que faltou e apaga o layout antigo
+    s.save_outputs("P", "R1", consolidated_df=_consolidated(2))
+    assert s.load_outputs("P", "R1")["trend"] == {"prediction": 7}
+    assert not any((outputs / fname).exists() for fname in OUTPUT_FILES)
+    assert s.outputs_tag("P", "R1") == s.output_version("P", "R1") != tag
+
+
+def test_round_busy_while_locked_in_another_thread(project_store):
+    s = project_store
+    locked, release = threading.Event(), threading.Event()
+
+    def hold():
+        with s.round_lock("P", "R1"):
+            locked.set()
+            release.wait(10)
+
+    t = threading.Thread(target=hold)
+    t.start()
+    try:
+        assert locked.wait(10)
+        assert s.round_busy("P", "R1")
+        with pytest.raises(database.RoundBusy):
+            with s.round_lock("P", "R1", timeout=0.3):
+                pass
+    finally:
+        release.set()
+        t.join()
+    assert not s.round_busy("P", "R1")
+
+
+@pytest.mark.skipif(database.fcntl is None, reason="trava entre processos usa flock")
+def test_round_busy_while_locked_by_another_process(project_store):
+    s = project_store
+    path = s.round_paths("P", "R1").root / ".run.lock"
+    path.parent.mkdir(parents=True)
+    holder = subprocess.Popen(
+        [sys.executable, "-c", (
+            "import fcntl, sys\n"
+            f"f = open({str(path)!r}, 'a+')\n"
+            "fcntl.flock(f, fcntl.LOCK_EX)\n"
+            "print('locked', flush=True)\n"
+            "sys.stdin.read()\n"
+        )],
+        stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True,
+    )
+    try:
+        assert holder.stdout.readline().strip() == "locked"
+        assert s.round_busy("P", "R1")
+    finally:
+        holder.stdin.close()
+        holder.wait(10)
+    assert not s.round_busy("P", "R1")
+
+
+def _import_main():
+    # main liga o copy-on-write no import: restaura para não afetar os outros testes
+    cow = pd.get_option("mode.copy_on_write")
+    import main
+    pd.set_option("mode.copy_on_write", cow)
+    return main
+
+
+def _legacy_tree(base):
+    """Storage anterior ao SQLite: index.json (ordem da lista) + project.json/round.json nas pastas."""
+    index = [
+        {"project_id": f"2024010{i}_120000_p{i}", "name": f"Projeto {i}", "status": "Processado" if i % 2 else "Rascunho",
+         "created_at": f"2024-01-0{i}T12:00:00", "updated_at": f"2024-02-0{9 - i}T12:00:00"}
+        for i in [3, 1, 4, 2, 5]
+    ]
+    base.mkdir(parents=True)
+    (base / "index.json").write_text(json.dumps({"projects": index}), encoding="utf-8")
+    for proj in index:
+        root = base / proj["project_id"]
+        (root / "rounds" / "R1").mkdir(parents=True)
+        # project.json pode ter campos que o index não tem; o index prevalece no que repetir
+        (root / "project.json").write_text(json.dumps({**proj, "name": "antigo", "unimed": "U"}), encoding="utf-8")
+        (root / "rounds" / "R1" / "round.json").write_text(
+            json.dumps({"project_id": proj["project_id"], "round_id": "R1", "name": "R1", "competencia": "2024-01"}), encoding="utf-8")
+    # Projeto só com project.json (fora do index): entra depois dos do index
+    orphan = {"project_id": "20230101_000000_orfao", "name": "Órfão", "created_at": "2023-01-01T00:00:00", "updated_at": "2023-01-01T00:00:00"}
+    (base / orphan["project_id"]).mkdir()
+    (base / orphan["project_id"] / "project.json").write_text(json.dumps(orphan), encoding="utf-8")
+    return [p["project_id"] for p in index] + [orphan["project_id"]]
+
+
+def test_migrate_legacy_json_once(tmp_path, monkeypatch):
+    from fastapi.testclient import TestClient
+
+    base = tmp_path / "projects"
+    order = _legacy_tree(base)
+
+    s = ProjectStore(str(base))
+    assert [p["project_id"] for p in s.list_projects()] == order
+    first = s.read_project(order[0])
+    assert first["name"] == "Projeto 3" and first["unimed"] == "U" and first["status"] == "Processado"
+    assert s.count_projects() == 6 and s.count_projects("Processado") == 3 and s.count_projects("Rascunho") == 3
+    assert [r["competencia"] for r in s.list_rounds(order[1])] == ["2024-01"]
+
+    # Arquivos renomeados: o SQLite passa a ser a única fonte
+    assert not (base / "index.json").exists() and (base / "index.json.migrated").exists()
+    assert not list(base.glob("*/project.json")) and len(list(base.glob("*/project.json.migrated"))) == 6
+    assert not list(base.glob("*/rounds/*/round.json")) and len(list(base.glob("*/rounds/*/round.json.migrated"))) == 5
+
+    # Alteração feita depois da migração não é desfeita ao reabrir, nem por uma pasta antiga copiada de volta
+    s.meta.update_project(order[0], name="Renomeado")
+    stale = base / order[0] / "project.json"
+    stale.write_text((base / order[0] / "project.json.migrated").read_text(encoding="utf-8"), encoding="utf-8")
+    s2 = ProjectStore(str(base))
+    assert not stale.exists()
+    assert [p["project_id"] for p in s2.list_projects()] == order
+    assert s2.count_projects() == 6
+    assert s2.read_project(order[0])["name"] == "Renomeado"
+    assert len(s2.list_rounds(order[1])) == 1
+
+    # Paginação da API na mesma ordem de antes (a do index.json)
+    main = _import_main()
+    monkeypatch.setattr(main, "store", s2)
+    client = TestClient(main.app)
+    r = client.get("/projects")
+    assert r.headers["X-Total-Count"] == "6" and [p["project_id"] for p in r.json()] == order
+    pages = [client.get("/projects", params={"limit": 2, "offset": off}) for off in (0, 2, 4)]
+    assert all(p.headers["X-Total-Count"] == "6" for p in pages)
+    assert [p["project_id"] for page in pages for p in page.json()] == order
+    r = client.get("/projects", params={"status": "Processado", "limit": 2})
+    assert r.headers["X-Total-Count"] == "3"
+    assert [p["project_id"] for p in r.json()] == [pid for pid in order if s2.read_project(pid).get("status") == "Processado"][:2]
+
+
+def test_run_analysis_conflict_when_round_locked():
+    from fastapi.testclient import TestClient
+
+    main = _import_main()
+    s = main.store
+    project_id = s.create_project("run conflict")
+    round_id = s.create_round(project_id, "R1")
+    s.save_inputs(project_id, round_id, pd.DataFrame({"CPF": ["1"]}), pd.DataFrame({"id_pessoa": ["1"]}))
+    config = {"mapping": {}, "ultima_comp_ref": "2021-06-30"}
+
+    client = TestClient(main.app)
+    with s.round_lock(project_id, round_id):
+        r = client.post(f"/analysis/run/{project_id}/{round_id}", json=config)
+    assert r.status_code == 409
+    assert round_id in r.json()["detail"]
+    assert not list(main.jobs.jobs_dir.glob("*.json"))
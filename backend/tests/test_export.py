@@ -0,0 +1,110 @@
+from __future__ import annotations
+import io
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+from openpyxl import load_workbook
+
+from src.export import arrow_ipc, read_arrow_ipc, stream_csv, stream_parquet, stream_xlsx
+
+
+def _frames(df: pd.DataFrame, size: int):
+    return [df.iloc[i:i + size] for i in range(0, len(df), size)]
+
+
+def _read_xlsx(frames, **kwargs):
+    body = b"".join(stream_xlsx(frames, **kwargs))
+    wb = load_workbook(io.BytesIO(body), read_only=True)
+    return {ws.title: [list(r) for r in ws.iter_rows(values_only=True)] for ws in wb.worksheets}
+
+
+@pytest.fixture
+def base():
+    return pd.DataFrame({
+        "id": ["001", "002", "003", "004", "005"],
+        "nome": ["Ana & <Bia>", "Zé \"aspas\"", None, "ctl\x01x", "   espaços  "],
+        "custo": [10.5, np.nan, np.inf, -3.0, 0.0],
+        "qtde": [1, 2, 3, 4, 5],
+        "ativo": [True, False, True, True, False],
+        "data": pd.to_datetime(["2024-01-31", None, "2023-12-01", "2024-06-15", "2020-02-29"]),
+    })
+
+
+def test_xlsx_round_trip(base):
+    sheets = _read_xlsx(_frames(base, 2), sheet_name="Base")
+    assert list(sheets) == ["Base"]
+    rows = sheets["Base"]
+    assert rows[0] == list(base.columns)
+    assert rows[1] == ["001", "Ana & <Bia>", 10.5, 1, 1, "31/01/2024"]
+    # Nulos e infinitos viram célula vazia sem deslocar as colunas seguintes
+    assert rows[2] == ["002", "Zé \"aspas\"", None, 2, 0, None]
+    assert rows[3] == ["003", None, None, 3, 1, "01/12/2023"]
+    # Caracteres de controle são removidos; espaços são preservados
+    assert rows[4][1] == "ctlx"
+    assert rows[5][1] == "   espaços  "
+    assert len(rows) == len(base) + 1
+
+
+def test_xlsx_spills_into_new_sheets(base):
+    df = pd.DataFrame({"n": np.arange(10), "txt": [f"v{i}" for i in range(10)]})
+    # max_rows conta o cabeçalho: 3 linhas de dados por planilha
+    sheets = _read_xlsx(_frames(df, 4), sheet_name="Base", max_rows=4)
+    assert list(sheets) == ["Base", "Base_2", "Base_3", "Base_4"]
+    for rows in sheets.values():
+        assert rows[0] == ["n", "txt"]
+    data = [r for rows in sheets.values() for r in rows[1:]]
+    assert data == [[i, f"v{i}"] for i in range(10)]
+
+
+def test_xlsx_empty():
+    sheets = _read_xlsx([], sheet_name="Base")
+    assert list(sheets) == ["Base"]
+    assert not any(any(r) for r in sheets["Base"])
+
+
+def test_csv_and_parquet_streams(base):
+    frames = _frames(base, 2)
+    text = b"".join(stream_csv(frames)).decode("utf-8")
+    assert text.startswith("﻿")
+    back = pd.read_csv(io.StringIO(text[1:]), sep=";", dtype={"id": str})
+    assert back["id"].tolist() == base["id"].tolist()
+    assert len(back) == len(base)
+
+    table = pq.read_table(io.BytesIO(b"".join(stream_parquet(frames))))
+    assert table.num_rows == len(base)
+    pd.testing.assert_frame_equal(table.to_pandas(), base.reset_index(drop=True), check_dtype=False)
+
+
+def test_arrow_ipc_round_trip(base):
+    tables = {
+        "base": base,
+        "timeline": pd.DataFrame({"momento_mes": [1, 2, 3], "custos": [10.0, None, 2.5]}),
+        "misto": pd.DataFrame({"valor": [1, "a", None], "grupo": pd.Categorical(["x", "y", "x"])}),
+        "vazia": base.iloc[:0],
+    }
+    meta = {"status": "success", "kpis": {"lives": 3, "pmpm": 1.5}}
+    body = arrow_ipc(tables, meta)
+
+    back_meta, back = read_arrow_ipc(body)
+    assert back_meta == meta
+    assert list(back) == list(tables)
+    pd.testing.assert_frame_equal(back["base"].to_pandas(), base)
+    pd.testing.assert_frame_equal(back["timeline"].to_pandas(), tables["timeline"])
+    # Texto com tipos misturados vai como texto; categorias continuam categorias
+    assert back["misto"].column("valor").to_pylist() == ["1", "a", None]
+    pd.testing.assert_series_equal(back["misto"].to_pandas()["grupo"], tables["misto"]["grupo"])
+    assert back["vazia"].num_rows == 0 and back["vazia"].column_names == list(base.columns)
+
+    # Um único stream: o leitor padrão do Arrow vê todas as partes (um batch por tabela)
+    reader = pa.ipc.open_stream(body)
+    assert reader.schema.names == list(tables)
+    batches = list(reader)
+    assert [b.num_rows for b in batches] == [len(df) for df in tables.values()]
+    assert pa.ipc.open_stream(body).read_all().num_rows == sum(len(df) for df in tables.values())
+
+
+def test_arrow_ipc_without_tables():
+    assert read_arrow_ipc(arrow_ipc({}, {"status": "success"})) == ({"status": "success"}, {})
@@ -0,0 +1,130 @@
+from __future__ import annotations
+
+import time
+from concurrent.futures import Future
+
+import pandas as pd
+import pytest
+
+from database import RoundBusy, store, _read_json
+from jobs import JobManager, TERMINAL, _cancel_path, _job_path, _update_job
+from pipeline import STAGES
+
+CONFIG = {
+    "mapping": {
+        "benef_mapping": {"identifier": ["CPF"], "data_inclusao": "Dt Inclusao", "sexo": "Sexo", "nascimento": "Data Nascimento"},
+        "ficha_mapping": {"identifier": ["id_pessoa"], "atendimento": "Data Atendimento", "custos": "Valor", "qtde_usada": "Qtde"},
+    },
+    "ultima_comp_ref": "2021-06-30",
+}
+
+
+def _round_with_inputs(name: str) -> tuple[str, str]:
+    # Os jobs rodam em processos spawn, que abrem o mesmo storage/ (diretório corrente dos testes)
+    project_id = store.create_project(name)
+    round_id = store.create_round(project_id, "R1")
+    benef = pd.DataFrame({
+        "CPF": ["1", "2", "3"],
+        "Dt Inclusao": ["01/01/2021", "15/03/2021", ""],
+        "Sexo": ["F", "M", "F"],
+        "Data Nascimento": ["01/01/1980", "01/01/1990", "01/01/2000"],
+    })
+    ficha = pd.DataFrame({
+        "id_pessoa": ["1", "1", "2", "3", "9"],
+        "Data Atendimento": ["10/12/2020", "10/02/2021", "01/04/2021", "01/04/2021", "01/04/2021"],
+        "Valor": ["10,50", "20", "1.234,00", "5", "7"],
+        "Qtde": ["1", "2", "", "1", "1"],
+    })
+    store.save_inputs(project_id, round_id, benef, ficha)
+    return project_id, round_id
+
+
+def _wait(manager: JobManager, job_id: str, timeout: float = 120) -> dict:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = manager.get(job_id)
+        if job["status"] in TERMINAL:
+            return job
+        time.sleep(0.1)
+    raise AssertionError(f"job {job_id} não terminou: {manager.get(job_id)}")
+
+
+@pytest.fixture
+def manager(tmp_path):
+    m = JobManager(tmp_path / "_jobs", max_workers=1)
+    yield m
+    if m._executor is not None:
+        m._executor.shutdown(wait=True, cancel_futures=True)
+
+
+def test_submit_runs_until_done(manager):
+    project_id, round_id = _round_with_inputs("jobs done")
+    job = manager.submit(project_id, round_id, CONFIG)
+    assert job["status"] == "queued" and job["stages"] == STAGES and job["progress"] == 0.0
+
+    done = _wait(manager, job["job_id"])
+    assert done["status"] == "done", done
+    assert done["progress"] == 1.0 and done["stage"] is None
+    assert done["result"]["status"] == "success" and done["result"]["rows"] == 5
+    assert done["started_at"] <= done["finished_at"]
+    assert manager.active(project_id, round_id) is None
+    assert store.output_version(project_id, round_id) is not None
+
+
+def test_cancel_queued_job(manager):
+    # Futuro ainda não iniciado no pool: o cancelamento é imediato
+    _update_job(manager.jobs_dir, "q1", status="queued", project_id="P", round_id="R1")
+    fut = Future()
+    manager._futures["q1"] = fut
+    manager._rounds["q1"] = ("P", "R1")
+    fut.add_done_callback(lambda f: manager._on_done("q1", f))
+
+    job = manager.cancel("q1")
+    assert job["status"] == "cancelled" and job["finished_at"]
+    assert fut.cancelled()
+    assert manager.get("q1")["status"] == "cancelled"
+    assert manager.active("P", "R1") is None
+
+
+def test_cancel_before_worker_starts(manager):
+    # Já entregue ao pool: o worker vê o pedido de cancelamento antes da 1ª etapa
+    first = manager.submit(*_round_with_inputs("jobs first"), CONFIG)
+    second = manager.submit(*_round_with_inputs("jobs second"), CONFIG)
+    manager.cancel(second["job_id"])
+
+    assert _wait(manager, first["job_id"])["status"] == "done"
+    job = _wait(manager, second["job_id"])
+    assert job["status"] == "cancelled"
+    assert "started_at" not in job
+
+
+def test_update_only_active_keeps_finished_job(tmp_path):
+    _update_job(tmp_path, "j1", status="running", stage="merge", progress=0.4)
+    _update_job(tmp_path, "j1", status="done", stage=None, progress=1.0, finished_at="t1")
+
+    # Atualização atrasada (ex.: cancelamento ou falha do pool) não reabre o job
+    job = _update_job(tmp_path, "j1", only_active=True, status="failed", stage="save", progress=0.9)
+    assert job == {"job_id": "j1", "status": "done", "stage": None, "progress": 1.0, "finished_at": "t1"}
+    assert _read_json(_job_path(tmp_path, "j1")) == job
+
+    # Job novo ou ainda ativo é atualizado normalmente
+    assert _update_job(tmp_path, "j2", only_active=True, status="running")["status"] == "running"
+
+
+def test_cancel_does_not_reopen_finished_job(manager, monkeypatch):
+    _update_job(manager.jobs_dir, "j1", status="done", progress=1.0)
+    assert manager.cancel("j1")["status"] == "done"
+    assert not _cancel_path(manager.jobs_dir, "j1").exists()
+
+    # Job termina entre a leitura do status e o pedido de cancelamento
+    monkeypatch.setattr(manager, "get", lambda job_id: {"job_id": job_id, "status": "running"})
+    job = manager.cancel("j1")
+    assert job["status"] == "done" and "cancel_requested" not in job
+
+
+def test_submit_refuses_active_round(manager):
+    project_id, round_id = _round_with_inputs("jobs busy")
+    with store.round_lock(project_id, round_id):
+        with pytest.raises(RoundBusy):
+            manager.submit(project_id, round_id, CONFIG)
+    assert not list(manager.jobs_dir.glob("*.json"))
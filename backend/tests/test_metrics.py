@@ -0,0 +1,117 @@
+from __future__ import annotations
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.metrics import ensure_numeric_cols, parse_decimal_br, pivot_antes_depois
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("1.234", 1234.0),
+    ("1.234,56", 1234.56),
+    ("R$ 10,00", 10.0),
+    ("1,234.56", 1234.56),
+    ("1.234.567", 1234567.0),
+    ("1.234.567,89", 1234567.89),
+    ("-1.234", -1234.0),
+    ("R$ -2.500,75", -2500.75),
+    ("10,5", 10.5),
+    ("-5.5", -5.5),
+    ("10.50", 10.5),
+    ("0.123", 0.123),
+    ("1234.5678", 1234.5678),
+    ("1,234,567", 1234567.0),
+    ("42", 42.0),
+])
+def test_parse_decimal_br(text, expected):
+    assert parse_decimal_br(pd.Series([text]))[0] == pytest.approx(expected)
+
+
+def test_parse_decimal_br_same_scale_in_column():
+    # "1.234" e "1.234.567" na mesma coluna ficam na mesma escala (milhar)
+    s = pd.Series(["1.234", "1.234.567", "999", "1.234"])
+    assert parse_decimal_br(s).tolist() == [1234.0, 1234567.0, 999.0, 1234.0]
+
+
+def test_parse_decimal_br_invalid_and_null():
+    s = pd.Series(["abc", None, "", "1,2,3,4,5"], index=[10, 11, 12, 13], name="custos")
+    out = parse_decimal_br(s)
+    assert out.index.tolist() == [10, 11, 12, 13]
+    assert out.name == "custos"
+    assert np.isnan(out[10]) and np.isnan(out[11]) and np.isnan(out[12])
+    assert out[13] == 12345.0
+
+
+def test_ensure_numeric_cols():
+    df = pd.DataFrame({"custos": ["1.234,50", "R$ 10,00", None], "qtde_usada": ["2", None, "1,5"]})
+    out = ensure_numeric_cols(df)
+    assert out["custos"].tolist() == [1234.5, 10.0, 0.0]
+    assert out["qtde_usada_num"].tolist() == [2.0, 1.0, 1.5]
+    # Base já convertida passa direto
+    assert ensure_numeric_cols(out) is out
+
+
+def _pivot_antes_depois_loop(df, base_total_users=None, id_col="identifier"):
+    """Cópia congelada do comparativo antigo: um filtro + measures por período."""
+    if "antes_depois" not in df.columns:
+        return []
+
+    keep = df[df["antes_depois"].isin(["Antes", "Depois"])].copy()
+    rows = []
+    for label in ["Antes", "Depois"]:
+        part = ensure_numeric_cols(keep[keep["antes_depois"] == label].copy())
+        use_id = id_col if id_col in part.columns else "identifier"
+        n_users = part[use_id].nunique(dropna=True) if use_id in part.columns else 0
+        custo = float(part["custos_num"].sum(skipna=True))
+        custo_medio_usuario = (custo / n_users) if n_users > 0 else None
+
+        n_total = base_total_users if base_total_users else n_users
+        rows.append({
+            "Momento": label,
+            "Custos": custo,
+            "N. Usuários com Utilizações": int(n_users),
+            "Custo Médio Usuário (com utilização)": custo_medio_usuario or 0.0,
+            "N. Usuários Base total": n_total,
+            "Custo Médio Usuários Total": (custo / n_total) if (n_total and n_total > 0) else 0.0,
+        })
+
+    diff = {"Momento": "Diferença", "N. Usuários Base total": 0}
+    pct = {"Momento": "%", "N. Usuários Base total": 0}
+    for c in ["Custos", "N. Usuários com Utilizações", "Custo Médio Usuário (com utilização)", "Custo Médio Usuários Total"]:
+        val_a = rows[0].get(c, 0) or 0
+        val_d = rows[1].get(c, 0) or 0
+        diff[c] = val_d - val_a
+        pct[c] = ((val_d / val_a) - 1.0) * 100 if val_a != 0 else 0.0
+    return rows + [diff, pct]
+
+
+def _antes_depois_frame(rng, n, n_ids):
+    ids = rng.integers(0, n_ids, n).astype(object)
+    ids[rng.random(n) < 0.05] = None
+    labels = rng.choice(np.array(["Antes", "Depois", "Fora", None], dtype=object), n, p=[0.4, 0.4, 0.1, 0.1])
+    # Custos em poucos valores (empates), com nulos
+    custos = rng.choice([10.0, 25.5, 100.0, np.nan], n)
+    return pd.DataFrame({
+        "identifier": ids,
+        "antes_depois": labels,
+        "custos": custos,
+        "qtde_usada": rng.choice([1.0, 2.0, np.nan], n),
+    })
+
+
+@pytest.mark.parametrize("seed", [0, 1, 2])
+@pytest.mark.parametrize("n, n_ids", [(500, 40), (200, 200), (50, 3)])
+@pytest.mark.parametrize("base_total_users", [None, 1000])
+def test_pivot_antes_depois_matches_loop(seed, n, n_ids, base_total_users):
+    df = _antes_depois_frame(np.random.default_rng(seed), n, n_ids)
+    got = pd.DataFrame(pivot_antes_depois(df, base_total_users))
+    expected = pd.DataFrame(_pivot_antes_depois_loop(df, base_total_users))
+    assert got["Momento"].tolist() == ["Antes", "Depois", "Diferença", "%"]
+    pd.testing.assert_frame_equal(got, expected)
+
+
+def test_pivot_antes_depois_empty_period():
+    # Sem linhas "Depois": contagens zeradas e % zerado, como no comparativo antigo
+    df = pd.DataFrame({"identifier": ["a", "a", None], "antes_depois": ["Antes", "Antes", np.nan], "custos": [10.0, 10.0, 5.0]})
+    pd.testing.assert_frame_equal(pd.DataFrame(pivot_antes_depois(df)), pd.DataFrame(_pivot_antes_depois_loop(df)))
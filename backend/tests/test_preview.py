@@ -0,0 +1,48 @@
+from __future__ import annotations
+
+import pandas as pd
+import pytest
+
+from src.compute import compute_tempo_programa
+from src.preview import iter_tp_frames, preview_head, tp_summary
+
+REF = pd.Timestamp("2024-06-01")
+
+# De-para como o wizard envia: listas de colunas e o identifier junto
+LIST_MAPPING = {"identifier": ["cod"], "data_inclusao": ["dt_inc"], "data_inativacao": [], "sexo": ""}
+
+
+@pytest.fixture
+def benef_path(tmp_path):
+    df = pd.DataFrame({
+        "cod": ["1", "2", "3", "4"],
+        "dt_inc": pd.to_datetime(["2023-01-10", "2024-03-05", None, "2024-08-01"]),
+    })
+    path = tmp_path / "beneficiarios.parquet"
+    df.to_parquet(path, index=False)
+    return path
+
+
+def test_list_mapping_is_sanitized(benef_path):
+    head = preview_head(benef_path, LIST_MAPPING, REF, rows=2)
+    assert head["tempo_programa"].tolist() == [17, 3]
+
+    summary = tp_summary(benef_path, LIST_MAPPING, REF)
+    assert summary["total_linhas"] == 4
+    assert summary["status"] == {"OK": 2, "SEM DATA INCLUSÃO": 1, "DATA DE INCLUSÃO NÃO PERMITE CÁLCULO": 1}
+    assert summary["grupos"] == {"Não Elegível": 2, "TP_03": 1, "TP_17": 1}
+
+    frames = list(iter_tp_frames(benef_path, LIST_MAPPING, REF, batch_rows=3))
+    assert sum(len(f) for f in frames) == 4
+
+
+def test_summary_matches_full_computation(benef_path):
+    full = compute_tempo_programa(pd.read_parquet(benef_path).rename(columns={"dt_inc": "data_inclusao"}), REF)
+    summary = tp_summary(benef_path, {"data_inclusao": "dt_inc"}, REF)
+    assert summary["status"] == full["tempo_programa_status"].value_counts().to_dict()
+    assert summary["grupos"] == full["grupos"].value_counts().sort_index().to_dict()
+
+
+def test_summary_requires_data_inclusao(benef_path):
+    with pytest.raises(KeyError):
+        tp_summary(benef_path, {"data_inclusao": ["nao_existe"]}, REF)
@@ -0,0 +1,46 @@
+from __future__ import annotations
+import importlib
+import sys
+
+import src.profiling as profiling
+
+
+def test_spans_without_peak_do_not_reset(monkeypatch):
+    def fail():
+        raise AssertionError("reset_peak_rss chamado fora do worker")
+
+    monkeypatch.setattr(profiling, "reset_peak_rss", fail)
+    prof = profiling.Profiler("results")
+    prof.step("load", rows_in=10)
+    prof.rows_out(5)
+    prof.step("aggregate")
+    profile = prof.finish(status="success")
+    assert [s["name"] for s in profile["spans"]] == ["load", "aggregate"]
+    assert profile["spans"][0]["rows_in"] == 10 and profile["spans"][0]["rows_out"] == 5
+    assert all(s["peak_rss_mb"] is None for s in profile["spans"])
+
+
+def test_spans_with_peak_reset_each_step(monkeypatch):
+    calls = []
+    monkeypatch.setattr(profiling, "reset_peak_rss", lambda: calls.append(1) or True)
+    prof = profiling.Profiler("run", track_peak=True)
+    prof.step("a")
+    prof.step("b")
+    profile = prof.finish()
+    assert len(calls) == 2
+    assert all(s["peak_rss_mb"] is not None for s in profile["spans"])
+
+
+def test_import_without_resource(monkeypatch):
+    # Windows: não há o módulo resource nem /proc
+    monkeypatch.setitem(sys.modules, "resource", None)
+    mod = importlib.reload(profiling)
+    try:
+        assert mod.resource is None
+        monkeypatch.setattr("builtins.open", lambda *a, **k: (_ for _ in ()).throw(OSError()))
+        assert mod.peak_rss_bytes() is None
+        assert mod.current_rss_bytes() is None
+        assert mod.reset_peak_rss() is False
+    finally:
+        monkeypatch.undo()
+        importlib.reload(profiling)
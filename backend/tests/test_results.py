@@ -0,0 +1,148 @@
+from __future__ import annotations
+
+import itertools
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import results
+from database import ProjectStore
+from src.cube import build_results_cube
+from src.export import ARROW_STREAM, read_arrow_ipc
+
+GRUPOS = ["TP_03", "TP_10", "TP_20"]
+ASSISTENCIAL = ["CONSULTA", "EXAME", "INTERNACAO"]
+
+
+def _consolidated(rng, n_lives=60, n_events=1500):
+    """Base consolidada sintética no formato do pipeline (atributos da vida repetidos em cada evento)."""
+    ids = np.array([f"{i:05d}" for i in range(n_lives)], dtype=object)
+    lives = pd.DataFrame({
+        "__id__": ids,
+        "tempo_programa_status": rng.choice(np.array(["OK", "OK", "OK", "Sem data", None], dtype=object), n_lives),
+        "grupos": rng.choice(GRUPOS, n_lives),
+        "tempo_programa": rng.integers(-2, 30, n_lives),
+        "sexo": rng.choice(["F", "M", ""], n_lives),
+        "idade": rng.integers(0, 90, n_lives),
+        "faixa_etaria": rng.choice(["00-18", "19-58", "59+"], n_lives),
+        "nascimento": pd.Timestamp("1950-01-01") + pd.to_timedelta(rng.integers(0, 20000, n_lives), unit="D"),
+    })
+    ev = lives.iloc[rng.integers(0, n_lives, n_events)].reset_index(drop=True)
+    momento = rng.integers(-30, 31, n_events).astype("float64")
+    momento[rng.random(n_events) < 0.05] = np.nan
+    ev["momento_mes"] = momento
+    ev["antes_depois"] = np.select(
+        [np.isnan(momento), momento == 0, momento < 0], ["", "Momento zero", "Antes"], default="Depois"
+    ).astype(object)
+    ev["agrupamento_assistencial"] = rng.choice(ASSISTENCIAL, n_events)
+    ev["custos"] = rng.choice([10.0, 25.5, 100.0, 1234.56], n_events)
+    ev["custos_num"] = ev["custos"]
+    ev["qtde_usada_num"] = rng.choice([1.0, 2.0], n_events)
+    ev["identifier"] = ev["__id__"]
+    return ev
+
+
+@pytest.fixture
+def project_store(tmp_path, monkeypatch):
+    s = ProjectStore(str(tmp_path / "projects"))
+    monkeypatch.setattr(results, "store", s)
+    return s
+
+
+def _save_rounds(s, df):
+    """Mesma base em duas rodadas: R1 com cubo e R2 só com o consolidated.parquet."""
+    cube = build_results_cube(df)
+    assert cube is not None
+    s.save_outputs("P", "R1", consolidated_df=df, cube=cube)
+    s.save_outputs("P", "R2", consolidated_df=df)
+    assert s.load_cube("P", "R1") is not None
+    assert s.load_cube("P", "R2") is None
+
+
+def _assert_same(a, b, path="$"):
+    if isinstance(a, dict):
+        assert isinstance(b, dict) and a.keys() == b.keys(), path
+        for k in a:
+            _assert_same(a[k], b[k], f"{path}.{k}")
+    elif isinstance(a, list):
+        assert isinstance(b, list) and len(a) == len(b), path
+        for i, (x, y) in enumerate(zip(a, b)):
+            _assert_same(x, y, f"{path}[{i}]")
+    elif isinstance(a, float) or isinstance(b, float):
+        # Somas pré-agregadas no cubo podem diferir só no arredondamento
+        assert a == pytest.approx(b, rel=1e-9, abs=1e-9), path
+    else:
+        assert a == b, path
+
+
+COMBOS = list(itertools.product(
+    ["dentro", "fora", "ambos"],
+    [False, True],
+    [6, 24],
+    [None, ["TP_03", "TP_20"]],
+    [None, ["EXAME"]],
+))
+
+
+@pytest.mark.parametrize("seed", [0, 1])
+def test_results_cube_matches_consolidated(project_store, seed):
+    _save_rounds(project_store, _consolidated(np.random.default_rng(seed)))
+
+    for periodo, momentoZero, janela, grupos, assistencial in COMBOS:
+        args = (periodo, momentoZero, janela, grupos, assistencial, False)
+        (body_cube, _), prof_cube = results.compute_results("P", "R1", None, *args)
+        (body_rows, _), prof_rows = results.compute_results("P", "R2", None, *args)
+        assert prof_cube["path"] == "cube" and prof_rows["path"] == "consolidated"
+        _assert_same(json.loads(body_cube), json.loads(body_rows), f"{args}")
+
+
+def test_cohort_dedupes_before_filters(project_store):
+    # Vidas repetidas com status/grupos diferentes entre as linhas (ids duplicados no
+    # cadastro): vale a primeira linha da vida, com ou sem cubo
+    df = _consolidated(np.random.default_rng(3))
+    first = df.drop_duplicates("__id__").head(4)
+    conflicts = first.copy()
+    conflicts["tempo_programa_status"] = ["OK", "Sem data", "OK", None]
+    conflicts["grupos"] = "TP_20"
+    first_rows = first.assign(tempo_programa_status=["Sem data", "OK", None, "OK"], grupos="TP_03")
+    df = pd.concat([first_rows, df, conflicts], ignore_index=True)
+    _save_rounds(project_store, df)
+
+    for grupos in (None, ["TP_20"], ["TP_03"]):
+        cube_lives = results.load_cohort("P", "R1", grupos, None, cube=project_store.load_cube("P", "R1"))
+        rows_lives = results.load_cohort("P", "R2", grupos, None)
+        assert sorted(cube_lives["__id__"]) == sorted(rows_lives["__id__"])
+        expected = df.drop_duplicates("__id__")
+        expected = expected[expected["tempo_programa_status"].fillna("") == "OK"]
+        if grupos:
+            expected = expected[expected["grupos"].isin(grupos)]
+        assert sorted(rows_lives["__id__"]) == sorted(expected["__id__"])
+
+        args = ("dentro", False, 24, grupos, None, False)
+        (body_cube, _), _ = results.compute_results("P", "R1", None, *args)
+        (body_rows, _), _ = results.compute_results("P", "R2", None, *args)
+        _assert_same(json.loads(body_cube), json.loads(body_rows))
+
+
+def test_results_arrow_matches_json(project_store):
+    _save_rounds(project_store, _consolidated(np.random.default_rng(4)))
+    args = ("dentro", False, 24, ["TP_03"], None)
+    (body, _), _ = results.compute_results("P", "R1", None, *args, False)
+    (arrow_body, media_type), _ = results.compute_results("P", "R1", None, *args, True)
+    assert media_type == ARROW_STREAM
+
+    expected = json.loads(body)
+    meta, tables = read_arrow_ipc(arrow_body)
+    assert list(tables) == ["comparative", "timeline"]
+    assert tables["comparative"].to_pylist() == expected.pop("comparative")
+    timeline = expected["charts"].pop("timeline")
+    assert tables["timeline"].column("momento_mes").to_pylist() == timeline["x"]
+    assert tables["timeline"].column("custos").to_pylist() == timeline["y"]
+    assert json.loads(json.dumps(meta)) == expected
+
+
+def test_results_processing_without_outputs(project_store):
+    out, profile = results.compute_results("P", "R9", None, "dentro", False, 24, None, None, False)
+    assert out["status"] == "processing" and profile is None
@@ -235,8 +235,7 @@ export default function ProjectPage() {
         {/* --- ABA: PERFIL DA CARTEIRA --- */}
         {activeTab === "demographics" && (
             <DemographicsTab 
-                data={analysisData?.raw_data || []} 
-                refDate={analysisData?.meta?.ref_date} 
+                summary={analysisData?.demographics} 
             />
         )}
 
@@ -11,78 +11,59 @@ const COLORS_SEX = {
   "N/I": "#94a3b8" // Cinza (Não Informado)
 };
 
-const COLORS_AGE = ["#3b82f6", "#10b981", "#f59e0b", "#8b5cf6", "#ef4444"];
-
-export default function DemographicsTab({ data }: { data: any[] }) {
+// Agregados da coorte calculados no backend (campo "demographics" de /analysis/results)
+export interface DemographicSummary {
+  total_vidas: number;
+  tem_sexo: boolean;
+  tem_idade: boolean;
+  sexo: Record<string, number>;
+  faixa_etaria: Record<string, number>;
+  piramide: { faixa_etaria: string; sexo: string; vidas: number }[];
+  grupos: Record<string, number>;
+  idade: { media: number; vidas_com_idade: number; quantis: Record<string, number | null> };
+  tempo_programa: { media: number; histograma: number[] };
+}
+
+const AGE_ORDER = ["0-18", "19-23", "24-28", "29-33", "34-38", "39-43", "44-48", "49-53", "54-58", "59+", "N/I", "Sem Data"];
+
+export default function DemographicsTab({ summary }: { summary?: DemographicSummary | null }) {
   
   const stats = useMemo(() => {
-    if (!data || data.length === 0) return null;
-
-    // 1. Gênero
-    const sexCount: Record<string, number> = {};
-    let hasGenderData = false;
-
-    // 2. Faixa Etária
-    const ageCount: Record<string, number> = {};
-    let hasAgeData = false;
-
-    // 3. Tempo de Programa
-    const tpCount: Record<string, number> = {};
-
-    let totalAge = 0;
-    let countAge = 0;
-    let totalTp = 0;
-    let countTp = 0;
-
-    data.forEach(row => {
-      // Sexo
-      let s = "N/I";
-      if (row.sexo && row.sexo !== "N/I") {
-        s = row.sexo.charAt(0).toUpperCase(); // M ou F
-        hasGenderData = true;
-      }
-      sexCount[s] = (sexCount[s] || 0) + 1;
-
-      // Faixa Etária
-      const f = row.faixa_etaria || "N/I";
-      if (f !== "N/I" && f !== "Sem Data") hasAgeData = true;
-      ageCount[f] = (ageCount[f] || 0) + 1;
-
-      // Médias
-      if (row.idade > 0) { totalAge += row.idade; countAge++; }
-      if (row.tempo_programa >= 0) { totalTp += row.tempo_programa; countTp++; }
-
-      // Grupos TP
-      const g = row.grupos || "N/I";
-      tpCount[g] = (tpCount[g] || 0) + 1;
-    });
+    if (!summary || summary.total_vidas === 0) return null;
 
     // Formata Sexo
-    const sexData = Object.keys(sexCount).map(k => ({ 
+    const sexData = Object.keys(summary.sexo).map(k => ({ 
       name: k === 'M' ? 'Masculino' : k === 'F' ? 'Feminino' : 'Não Informado', 
       key: k,
-      value: sexCount[k] 
+      value: summary.sexo[k] 
     }));
 
-    // Formata Idade (Ordenado)
-    const ageOrder = ["0-18", "19-23", "24-28", "29-33", "34-38", "39-43", "44-48", "49-53", "54-58", "59+", "N/I", "Sem Data"];
-    const ageData = ageOrder
-      .filter(k => ageCount[k] > 0)
-      .map(k => ({ name: k, value: ageCount[k] }));
-
-    // Formata TP (Ordenado para o gráfico horizontal)
-    const tpData = Object.keys(tpCount)
-      .sort()
-      .map(k => ({ name: k, value: tpCount[k] }));
+    // Pirâmide: faixa etária (ordenada) com uma barra empilhada por sexo
+    const sexKeys = sexData.map(s => s.key);
+    const ageData = AGE_ORDER
+      .filter(k => (summary.faixa_etaria[k] || 0) > 0)
+      .map(k => {
+        const row: Record<string, string | number> = { name: k, value: summary.faixa_etaria[k] };
+        sexKeys.forEach(s => { row[s] = 0; });
+        summary.piramide
+          .filter(p => p.faixa_etaria === k)
+          .forEach(p => { row[p.sexo] = p.vidas; });
+        return row;
+      });
+
+    // Formata TP (já vem ordenado do backend)
+    const tpData = Object.keys(summary.grupos).map(k => ({ name: k, value: summary.grupos[k] }));
 
     return { 
-      sexData, hasGenderData,
-      ageData, hasAgeData,
+      sexData, sexKeys, hasGenderData: summary.tem_sexo,
+      ageData, hasAgeData: summary.tem_idade,
       tpData, 
-      avgAge: countAge ? Math.round(totalAge / countAge) : 0,
-      avgTp: countTp ? Math.round(totalTp / countTp) : 0
+      total: summary.total_vidas,
+      avgAge: summary.idade.media,
+      medianAge: summary.idade.quantis?.p50,
+      avgTp: summary.tempo_programa.media
     };
-  }, [data]);
+  }, [summary]);
 
   if (!stats) return <div className="p-10 text-center text-slate-400">Carregando perfil...</div>;
 
@@ -97,7 +78,7 @@ export default function DemographicsTab({ data }: { data: any[] }) {
           </div>
           <div>
             <p className="text-xs text-slate-500 font-bold uppercase tracking-wider">Amostra Total</p>
-            <h3 className="text-2xl font-black text-slate-800 dark:text-white">{data.length} <span className="text-sm font-normal text-slate-400">vidas</span></h3>
+            <h3 className="text-2xl font-black text-slate-800 dark:text-white">{stats.total} <span className="text-sm font-normal text-slate-400">vidas</span></h3>
           </div>
         </div>
         <div className="bg-white dark:bg-slate-800 p-6 rounded-xl border border-slate-200 dark:border-slate-700 shadow-sm flex items-center gap-4">
@@ -107,6 +88,9 @@ export default function DemographicsTab({ data }: { data: any[] }) {
           <div>
             <p className="text-xs text-slate-500 font-bold uppercase tracking-wider">Idade Média</p>
             <h3 className="text-2xl font-black text-slate-800 dark:text-white">{stats.avgAge} <span className="text-sm font-normal text-slate-400">anos</span></h3>
+            {stats.medianAge != null && (
+              <p className="text-xs text-slate-400">mediana {Math.round(stats.medianAge)} anos</p>
+            )}
           </div>
         </div>
         <div className="bg-white dark:bg-slate-800 p-6 rounded-xl border border-slate-200 dark:border-slate-700 shadow-sm flex items-center gap-4">
@@ -174,11 +158,16 @@ export default function DemographicsTab({ data }: { data: any[] }) {
                 <XAxis dataKey="name" axisLine={false} tickLine={false} tick={{fill: '#64748b', fontSize: 10}} interval={0} />
                 <YAxis axisLine={false} tickLine={false} tick={{fill: '#64748b', fontSize: 12}} />
                 <RechartsTooltip cursor={{fill: '#f1f5f9'}} />
-                <Bar dataKey="value" radius={[4, 4, 0, 0]}>
-                  {stats.ageData.map((entry, index) => (
-                    <Cell key={`cell-${index}`} fill={COLORS_AGE[index % COLORS_AGE.length]} />
-                  ))}
-                </Bar>
+                <Legend verticalAlign="bottom" height={36} iconType="circle" />
+                {stats.sexKeys.map((key, index) => (
+                  <Bar
+                    key={key}
+                    dataKey={key}
+                    name={stats.sexData[index].name}
+                    stackId="sexo"
+                    fill={COLORS_SEX[key as keyof typeof COLORS_SEX] || COLORS_SEX["N/I"]}
+                  />
+                ))}
               </BarChart>
             </ResponsiveContainer>
           </div>
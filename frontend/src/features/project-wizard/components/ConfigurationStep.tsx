@@ -1,6 +1,7 @@
 "use client";
 import React, { useState, useMemo } from "react";
 import { ArrowLeft, Play, Calendar, Link2, Calculator, Table as TableIcon, Download, Search, Maximize2, Minimize2 } from "lucide-react";
+import { DOWNLOAD_FORMATS, type DownloadFormat } from "../hooks/useProjectWizard";
 
 interface ConfigurationStepProps {
   benefCols: string[];
@@ -18,7 +19,7 @@ interface ConfigurationStepProps {
   isLoading: boolean;
   onPreview: () => void;
   previewData: { data: any[], ref_calculada: string } | null;
-  onDownload: () => void;
+  onDownload: (format: DownloadFormat) => void;
 }
 
 export default function ConfigurationStep({
@@ -32,6 +33,7 @@ export default function ConfigurationStep({
   // --- NOVOS ESTADOS PARA AS FUNCIONALIDADES DA TABELA ---
   const [searchTerm, setSearchTerm] = useState("");
   const [isExpanded, setIsExpanded] = useState(false);
+  const [downloadFormat, setDownloadFormat] = useState<DownloadFormat>("xlsx");
 
   // Formata data
   const formatDisplayDate = (isoDate: string) => {
@@ -162,11 +164,21 @@ export default function ConfigurationStep({
                       />
                     </div>
                     
-                    {/* BOTÃO DE DOWNLOAD (CHAMA A FUNÇÃO DO BACKEND) */}
+                    {/* DOWNLOAD DA BASE COMPLETA (FORMATO + BOTÃO QUE CHAMA O BACKEND) */}
+                    <select
+                      value={downloadFormat}
+                      onChange={(e) => setDownloadFormat(e.target.value as DownloadFormat)}
+                      className="py-1.5 px-2 text-sm border border-slate-300 rounded-lg bg-white text-slate-700 focus:ring-2 focus:ring-blue-500 outline-none"
+                      title="Formato do download"
+                    >
+                      {DOWNLOAD_FORMATS.map(f => (
+                        <option key={f.value} value={f.value}>{f.label}</option>
+                      ))}
+                    </select>
                     <button 
-                      onClick={onDownload}
+                      onClick={() => onDownload(downloadFormat)}
                       className="p-2 bg-white border border-slate-300 text-slate-700 hover:bg-slate-50 rounded-lg transition-colors"
-                      title="Baixar Excel Completo (.xlsx)"
+                      title={`Baixar base completa (${DOWNLOAD_FORMATS.find(f => f.value === downloadFormat)?.label})`}
                     >
                       <Download size={16} />
                     </button>
@@ -3,6 +3,21 @@ import { toast } from "sonner";
 import { apiClient } from "@/core/api/client";
 import { useRouter } from "next/navigation";
 
+// Formatos aceitos pela rota de download da base completa (?format=)
+export type DownloadFormat = "xlsx" | "csv" | "parquet";
+
+export const DOWNLOAD_FORMATS: { value: DownloadFormat; label: string }[] = [
+  { value: "xlsx", label: "Excel (.xlsx)" },
+  { value: "csv", label: "CSV (.csv)" },
+  { value: "parquet", label: "Parquet (.parquet)" },
+];
+
+// Nome do arquivo vindo do Content-Disposition da resposta (com fallback)
+const filenameFromDisposition = (disposition: string | undefined, fallback: string) => {
+  const match = disposition?.match(/filename="?([^";]+)"?/i);
+  return match ? match[1] : fallback;
+};
+
 export const useProjectWizard = () => {
   const router = useRouter();
   const [currentStep, setCurrentStep] = useState(1);
@@ -182,8 +197,18 @@ export const useProjectWizard = () => {
         }
       };
 
-      await apiClient.post(`/analysis/run/${projectId}/R1`, payload);
-      
+      // O processamento roda em background: enfileira e acompanha o job até terminar
+      const { data: submitted } = await apiClient.post(`/analysis/run/${projectId}/R1`, payload);
+      const toastId = toast.loading("Processando análise...");
+      let job = submitted;
+      while (!["done", "failed", "cancelled"].includes(job.status)) {
+        await new Promise((resolve) => setTimeout(resolve, 1500));
+        ({ data: job } = await apiClient.get(`/analysis/jobs/${submitted.job_id}`));
+        if (job.stage) toast.loading(`Processando análise (${job.stage})...`, { id: toastId });
+      }
+      toast.dismiss(toastId);
+      if (job.status !== "done") throw new Error(job.error || "Processamento não concluído.");
+
       toast.success("Processamento concluído!");
       router.push(`/dashboard/${projectId}`);
       
@@ -232,10 +257,11 @@ export const useProjectWizard = () => {
     }
   };
 
-  // FUNÇÃO: DOWNLOAD EXCEL ---
-  const handleDownloadFullPreview = async () => {
+  // FUNÇÃO: DOWNLOAD DA BASE COMPLETA (xlsx, csv ou parquet) ---
+  const handleDownloadFullPreview = async (format: DownloadFormat = "xlsx") => {
     if (!projectId) return;
-    const toastId = toast.loading("Gerando Excel completo (isso pode levar alguns segundos)...");
+    const label = DOWNLOAD_FORMATS.find(f => f.value === format)?.label ?? format;
+    const toastId = toast.loading(`Gerando ${label} completo (isso pode levar alguns segundos)...`);
     
     try {
       const prepareMapping = (map: any, id: string) => {
@@ -254,13 +280,14 @@ export const useProjectWizard = () => {
 
       // Chama a rota de download com Blob
       const response = await apiClient.post(`/analysis/download_preview/${projectId}/R1`, payload, {
+        params: { format },
         responseType: 'blob'
       });
       
       const url = window.URL.createObjectURL(new Blob([response.data]));
       const link = document.createElement('a');
       link.href = url;
-      link.setAttribute('download', 'base_calculada_completa.xlsx');
+      link.setAttribute('download', filenameFromDisposition(response.headers['content-disposition'], `base_calculada_completa.${format}`));
       document.body.appendChild(link);
       link.click();
       link.remove();
@@ -271,7 +298,7 @@ export const useProjectWizard = () => {
     } catch (e) {
       console.error(e);
       toast.dismiss(toastId);
-      toast.error("Erro ao gerar Excel.");
+      toast.error("Erro ao gerar o arquivo.");
     }
   };
 